@@ -657,6 +657,89 @@ try:
         'A62': 'Cancel change consulting doctor'
     }
 
+    # Lazy structure nodes (from src/parser/structure.py)
+    from collections.abc import Mapping
+
+    class StructureNode(Mapping):
+        """A node of the message structure with lazily built children."""
+        
+        __slots__ = ('name', 'raw_name', 'value', '_description', '_children', '_has_children')
+        KEYS = ('name', 'raw_name', 'description', 'value', 'children')
+        
+        def __init__(self, name, raw_name=None, description="", value=None, children=None, has_children=None):
+            self.name = name
+            self.raw_name = name if raw_name is None else raw_name
+            self.value = value
+            self._description = description
+            self._children = children
+            self._has_children = has_children
+            
+        @property
+        def description(self):
+            if callable(self._description):
+                self._description = self._description()
+            return self._description
+            
+        @property
+        def children(self):
+            if self._children is None:
+                self._children = []
+            elif callable(self._children):
+                self._children = self._children()
+            return self._children
+            
+        @property
+        def has_children(self):
+            """True if the node has children, without building them if possible"""
+            if self._has_children is not None and callable(self._children):
+                return self._has_children
+            return bool(self.children)
+            
+        def __getitem__(self, key):
+            if key in self.KEYS:
+                return getattr(self, key)
+            raise KeyError(key)
+            
+        def __iter__(self):
+            return iter(self.KEYS)
+            
+        def __len__(self):
+            return len(self.KEYS)
+
+    # MSH-18 character sets (from src/parser/charsets.py)
+    import codecs
+    import re
+    HL7_CHARSETS = {
+        'ASCII': 'ascii',
+        '8859/1': 'latin-1',
+        '8859/2': 'iso8859-2',
+        '8859/5': 'iso8859-5',
+        '8859/7': 'iso8859-7',
+        '8859/9': 'iso8859-9',
+        '8859/15': 'iso8859-15',
+        'UNICODE': 'utf-8',
+        'UNICODE UTF-8': 'utf-8',
+        'GB 18030-2000': 'gb18030',
+        'KS X 1001': 'euc_kr',
+        'BIG-5': 'big5',
+    }
+
+    def decode_hl7_bytes(data):
+        """Decode a raw HL7 message with the character set named in MSH-18."""
+        for bom, codec in ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF32_LE, 'utf-32'),
+                           (codecs.BOM_UTF32_BE, 'utf-32'), (codecs.BOM_UTF16_LE, 'utf-16'),
+                           (codecs.BOM_UTF16_BE, 'utf-16')):
+            if data.startswith(bom):
+                return data.decode(codec, 'replace')
+        charset = ''
+        header = data.split(b'\r', 1)[0].split(b'\n', 1)[0]
+        if header.startswith(b'MSH') and len(header) > 4:
+            fields = header.split(header[3:4])
+            if len(fields) >= 18:
+                charset = fields[17].split(header[5:6] or b'~')[0].decode('ascii', 'replace').strip().upper()
+        return data.decode(HL7_CHARSETS.get(charset, 'utf-8'), 'replace')
+
+
     # HL7 Parser implementation (from src/parser/hl7_parser.py)
     class HL7Parser:
         """Parser for HL7 messages."""
@@ -666,6 +749,12 @@ try:
             self.message_text = ""
             self.segments = []
             self.raw_message = None
+            self.field_separator = "|"
+            self.component_separator = "^"
+            self.repetition_separator = "~"
+            self.subcomponent_separator = "&"
+            self.escape_character = "\\"
+            self._escape_pattern = None
             
         def parse_text(self, message_text):
             """Parse an HL7 message from text input."""
@@ -673,11 +762,15 @@ try:
             self.raw_message = message_text
             return self.parse_message(message_text)
             
+        def read_file(self, file_path):
+            """Read an HL7 file, decoding it with the charset named in MSH-18."""
+            with open(file_path, 'rb') as f:
+                return decode_hl7_bytes(f.read())
+
         def parse_file(self, file_path):
             """Parse an HL7 message from file path."""
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read().strip()
+                content = self.read_file(file_path).strip()
                 return self.parse_message(content)
             except Exception as e:
                 raise ValueError(f"Failed to read or parse file: {str(e)}")
@@ -690,6 +783,16 @@ try:
             # Split the message into segments (lines)
             lines = message_text.strip().splitlines()
             
+            # Read the delimiters declared in MSH-1/MSH-2 (defaults: |^~\&)
+            (self.field_separator, self.component_separator, self.repetition_separator,
+             self.escape_character, self.subcomponent_separator) = \
+                self._read_delimiters(lines[0].strip() if lines else "")
+            field_separator = self.field_separator
+            
+            # \F\ \S\ \T\ \R\ \E\ and \Xhh..\ written with the declared escape character
+            esc = re.escape(self.escape_character)
+            self._escape_pattern = re.compile(f'{esc}(F|S|T|R|E|X(?:[0-9A-Fa-f]{{2}})+){esc}')
+            
             for line in lines:
                 line = line.strip()
                 if not line:
@@ -700,37 +803,27 @@ try:
                 
                 # Extract fields
                 fields = []
-                if "|" in line:
-                    # Split by pipe character
-                    parts = line.split("|")
+                if field_separator in line:
+                    # Split by the field separator
+                    parts = line.split(field_separator)
                     
                     # Special handling for MSH segment
                     if segment_name == "MSH":
-                        # MSH-1 is the field separator character (|)
-                        fields.append({
-                            "value": "|",
-                            "components": [{
-                                "value": "|",
-                                "subcomponents": []
-                            }]
-                        })
+                        # MSH-1 is the field separator character itself
+                        fields.append({"value": field_separator, "literal": True})
+                        
+                        # MSH-2 holds the encoding characters and is never split
+                        if len(parts) > 1:
+                            fields.append({"value": parts[1], "literal": True})
                         
                         # Process the remaining fields with proper indexing
-                        for i, part in enumerate(parts):
-                            # Skip the segment name (already handled)
-                            if i == 0:
-                                continue
-                                
-                            # Add the field with components
-                            self._add_field_with_components(fields, part)
+                        for part in parts[2:]:
+                            fields.append({"value": part})
                     else:
-                        # For non-MSH segments, first part is segment name, skip it
-                        for i, part in enumerate(parts):
-                            if i == 0:
-                                continue
-                                
-                            # Add the field with components
-                            self._add_field_with_components(fields, part)
+                        # For non-MSH segments, first part is segment name, skip it.
+                        # Repetitions and components are split when a node is expanded.
+                        for part in parts[1:]:
+                            fields.append({"value": part})
                 
                 # Add segment to the list
                 self.segments.append({
@@ -741,88 +834,79 @@ try:
             
             return self.segments
             
-        def _add_field_with_components(self, fields, field_value):
-            """Helper method to add a field with its components to the fields list."""
-            components = []
-            if "^" in field_value:
-                # Split by caret for components
-                comp_parts = field_value.split("^")
-                for comp in comp_parts:
-                    # Handle subcomponents
-                    if "&" in comp:
-                        subcomps = comp.split("&")
-                        components.append({
-                            "value": comp,
-                            "subcomponents": subcomps
-                        })
-                    else:
-                        components.append({
-                            "value": comp,
-                            "subcomponents": []
-                        })
-            else:
-                # No components, just the field
-                components.append({
-                    "value": field_value,
-                    "subcomponents": []
-                })
-            
-            fields.append({
-                "value": field_value,
-                "components": components
-            })
+        def _read_delimiters(self, msh_line):
+            """Return the field, component, repetition, escape and subcomponent characters from MSH."""
+            if not msh_line.startswith("MSH") or len(msh_line) < 6:
+                return "|", "^", "~", "\\", "&"
+            field_separator = msh_line[3]
+            encoding_chars = msh_line[4:].split(field_separator, 1)[0]
+            component_separator = encoding_chars[0] if len(encoding_chars) > 0 else "^"
+            repetition_separator = encoding_chars[1] if len(encoding_chars) > 1 else "~"
+            escape_character = encoding_chars[2] if len(encoding_chars) > 2 else "\\"
+            subcomponent_separator = encoding_chars[3] if len(encoding_chars) > 3 else "&"
+            return field_separator, component_separator, repetition_separator, escape_character, subcomponent_separator
+            
+        def _unescape(self, value):
+            """Decode the escape sequences of a leaf value (from src/parser/encoding.py)."""
+            if self._escape_pattern is None or self.escape_character not in value:
+                return value
+            return self._escape_pattern.sub(self._replace_escape, value)
+            
+        def _replace_escape(self, match):
+            code = match.group(1)
+            if code[0] == 'X':
+                return bytes.fromhex(code[1:]).decode('latin-1')
+            return {
+                'F': self.field_separator,
+                'S': self.component_separator,
+                'T': self.subcomponent_separator,
+                'R': self.repetition_separator,
+                'E': self.escape_character,
+            }[code]
+            
+        def _is_composite(self, field):
+            """Check whether a field has repetitions, components or subcomponents."""
+            if field.get("literal"):
+                return False
+            value = field["value"]
+            return (self.repetition_separator in value or self.component_separator in value
+                    or self.subcomponent_separator in value)
         
         def get_structure(self):
-            """Return hierarchical structure of the parsed message."""
+            """Return hierarchical structure of the parsed message.
+            
+            Segment, field and component nodes are only built when their
+            parent's children are first read (see StructureNode).
+            """
             if not self.segments:
                 return None
                 
             # Create the message structure
-            result = {
-                'name': 'Message',
-                'value': "",  # No value for the root element
-                'description': "HL7 Message",
-                'children': []
-            }
-            
-            # Add segments as children
-            for segment in self.segments:
-                segment_node = self._create_segment_node(segment)
-                result['children'].append(segment_node)
-                
-            return result
+            return StructureNode(
+                'Message',
+                value="",  # No value for the root element
+                description="HL7 Message",
+                children=lambda: [self._create_segment_node(segment) for segment in self.segments],
+                has_children=True
+            )
             
         def _create_segment_node(self, segment):
-            """Create a segment node with its fields."""
+            """Create a segment node whose fields are built on first access."""
             segment_name = segment['name']
             
-            # Get segment description
-            description = HL7_SEGMENTS.get(segment_name, f"Unknown Segment ({segment_name})")
-            
-            segment_node = {
-                'name': segment_name,
-                'value': segment['content'],
-                'description': description,
-                'children': []
-            }
-            
-            # Add fields as children
-            for i, field in enumerate(segment['fields']):
+            return StructureNode(
+                segment_name,
+                value=segment['content'],
+                # Get segment description
+                description=lambda: HL7_SEGMENTS.get(segment_name, f"Unknown Segment ({segment_name})"),
                 # Get the correct field number (MSH segment is special)
-                field_num = str(i+1)
-                
-                # Create field node
-                field_node = self._create_field_node(segment_name, field_num, field)
-                segment_node['children'].append(field_node)
-                
-            return segment_node
-            
-        def _create_field_node(self, segment_name, field_num, field):
-            """Create a field node with its components."""
-            # Format field name as 'MSH-1', 'PID-3', etc.
-            field_name = f"{segment_name}-{field_num}"
+                children=lambda: [self._create_field_node(segment_name, str(i + 1), field)
+                                  for i, field in enumerate(segment['fields'])],
+                has_children=bool(segment['fields'])
+            )
             
-            # Get field description
+        def _describe_field(self, segment_name, field_num, field):
+            """Look up the description of a field."""
             description = ""
             if segment_name in HL7_FIELDS and field_num in HL7_FIELDS[segment_name]:
                 description = HL7_FIELDS[segment_name][field_num]
@@ -830,46 +914,78 @@ try:
                 description = f"Field {field_num}"
                 
             # Special handling for MSH-9 (Message Type) field
-            if segment_name == 'MSH' and field_num == '9' and "^" in field["value"]:
+            if segment_name == 'MSH' and field_num == '9' and self.component_separator in field["value"]:
                 # Try to extract the message type and trigger event
-                parts = field["value"].split("^")
+                parts = field["value"].split(self.component_separator)
                 if len(parts) >= 2 and parts[0] == "ADT":
                     event_code = parts[1]
                     if event_code in ADT_CODES:
                         description += f" - {ADT_CODES[event_code]}"
+            return description
             
-            field_node = {
-                'name': field_name,
-                'value': field['value'],
-                'description': description,
-                'children': []
-            }
-            
-            # Add components as children
-            for j, component in enumerate(field['components']):
-                comp_name = f"{field_name}.{j+1}"
-                comp_node = {
-                    'name': comp_name,
-                    'value': component['value'],
-                    'description': f"Component {j+1}",
-                    'children': []
-                }
-                
-                # Add subcomponents
-                for k, subcomp in enumerate(component['subcomponents']):
-                    if k > 0:  # Skip first subcomponent (already included in component)
-                        subcomp_name = f"{comp_name}.{k+1}"
-                        subcomp_node = {
-                            'name': subcomp_name,
-                            'value': subcomp,
-                            'description': f"Subcomponent {k+1}",
-                            'children': []
-                        }
-                        comp_node['children'].append(subcomp_node)
+        def _create_field_node(self, segment_name, field_num, field):
+            """Create a field node whose components are built on first access."""
+            # Format field name as 'MSH-1', 'PID-3', etc.
+            field_name = f"{segment_name}-{field_num}"
+            composite = self._is_composite(field)
+            
+            return StructureNode(
+                field_name,
+                # Leaf values are shown with escape sequences decoded; MSH-1
+                # and MSH-2 are the delimiters themselves
+                value=field['value'] if composite or field.get("literal") else self._unescape(field['value']),
+                description=lambda: self._describe_field(segment_name, field_num, field),
+                children=lambda: self._create_field_children(field_name, field),
+                has_children=composite
+            )
+            
+        def _create_field_children(self, field_name, field):
+            """Create repetition nodes, or the components of a single repetition."""
+            repetitions = field['value'].split(self.repetition_separator)
+            if len(repetitions) == 1:
+                return self._create_component_nodes(field_name, field['value'])
+            
+            nodes = []
+            for r, repetition in enumerate(repetitions):
+                # Format repetition name as 'PID-3[2]'
+                rep_name = f"{field_name}[{r+1}]"
+                composite = (self.component_separator in repetition
+                             or self.subcomponent_separator in repetition)
+                nodes.append(StructureNode(
+                    rep_name,
+                    value=repetition if composite else self._unescape(repetition),
+                    description=f"Repetition {r+1}",
+                    # Each repeat is only split into components when expanded
+                    children=lambda rep_name=rep_name, repetition=repetition:
+                        self._create_component_nodes(rep_name, repetition),
+                    has_children=composite
+                ))
+            return nodes
+            
+        def _create_component_nodes(self, parent_name, value):
+            """Create the component nodes of one field repetition."""
+            nodes = []
+            for j, component in enumerate(value.split(self.component_separator)):
+                comp_name = f"{parent_name}.{j+1}"
                 
-                field_node['children'].append(comp_node)
+                # Add subcomponents when there is more than one
+                subcomp_nodes = []
+                subcomps = component.split(self.subcomponent_separator)
+                if len(subcomps) > 1:
+                    for k, subcomp in enumerate(subcomps):
+                        subcomp_nodes.append(StructureNode(
+                            f"{comp_name}.{k+1}",
+                            value=self._unescape(subcomp),
+                            description=f"Subcomponent {k+1}"
+                        ))
                 
-            return field_node
+                nodes.append(StructureNode(
+                    comp_name,
+                    value=component if subcomp_nodes else self._unescape(component),
+                    description=f"Component {j+1}",
+                    children=subcomp_nodes
+                ))
+            return nodes
             
         @property
         def message(self):
@@ -879,6 +995,9 @@ try:
     class HL7TreeModel(QStandardItemModel):
         """Tree model for displaying HL7 message structure."""
         
+        # Item data role holding a node whose children are not built yet
+        LAZY_NODE_ROLE = Qt.ItemDataRole.UserRole + 1
+        
         def __init__(self, parent=None):
             super().__init__(parent)
             self.setHorizontalHeaderLabels(["Element", "Description", "Value"])
@@ -894,7 +1013,7 @@ try:
             self.setHorizontalHeaderLabels(["Element", "Description", "Value"])
             
             # Get the message structure
-            if not isinstance(message_structure, dict):
+            if not isinstance(message_structure, Mapping):
                 # If not a dict, assume it's segments and return
                 print("Error: Expected message structure but received:", type(message_structure))
                 return
@@ -913,7 +1032,7 @@ try:
             self._populate_children(root_item, structure['children'])
             
         def _populate_children(self, parent_item, children):
-            """Recursively populate the tree with children items."""
+            """Add rows for children; their own children wait until expanded."""
             for child in children:
                 # Create items for this child
                 name_item = QStandardItem(child['name'])
@@ -923,9 +1042,20 @@ try:
                 # Add this child to its parent
                 parent_item.appendRow([name_item, desc_item, value_item])
                 
-                # Process this child's children recursively
-                if child['children']:
-                    self._populate_children(name_item, child['children'])
+                # Defer this child's children until the row is expanded
+                if child.has_children:
+                    name_item.setData(child, self.LAZY_NODE_ROLE)
+                    name_item.appendRow([QStandardItem(), QStandardItem(), QStandardItem()])
+                    
+        def populate_on_expand(self, index):
+            """Replace the placeholder row of an expanded item with its children."""
+            item = self.itemFromIndex(index.siblingAtColumn(0))
+            node = item.data(self.LAZY_NODE_ROLE) if item is not None else None
+            if node is None:
+                return
+            item.setData(None, self.LAZY_NODE_ROLE)
+            item.removeRows(0, item.rowCount())
+            self._populate_children(item, node['children'])
 
     # Main application window (from src/gui/main_window.py)
     class MainWindow(QMainWindow):
@@ -1017,6 +1147,7 @@ try:
             # Tree model
             self.tree_model = HL7TreeModel()
             self.tree_view.setModel(self.tree_model)
+            self.tree_view.expanded.connect(self.tree_model.populate_on_expand)
             
             # Copy button
             copy_button = QPushButton("Copy Selected Value")
@@ -1082,9 +1213,8 @@ try:
                     self.parser.parse_file(file_path)
                     
                     # Update the text area with the file contents
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        message_text = f.read()
-                        self.input_text.setPlainText(message_text)
+                    message_text = self.parser.read_file(file_path)
+                    self.input_text.setPlainText(message_text)
                     
                     # Get the structure and populate the tree model
                     structure = self.parser.get_structure()
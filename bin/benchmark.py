@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+HL7 Parser - Throughput benchmark
+Generates a synthetic 1,000-segment ORU^R01 message and reports how many
+messages per second each parsing engine handles.
+"""
+import sys
+import time
+import argparse
+import statistics
+import tracemalloc
+from pathlib import Path
+
+# Make the src package importable when run from a checkout
+sys.path.insert(0, str(Path(__file__).parent.parent.absolute()))
+
+from src.parser.hl7_parser import HL7Parser
+
+# Documented target for the native engine on the 1,000-segment ORU
+NATIVE_TARGET_MSGS_PER_SEC = 100
+
+
+def build_oru(segment_count=1000):
+    """Build an ORU^R01 message with the given total number of segments"""
+    segments = [
+        "MSH|^~\\&|LAB|HOSP|EHR|HOSP|20230101120000||ORU^R01|MSG00001|P|2.5.1",
+        "PID|1||12345^^^HOSP^MR~67890^^^STATE^SS||DOE^JOHN^A||19700101|M",
+        "OBR|1|ORD123|FIL456|CBC^Complete Blood Count^LN|||20230101110000",
+    ]
+    index = 1
+    while len(segments) < segment_count:
+        segments.append(
+            f"OBX|{index}|NM|718-7^Hemoglobin^LN||13.{index % 10}|g/dL^grams per deciliter^UCUM"
+            f"|12.0-16.0|N|||F|||20230101113000|LAB&Main Lab&L")
+        index += 1
+    return "\r".join(segments)
+
+
+def measure(label, func, repeat, runs=1):
+    """Time runs batches of repeat calls to func and print the median messages per second.
+
+    One untimed call first warms up caches and lazily built tables, so the
+    first batch is not slowed by them.
+    """
+    func()
+    rates = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        elapsed = time.perf_counter() - start
+        rates.append(repeat / elapsed if elapsed else float('inf'))
+    rate = statistics.median(rates)
+    spread = f", {min(rates):.1f}-{max(rates):.1f} over {runs} runs" if runs > 1 else ""
+    print(f"{label:<32} {rate:>10.1f} msgs/sec  ({1000 / rate:.2f} ms/msg{spread})")
+    return rate
+
+
+def first_field(parser, text):
+    """Report time and peak memory to reach the first OBX-5 through get_structure"""
+    def read_first_obx_5():
+        parser.parse_text(text)
+        structure = parser.get_structure()
+        obx = next(node for node in structure['children'] if node['raw_name'] == 'OBX')
+        return obx['children'][4]['value']
+
+    start = time.perf_counter()
+    read_first_obx_5()
+    elapsed = time.perf_counter() - start
+
+    # Measure memory separately; tracemalloc slows allocation down a lot
+    tracemalloc.start()
+    read_first_obx_5()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{'time to first OBX-5':<32} {elapsed * 1000:>10.2f} ms  (peak {peak / 1024:.0f} KiB)")
+
+
+# Typical integration extract: a handful of header, patient and result fields
+EXTRACT_PATHS = (
+    "MSH-7", "MSH-9.1", "MSH-9.2", "MSH-10", "MSH-12", "PID-3.1", "PID-3[*].1", "PID-5.1",
+    "PID-5.2", "PID-7", "PID-8", "OBR-4.1", "OBR-7", "OBX[*]-3.1", "OBX[*]-5",
+)
+
+
+# Projection covering the header fields of EXTRACT_PATHS
+HEADER_PROJECTION = {"MSH": [7, 9, 10, 12], "PID": [3, 5, 7, 8], "OBR": [4, 7]}
+
+
+def extract_fields(parser, text):
+    """Parse and pull EXTRACT_PATHS with path queries"""
+    parser.parse_text(text)
+    message = parser.message
+    return [message.get(path) for path in EXTRACT_PATHS]
+
+
+def bytes_per_field(parser, text):
+    """Report memory per field for the compact message and for nested dicts"""
+    parser.parse_text(text)
+    message = parser.message
+    field_count = len(message.tokens.field_start)
+    print(f"{'compact message':<32} {message.nbytes() / field_count:>10.1f} bytes/field  ({field_count} fields)")
+
+    # The same message fully materialized as the nested dicts of old
+    tracemalloc.start()
+    tree = parser.get_structure().to_dict()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{'nested dict structure':<32} {size / field_count:>10.1f} bytes/field")
+    return tree
+
+
+def main():
+    """Run the benchmark suite."""
+    arg_parser = argparse.ArgumentParser(description="HL7 Parser throughput benchmark")
+    arg_parser.add_argument("--segments", type=int, default=1000, help="Segments per message")
+    arg_parser.add_argument("--repeat", type=int, default=50, help="Messages to parse per timed run")
+    arg_parser.add_argument("--runs", type=int, default=5, help="Timed runs per measurement; the median is reported")
+    arg_parser.add_argument("--hl7apy", action="store_true", help="Also benchmark the hl7apy engine")
+    args = arg_parser.parse_args()
+    if args.repeat < 1 or args.runs < 1:
+        arg_parser.error("--repeat and --runs must be positive")
+
+    text = build_oru(args.segments)
+    print(f"ORU^R01 with {args.segments} segments, {len(text)} characters")
+
+    native = HL7Parser()
+    rate = measure("native parse_text", lambda: native.parse_text(text), args.repeat, args.runs)
+    data = text.encode("utf-8")
+    measure("native parse_bytes", lambda: native.parse_bytes(data), args.repeat, args.runs)
+    measure("native parse + get_structure",
+            lambda: (native.parse_text(text), native.get_structure()), args.repeat, args.runs)
+
+    measure(f"native parse + {len(EXTRACT_PATHS)} path gets",
+            lambda: extract_fields(native, text), args.repeat, args.runs)
+    projected = HL7Parser(projection=HEADER_PROJECTION)
+    measure("projected parse (headers only)", lambda: projected.parse_text(text), args.repeat, args.runs)
+
+    first_field(native, text)
+    bytes_per_field(native, text)
+
+    if args.hl7apy:
+        validating = HL7Parser(engine="hl7apy")
+        measure("hl7apy parse_text", lambda: validating.parse_text(text), max(1, args.repeat // 10))
+
+    if args.segments == 1000:
+        status = "OK" if rate >= NATIVE_TARGET_MSGS_PER_SEC else "BELOW TARGET"
+        print(f"Target: {NATIVE_TARGET_MSGS_PER_SEC} msgs/sec (median) for native parse_text - {status}")
+
+
+if __name__ == "__main__":
+    main()
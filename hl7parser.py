@@ -6,12 +6,26 @@ It detects the platform and runs the appropriate platform-specific script.
 """
 import os
 import sys
+import argparse
+import json
 import platform
 import subprocess
 from pathlib import Path
 
 def main():
     """Run the appropriate script based on the operating system."""
+    # Headless commands write their results to stdout, so no banner
+    if len(sys.argv) > 1 and sys.argv[1].lower() in ("parse-dir", "parse-files"):
+        sys.exit(run_batch(sys.argv[1].lower(), sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "mllp-server":
+        sys.exit(run_mllp_server(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "mllp-send":
+        sys.exit(run_mllp_send(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "serve":
+        sys.exit(run_service(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "parse":
+        sys.exit(run_parse(sys.argv[2:]))
+
     print("HL7 Parser")
     print("==========")
     
@@ -55,6 +69,234 @@ def run_script(script_path):
         
     return subprocess.call([sys.executable, str(script_path)]) == 0
 
+def run_batch(cmd, args):
+    """Parse a directory or a list of HL7 files on all cores."""
+    # Imported here so the GUI commands do not load the parser
+    from src.parser.batch import (parse_files, parse_partitioned, find_files, DEFAULT_FIELDS,
+                                  DEFAULT_TASK_SIZE, OUTPUT_FORMATS)
+
+    arg_parser = argparse.ArgumentParser(prog=f"hl7parser.py {cmd}")
+    if cmd == "parse-dir":
+        arg_parser.add_argument("directory", help="directory holding the HL7 files")
+        arg_parser.add_argument("--pattern", default="*.hl7", help="file name pattern (default: *.hl7)")
+        arg_parser.add_argument("-r", "--recursive", action="store_true", help="include subdirectories")
+    else:
+        arg_parser.add_argument("files", nargs="+", help="HL7 files to parse")
+    # Comma-separated and repeatable, so the paths cannot swallow positional files
+    arg_parser.add_argument("--fields", action="append", metavar="PATH[,PATH...]",
+                            help="paths written per message, comma-separated; may be repeated "
+                                 f"(default: {','.join(DEFAULT_FIELDS)})")
+    arg_parser.add_argument("--workers", type=int, default=None,
+                            help="worker processes (default: number of CPUs)")
+    arg_parser.add_argument("--format", choices=OUTPUT_FORMATS, default="jsonl", help="output format")
+    arg_parser.add_argument("--output", "-o", help="output file (default: stdout)")
+    arg_parser.add_argument("--unordered", action="store_true",
+                            help="write results as they finish instead of in input order")
+    arg_parser.add_argument("--partition-by", metavar="PATH",
+                            help="keep messages with the same value of PATH (e.g. PID-3.1) in order, "
+                                 "parsing different values in parallel")
+    arg_parser.add_argument("--chunk-size", type=int, default=DEFAULT_TASK_SIZE,
+                            help="input bytes per worker task (default: %(default)s)")
+    options = arg_parser.parse_args(args)
+    if options.workers is not None and options.workers < 1:
+        arg_parser.error("--workers must be at least 1")
+    fields = [path for value in options.fields or [] for path in value.split(",") if path] or list(DEFAULT_FIELDS)
+
+    try:
+        if cmd == "parse-dir":
+            files = find_files(options.directory, options.pattern, options.recursive)
+        else:
+            files = options.files
+        output = open(options.output, "w", encoding="utf-8", newline="") if options.output else sys.stdout
+        try:
+            if options.partition_by:
+                summary = parse_partitioned(files, output, options.partition_by, fields,
+                                            options.workers, options.format)
+            else:
+                summary = parse_files(files, output, fields, options.workers, not options.unordered,
+                                      options.format, options.chunk_size)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    print(f"Parsed {summary.messages} messages from {summary.files} files "
+          f"in {summary.tasks} tasks, {summary.errors} errors", file=sys.stderr)
+    if options.partition_by:
+        print(f"Messages per partition: {list(summary.partition_messages)}, "
+              f"keys: {list(summary.partition_keys)}, skew {summary.skew:.2f}, "
+              f"busiest key {summary.max_key_messages} messages, {summary.unkeyed} without a key",
+              file=sys.stderr)
+    return 1 if summary.errors else 0
+
+def run_mllp_server(args):
+    """Receive HL7 over MLLP, parse every message and acknowledge it."""
+    from src.parser.mllp import MLLPServer, DEFAULT_HOST, DEFAULT_PORT, DEFAULT_MAX_PENDING
+    from src.parser.pools import server_pool, shutdown_pool
+    import asyncio
+
+    arg_parser = argparse.ArgumentParser(prog="hl7parser.py mllp-server")
+    arg_parser.add_argument("--host", default=DEFAULT_HOST, help="address to listen on (default: %(default)s)")
+    arg_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on (default: %(default)s)")
+    arg_parser.add_argument("--workers", type=int, default=0,
+                            help="parse in this many processes (default: on the event loop)")
+    arg_parser.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING,
+                            help="unacknowledged messages per connection (default: %(default)s)")
+    options = arg_parser.parse_args(args)
+
+    executor = server_pool(options.workers) if options.workers > 0 else None
+    server = MLLPServer(host=options.host, port=options.port, executor=executor,
+                        max_pending=options.max_pending)
+
+    async def serve():
+        async with server:
+            print(f"Listening for MLLP on {server.host}:{server.port}", file=sys.stderr)
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if executor is not None:
+            shutdown_pool(executor)
+    print(f"Acknowledged {server.messages} messages, {server.errors} with errors", file=sys.stderr)
+    return 0
+
+def run_mllp_send(args):
+    """Replay files or a generated corpus to an MLLP receiver and report ACK latency."""
+    import itertools
+    from src.parser.loadgen import (LoadGenerator, replay_file, generate_corpus,
+                                    DEFAULT_CONNECTIONS, DEFAULT_WINDOW)
+
+    arg_parser = argparse.ArgumentParser(prog="hl7parser.py mllp-send")
+    arg_parser.add_argument("target", help="receiver as HOST:PORT")
+    arg_parser.add_argument("files", nargs="*", help="HL7 files or archives to replay")
+    arg_parser.add_argument("--generate", type=int, metavar="N", help="send N synthetic ADT messages")
+    pacing = arg_parser.add_mutually_exclusive_group()
+    pacing.add_argument("--rate", type=float, help="messages per second (default: as fast as possible)")
+    pacing.add_argument("--speed", type=float, help="replay MSH-7 times compressed by this factor")
+    arg_parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS,
+                            help="persistent connections (default: %(default)s)")
+    arg_parser.add_argument("--window", type=int, default=DEFAULT_WINDOW,
+                            help="unacknowledged messages per connection (default: %(default)s)")
+    options = arg_parser.parse_args(args)
+    host, _, port = options.target.rpartition(":")
+    if not host or not port.isdigit():
+        arg_parser.error("target must be HOST:PORT")
+    if not options.files and not options.generate:
+        arg_parser.error("give files to replay or --generate N")
+
+    sources = [replay_file(path) for path in options.files]
+    if options.generate:
+        sources.append(generate_corpus(options.generate))
+    try:
+        generator = LoadGenerator(host, int(port), options.connections, options.window,
+                                  options.rate, options.speed)
+        report = generator.run(itertools.chain.from_iterable(sources))
+    except (ValueError, OSError, TimeoutError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    except KeyboardInterrupt:
+        return 130
+
+    latency = ", ".join(f"p{p} {ms:.1f} ms" for p, ms in report.latency_ms.items())
+    print(f"Sent {report.sent}, acknowledged {report.acked} ({report.errors} errors) "
+          f"in {report.elapsed:.2f} s: {report.rate:.0f} msgs/s")
+    print(f"ACK latency: {latency}, max {report.max_latency_ms:.1f} ms")
+    return 1 if report.errors or report.acked < report.sent else 0
+
+def run_service(args):
+    """Keep a warm pool of parser workers answering parse requests over HTTP."""
+    from src.utils.parse_client import default_address, parse_address
+    from src.parser.service import ParseService
+    import asyncio
+
+    arg_parser = argparse.ArgumentParser(prog="hl7parser.py serve")
+    arg_parser.add_argument("--address", default=default_address(),
+                            help="unix:PATH or HOST:PORT to listen on (default: %(default)s)")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                            help="parser processes, 0 to parse on the event loop (default: %(default)s)")
+    options = arg_parser.parse_args(args)
+    try:
+        kind, target = parse_address(options.address)
+    except ValueError as e:
+        arg_parser.error(str(e))
+    if kind == "unix":
+        service = ParseService(path=target, workers=options.workers)
+    else:
+        service = ParseService(*target, workers=options.workers)
+
+    async def serve():
+        async with service:
+            print(f"Parse service listening on {service.address} with {options.workers} workers",
+                  file=sys.stderr)
+            await service.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    print(f"Answered {service.requests} requests, {service.errors} errors", file=sys.stderr)
+    return 0
+
+def run_parse(args):
+    """Print the structure of HL7 messages as JSON, through the parse service if it is running."""
+    from src.utils.parse_client import ParseClient, NOT_RUNNING
+
+    arg_parser = argparse.ArgumentParser(prog="hl7parser.py parse")
+    arg_parser.add_argument("files", nargs="+", help="files holding one message each, or - for stdin")
+    arg_parser.add_argument("--address", help="parse service to use (default: the local one, if running)")
+    arg_parser.add_argument("--local", action="store_true", help="parse in this process, without the service")
+    options = arg_parser.parse_args(args)
+
+    client = None if options.local else ParseClient(options.address)
+    errors = 0
+    out = sys.stdout.buffer
+    for path in options.files:
+        try:
+            if path == "-":
+                data = sys.stdin.buffer.read()
+            else:
+                with open(path, "rb") as f:
+                    data = f.read()
+        except OSError as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            errors += 1
+            continue
+        try:
+            if client is not None:
+                try:
+                    result = client.parse_json(data)
+                except NOT_RUNNING:
+                    if options.address:
+                        raise
+                    # No service: parse here for the rest of the files
+                    client = None
+            if client is None:
+                from src.parser.service import parse_structure
+                status, result = parse_structure(data)
+                if status != 200:
+                    raise ValueError(json.loads(result)["error"])
+        except ValueError as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            errors += 1
+            continue
+        except OSError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 2
+        out.write(result + b"\n")
+    out.flush()
+    return 1 if errors else 0
+
 def show_help():
     """Show help information."""
     print("""
@@ -64,6 +306,13 @@ Commands:
   (no command) Run the HL7 Parser application
   install      Install dependencies
   build        Build installer package (Windows only)
+  parse-dir    Parse the HL7 files in a directory on all cores, without the GUI
+  parse-files  Parse the given HL7 files on all cores, without the GUI
+               (use "parse-dir --help" for options)
+  mllp-server  Receive HL7 over MLLP and acknowledge each message
+  mllp-send    Replay files or generated traffic to an MLLP receiver
+  serve        Keep warm parser workers answering HTTP parse requests
+  parse        Print the structure of messages as JSON, using "serve" if running
   help         Show this help message
 
 For more information, see docs/README.md and docs/BUILD.md
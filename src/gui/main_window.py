@@ -1,21 +1,37 @@
 import sys
 import os
 import pathlib
+from concurrent.futures import CancelledError
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QTextEdit, QPushButton, QFileDialog, QMessageBox,
                              QTreeView, QLabel, QSplitter, QFrame)
-from PyQt6.QtCore import Qt, QModelIndex, QSettings
+from PyQt6.QtCore import Qt, QModelIndex, QSettings, pyqtSignal
 from PyQt6.QtGui import QStandardItemModel, QStandardItem, QClipboard
 
 from parser.hl7_parser import HL7Parser
+from parser.definitions import set_overlay
+from parser.reader import iter_messages
+from parser.scheduler import shared_scheduler, Cancelled, INTERACTIVE
+from parser.structure import has_children
 from gui.tree_model import HL7TreeModel
 
+# Item data role holding a structure node whose children are not built yet
+LAZY_NODE_ROLE = Qt.ItemDataRole.UserRole + 1
+
 class MainWindow(QMainWindow):
+    # Emitted with a finished parse job from a scheduler thread; the
+    # connected slot runs on the GUI thread
+    parse_finished = pyqtSignal(object)
+
     def __init__(self):
         super().__init__()
         
         self.parser = HL7Parser()
         
+        # The latest parse job; results of older ones are dropped
+        self.parse_job = None
+        self.parse_finished.connect(self.show_parse_result)
+        
         # Settings for the application
         self.settings = QSettings("HL7Parser", "hl7parser")
         
@@ -56,9 +72,13 @@ class MainWindow(QMainWindow):
         self.clear_button = QPushButton("Clear")
         self.clear_button.clicked.connect(self.clear_input)
         
+        self.definitions_button = QPushButton("Load Definitions")
+        self.definitions_button.clicked.connect(self.load_definitions)
+        
         button_layout.addWidget(self.parse_button)
         button_layout.addWidget(self.load_button)
         button_layout.addWidget(self.clear_button)
+        button_layout.addWidget(self.definitions_button)
         
         input_layout.addWidget(input_label)
         input_layout.addWidget(self.input_text)
@@ -125,22 +145,38 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Warning", "Please enter an HL7 message to parse.")
             return
         
+        # Clear the loaded file path if manually parsing text
+        # (only if the text doesn't match the loaded file)
+        if self.loaded_file_path:
+            try:
+                with open(self.loaded_file_path, 'r') as f:
+                    if f.read().strip() != text:
+                        self.loaded_file_path = None
+            except:
+                # If there's any error reading the file, just reset the path
+                self.loaded_file_path = None
+                        
+        # Interactive priority: background jobs on the shared scheduler pause for it.
+        # The window keeps handling events; show_parse_result gets the job when done
+        self.parse_job = shared_scheduler().submit(self.parser.parse, text, priority=INTERACTIVE,
+                                                   key=('parse', id(self)))
+        self.parse_job.add_done_callback(self.parse_finished.emit)
+    
+    def show_parse_result(self, job):
+        """Show the message of a finished parse job, unless a newer parse replaced it"""
+        if job is not self.parse_job:
+            return
+        self.parse_job = None
         try:
-            # Clear the loaded file path if manually parsing text
-            # (only if the text doesn't match the loaded file)
-            if self.loaded_file_path:
-                try:
-                    with open(self.loaded_file_path, 'r') as f:
-                        if f.read().strip() != text:
-                            self.loaded_file_path = None
-                except:
-                    # If there's any error reading the file, just reset the path
-                    self.loaded_file_path = None
-                            
-            self.parser.parse_text(text)
-            self.display_message_structure()
+            message = job.result()
+        except (Cancelled, CancelledError):
+            return
         except ValueError as e:
+            self.parser.message = None
             QMessageBox.critical(self, "Error", str(e))
+            return
+        self.parser.set_message(message)
+        self.display_message_structure()
     
     def load_file(self):
         file_path, _ = QFileDialog.getOpenFileName(
@@ -151,16 +187,45 @@ class MainWindow(QMainWindow):
             return
         
         try:
-            self.parser.parse_file(file_path)
-            with open(file_path, 'r') as f:
-                self.input_text.setPlainText(f.read())
+            # Stream the file so batch files are not read into memory whole;
+            # messages are decoded with their MSH-18 charset
+            messages = iter(iter_messages(file_path))
+            message = next(messages, None)
+            if message is None:
+                raise ValueError("No HL7 message found in file")
+            self.parser.set_message(message)
+            self.input_text.setPlainText(str(message))
+            more = next(messages, None) is not None
+            messages.close()
+            if more:
+                QMessageBox.information(self, "Batch File",
+                                        "The file holds more than one message; showing the first one.")
                 
             # Store the loaded file path for later use in export
             self.loaded_file_path = file_path
             
             self.display_message_structure()
-        except ValueError as e:
+        except (ValueError, OSError) as e:
+            QMessageBox.critical(self, "Error", str(e))
+    
+    def load_definitions(self):
+        """Describe Z-segments and site fields with an overlay file from now on"""
+        file_path, _ = QFileDialog.getOpenFileName(
+            self, "Open Definitions Overlay", "", "Definitions (*.json *.toml);;All Files (*)"
+        )
+        
+        if not file_path:
+            return
+        
+        try:
+            set_overlay(file_path)
+        except (ValueError, OSError) as e:
             QMessageBox.critical(self, "Error", str(e))
+            return
+        
+        # Rebuild the shown structure with the new descriptions
+        if self.parser.message:
+            self.display_message_structure()
     
     def display_message_structure(self):
         self.tree_model.clear()
@@ -189,7 +254,7 @@ class MainWindow(QMainWindow):
         
         self.populate_tree(root_item, structure['children'])
         
-        # Expand the first level
+        # Expand the first level (expansion populates the segment rows)
         self.tree_view.expandToDepth(0)
         
         # Make columns interactive and resizable by user
@@ -219,28 +284,31 @@ class MainWindow(QMainWindow):
         for child in children:
             # Create item with name and description if available
             name_text = child['name']
-            description = ""
+            description = child.get('description') or ""
             
-            if 'description' in child and child['description']:
+            child_item = QStandardItem(name_text)
+            if description:
                 # Add tooltip with description
-                description = child['description']
-                child_item = QStandardItem(name_text)
                 child_item.setToolTip(description)
-                # Print first 5 items for debugging
-                if len(parent_item.text()) <= 3:  # Only for top-level segments
-                    print(f"Added tooltip for {name_text}: {description}", file=sys.stderr)
-            else:
-                child_item = QStandardItem(name_text)
-                if len(parent_item.text()) <= 3:  # Only for top-level segments
-                    print(f"No description for {name_text}", file=sys.stderr)
                 
             value_item = QStandardItem(child['value'] if child['value'] else "")
             description_item = QStandardItem(description)
             
             parent_item.appendRow([child_item, description_item, value_item])
             
-            if child['children']:
-                self.populate_tree(child_item, child['children'])
+            if has_children(child):
+                # Children are only built when the user expands this item
+                child_item.setData(child, LAZY_NODE_ROLE)
+                child_item.appendRow([QStandardItem(), QStandardItem(), QStandardItem()])
+    
+    def populate_pending_children(self, item):
+        """Replace the placeholder row of a lazily populated item with its children"""
+        node = item.data(LAZY_NODE_ROLE)
+        if node is None:
+            return
+        item.setData(None, LAZY_NODE_ROLE)
+        item.removeRows(0, item.rowCount())
+        self.populate_tree(item, node['children'])
     
     def clear_input(self):
         self.input_text.clear()
@@ -317,9 +385,11 @@ class MainWindow(QMainWindow):
             QMessageBox.critical(self, "Error", f"Failed to export: {str(e)}")
             
     def on_item_expanded(self, index):
-        """Handle item expansion without resizing columns to preserve user's column widths"""
+        """Populate lazy children on expansion without resizing columns"""
+        item = self.tree_model.itemFromIndex(index.siblingAtColumn(0))
+        if item is not None:
+            self.populate_pending_children(item)
         # We don't auto-resize columns anymore to respect user's manual sizing
-        pass
         
     def on_item_collapsed(self, index):
         """Handle item collapse without resizing columns to preserve user's column widths"""
@@ -1,13 +1,28 @@
 from PyQt6.QtCore import Qt, QAbstractItemModel, QModelIndex
 from PyQt6.QtGui import QStandardItemModel, QStandardItem
 
+from parser.structure import has_children
+
 class HL7TreeItem:
-    def __init__(self, name, value=None, description=None, parent=None):
+    def __init__(self, name, value=None, description=None, parent=None, node=None):
         self.name = name
         self.value = value
         self.description = description
         self.parent_item = parent
-        self.child_items = []
+        # Structure node whose children are turned into items on first access
+        self.node = node
+        self._child_items = None if node is not None else []
+        
+    @property
+    def child_items(self):
+        if self._child_items is None:
+            self._child_items = [HL7TreeItem.from_node(child, self) for child in self.node['children']]
+        return self._child_items
+        
+    @classmethod
+    def from_node(cls, node, parent=None):
+        """Create an item for a structure node; its children stay unbuilt"""
+        return cls(node['name'], node['value'], node.get('description', ''), parent, node)
         
     def appendChild(self, item):
         self.child_items.append(item)
@@ -51,19 +66,19 @@ class HL7TreeModel(QAbstractItemModel):
         self.beginResetModel()
         self.root_item = HL7TreeItem("Root")
         if structure:
-            description = structure.get('description', '')
-            root = HL7TreeItem(structure['name'], structure['value'], description)
-            self.root_item.appendChild(root)
-            self._populate_tree(root, structure['children'])
+            # Child items are created on demand as the view asks for rows
+            self.root_item.appendChild(HL7TreeItem.from_node(structure, self.root_item))
         self.endResetModel()
         
-    def _populate_tree(self, parent, children):
-        for child in children:
-            description = child.get('description', '')
-            item = HL7TreeItem(child['name'], child['value'], description, parent)
-            parent.appendChild(item)
-            if child['children']:
-                self._populate_tree(item, child['children'])
+    def hasChildren(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return False
+        if not parent.isValid():
+            return self.root_item.childCount() > 0
+        item = parent.internalPointer()
+        if item._child_items is None:
+            return has_children(item.node)
+        return item.childCount() > 0
                 
     def index(self, row, column, parent=QModelIndex()):
         if not self.hasIndex(row, column, parent):
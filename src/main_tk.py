@@ -3,6 +3,7 @@ import sys
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 from parser.hl7_parser import HL7Parser
+from parser.reader import iter_messages
 
 class MainWindow:
     def __init__(self, root):
@@ -95,12 +96,21 @@ class MainWindow:
             return
         
         try:
-            self.parser.parse_file(file_path)
-            with open(file_path, 'r') as f:
-                self.input_text.delete("1.0", tk.END)
-                self.input_text.insert("1.0", f.read())
+            # Stream the file so batch files are not read into memory whole;
+            # messages are decoded with their MSH-18 charset
+            messages = iter(iter_messages(file_path))
+            message = next(messages, None)
+            if message is None:
+                raise ValueError("No HL7 message found in file")
+            self.parser.set_message(message)
+            self.input_text.delete("1.0", tk.END)
+            self.input_text.insert("1.0", str(message))
+            more = next(messages, None) is not None
+            messages.close()
+            if more:
+                messagebox.showinfo("Batch File", "The file holds more than one message; showing the first one.")
             self.display_message_structure()
-        except ValueError as e:
+        except (ValueError, OSError) as e:
             messagebox.showerror("Error", str(e))
     
     def display_message_structure(self):
@@ -1,3 +1,17 @@
 # HL7 Parser Module
-from .hl7_parser import HL7Parser
-from .hl7_definitions import HL7_SEGMENTS, HL7_FIELDS, ADT_CODES
\ No newline at end of file
+from .hl7_parser import HL7Parser, parse
+from .message import HL7Message
+from .paths import compile_path
+from .projection import Projection
+from .reader import iter_messages, MessageReader
+from .archive import HL7Archive
+from .definitions import segment_description, field_description, event_description, set_overlay
+
+
+def __getattr__(name):
+    # The definition dicts are only built when asked for; the parser reads
+    # the compiled tables of .definitions
+    if name in ('HL7_SEGMENTS', 'HL7_FIELDS', 'ADT_CODES'):
+        from . import hl7_definitions
+        return getattr(hl7_definitions, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
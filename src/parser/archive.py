@@ -0,0 +1,177 @@
+"""Random access to the messages of large HL7 archive files.
+
+HL7Archive memory-maps an archive and finds the start of every message
+(a segment starting with MSH) in a single scan, keeping the offsets in
+``array('Q')`` tables. Nothing else is read until a message is accessed;
+``archive[n]`` then parses just that message, from a slice of the
+mapping, with the configured HL7Parser engine. Parsing keeps no state
+on the archive, so threads can read messages concurrently.
+
+If an up-to-date sidecar index (see index.py) exists, its offsets are
+used instead of scanning, and find()/between() look messages up by
+control ID and timestamp through it.
+"""
+import mmap
+import os
+from array import array
+from collections.abc import Sequence
+
+from .hl7_parser import HL7Parser, ENGINE_NATIVE
+from .index import ArchiveIndex, index_path, open_index
+
+# Unsigned 64-bit offsets; archives can be far larger than 4 GiB
+ARCHIVE_OFFSET_TYPECODE = 'Q'
+
+# Characters that can precede the MSH starting a message
+_SEGMENT_START = frozenset(b'\r\n\x0b')
+
+# Segment terminators, MLLP framing and blanks around a message
+_FRAMING = frozenset(b'\r\n\x0b\x1c \t')
+
+# Envelope segments that can follow the last message of a batch
+_ENVELOPE_TRAILERS = tuple(
+    terminator + name for name in (b'BTS', b'FTS', b'BHS', b'FHS') for terminator in (b'\r', b'\n')
+)
+
+
+class HL7Archive(Sequence):
+    """A read-only sequence of the messages in an HL7 archive file.
+
+    Supports ``len()``, ``archive[n]`` and slicing; items are parsed
+    messages. Use as a context manager, or call close(), to release the
+    mapping. ``span(n)`` and ``raw(n)`` give a message's offsets and an
+    undecoded zero-copy view of it.
+    """
+
+    def __init__(self, path, engine=ENGINE_NATIVE, projection=None):
+        self.path = str(path)
+        self.parser = HL7Parser(engine, projection)
+        self.starts = array(ARCHIVE_OFFSET_TYPECODE)
+        self.ends = array(ARCHIVE_OFFSET_TYPECODE)
+        self._index = None
+        self._file = open(self.path, 'rb')
+        try:
+            # mmap cannot map an empty file
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._size() else None
+        except BaseException:
+            self._file.close()
+            raise
+        if self._map is not None and not self._read_sidecar():
+            self._build_index()
+
+    def _size(self):
+        self._file.seek(0, 2)
+        return self._file.tell()
+
+    def _build_index(self):
+        """Record the start and end offset of every message in one scan.
+
+        A message starts at ``MSH`` at the beginning of the file or after
+        a segment terminator, and ends where the next one starts (minus
+        framing). Envelope segments trailing the last message of a batch
+        are cut off when the message is read, see span().
+        """
+        data = self._map
+        find = data.find
+        starts, ends = self.starts, self.ends
+        pos = find(b'MSH')
+        while pos >= 0:
+            if pos == 0 or data[pos - 1] in _SEGMENT_START:
+                if starts:
+                    ends.append(self._trim_end(starts[-1], pos))
+                starts.append(pos)
+            pos = find(b'MSH', pos + 3)
+        if starts:
+            ends.append(self._trim_end(starts[-1], len(data)))
+
+    def _read_sidecar(self):
+        """Take the message offsets from a valid sidecar index, if there is one"""
+        path = index_path(self.path)
+        if not os.path.exists(path):
+            return False
+        try:
+            index = ArchiveIndex.load(path)
+        except (ValueError, OSError):
+            # Unreadable or invalid; the offsets are found by scanning instead
+            return False
+        if not index.matches(self.path):
+            return False
+        self._index = index
+        self.starts = index.offsets
+        self.ends = array(ARCHIVE_OFFSET_TYPECODE, map(sum, zip(index.offsets, index.lengths)))
+        return True
+
+    @property
+    def index(self):
+        """The sidecar ArchiveIndex, built and saved on first use if missing or stale"""
+        if self._index is None:
+            self._index = open_index(self)
+        return self._index
+
+    def find(self, control_id):
+        """Return the messages with an MSH-10 control ID"""
+        return [self[n] for n in self.index.find(control_id)]
+
+    def between(self, start=None, end=None):
+        """Return the messages with start <= MSH-7 < end, in time order"""
+        return [self[n] for n in self.index.between(start, end)]
+
+    def _trim_end(self, start, end):
+        """Move end back over the framing characters before it"""
+        data = self._map
+        while end > start and data[end - 1] in _FRAMING:
+            end -= 1
+        return end
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[n] for n in range(*index.indices(len(self)))]
+        start, end = self.span(index)
+        # Slicing the mapping copies the message once; it has to outlive
+        # the mapping, and the tokenizer works on bytes, not on views
+        data = self._map[start:end]
+        if self.parser.engine == ENGINE_NATIVE:
+            return self.parser.parse(data)
+        # hl7apy results live on a parser, so each message gets its own
+        parser = HL7Parser(self.parser.engine)
+        parser.parse_bytes(data)
+        return parser.message
+
+    def span(self, index):
+        """Return the (start, end) byte offsets of a message"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("message index out of range")
+        start, end = self.starts[index], self.ends[index]
+        find = self._map.find
+        for trailer in _ENVELOPE_TRAILERS:
+            pos = find(trailer, start, end)
+            if pos >= 0:
+                end = self._trim_end(start, pos)
+        return start, end
+
+    def raw(self, index):
+        """Return a zero-copy memoryview of a message's bytes; release it when done"""
+        start, end = self.span(index)
+        with memoryview(self._map) as view:
+            return view[start:end]
+
+    def close(self):
+        """Release the mapping and the file"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return f"HL7Archive({self.path!r}, {len(self)} messages)"
@@ -0,0 +1,510 @@
+"""Parallel batch parsing of HL7 files over a process pool.
+
+parse_files() splits its input into tasks of roughly ``chunk_size``
+bytes: small files are grouped together, and large files are cut into
+byte ranges that start and end on message boundaries. Each task goes to a
+ProcessPoolExecutor worker, which reads its ranges, parses every message
+and returns the output for the whole task as one string, so only a few
+objects cross the process boundary per megabyte of input instead of one
+per message.
+
+Workers are set up once per process (see _init_worker): the HL7
+definitions are loaded and the output paths compiled there, not per task.
+Results are written to the output sink in input order, or in completion
+order when ``ordered=False``.
+
+parse_messages() distributes the same tasks but hands the parsed messages
+themselves back to the caller. Each worker packs a task's messages into a
+shared memory segment (see packed.py) and returns only the segment's
+name. No message is pickled, and the caller reads lazy views directly
+from the shared memory.
+
+parse_partitioned() keeps the order of related messages, e.g. the
+A01/A08/A03 events of one patient. The parent reads the files, parses
+just the partition key of each message and picks its partition with a
+stable hash of the key's value. Every partition belongs to one worker
+process, which parses its messages in input order, so rows with the same
+key keep their order while different keys are parsed in parallel.
+"""
+import csv
+import io
+import json
+import os
+import zlib
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import resource_tracker
+from pathlib import Path
+
+from .definitions import definitions
+from .message import HL7Message
+from .packed import share_messages, SharedMessages
+from .paths import compile_path
+from .projection import as_projection
+from .reader import MessageReader, DEFAULT_CHUNK_SIZE, MESSAGE_HEADER, _BOUNDARY_BYTES, _records
+from .scheduler import checkpoint
+
+# Input bytes per task; large enough that IPC is negligible next to parsing
+DEFAULT_TASK_SIZE = 4 * 1024 * 1024
+
+# Fields written for every message unless others are requested
+DEFAULT_FIELDS = ('MSH-7', 'MSH-9', 'MSH-10')
+
+OUTPUT_FORMATS = ('jsonl', 'csv')
+
+# Tasks submitted ahead of the one being written, per worker
+TASKS_IN_FLIGHT_PER_WORKER = 4
+
+# Path whose value decides the partition of a message in parse_partitioned()
+DEFAULT_PARTITION_KEY = 'PID-3.1'
+
+# Messages handed to a partition's worker at a time
+PARTITION_BATCH_SIZE = 256
+
+# Bytes read at a time while looking for the next message boundary
+_ALIGN_BLOCK_SIZE = 64 * 1024
+
+BatchSummary = namedtuple('BatchSummary', 'files tasks messages errors')
+
+# As BatchSummary, plus skew counters: messages and distinct keys per
+# partition, messages without a key, messages of the busiest key, and
+# the busiest partition's messages relative to the mean
+PartitionSummary = namedtuple('PartitionSummary', 'files tasks messages errors partition_messages '
+                                                  'partition_keys unkeyed max_key_messages skew')
+
+# Per-process worker state, set by _init_worker
+_worker = None
+
+
+def parse_files(paths, output, fields=DEFAULT_FIELDS, workers=None, ordered=True,
+                output_format='jsonl', chunk_size=DEFAULT_TASK_SIZE):
+    """Parse HL7 files in parallel and write one row per message to output.
+
+    ``output`` is a text stream. Each row holds the file name and the
+    value of each path in ``fields`` (e.g. ``PID-3.1``); only the segments
+    and fields those paths need are parsed. ``workers`` defaults to the
+    CPU count; with 1 everything runs in this process. Returns a
+    BatchSummary.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive")
+    fields = tuple(fields)
+    projection = fields_projection(fields)
+    paths = [str(path) for path in paths]
+    workers = workers or os.cpu_count() or 1
+
+    if output_format == 'csv':
+        csv.writer(output).writerow(('file',) + fields)
+
+    tasks = split_tasks(paths, chunk_size)
+    setup = (fields, projection, output_format)
+    task_count = messages = errors = 0
+    if workers == 1:
+        _init_worker(*setup)
+        results = map(_parse_task, tasks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=setup)
+        results = _run(executor, _parse_task, tasks, ordered, workers * TASKS_IN_FLIGHT_PER_WORKER)
+    try:
+        for text, message_count, error_count in results:
+            checkpoint()
+            output.write(text)
+            task_count += 1
+            messages += message_count
+            errors += error_count
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return BatchSummary(len(paths), task_count, messages, errors)
+
+
+def parse_messages(paths, workers=None, ordered=True, projection=None, chunk_size=DEFAULT_TASK_SIZE):
+    """Parse HL7 files in parallel and yield the messages, one task at a time.
+
+    Yields a SharedMessages sequence per task (a few MiB of input). Its
+    items are HL7Messages read in place from shared memory. Use each one
+    as a context manager, or close() it, once its messages are no longer
+    needed. Unreadable files raise OSError.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive")
+    paths = [str(path) for path in paths]
+    workers = workers or os.cpu_count() or 1
+    if os.name == 'posix':
+        # Started before the workers so they share it; each segment is then
+        # forgotten by the tracker as soon as this process unlinks it
+        resource_tracker.ensure_running()
+
+    tasks = split_tasks(paths, chunk_size)
+    setup = ((), projection, None)
+    if workers == 1:
+        _init_worker(*setup)
+        for task in tasks:
+            name = _share_task(task)
+            if name is not None:
+                yield SharedMessages(name)
+        return
+
+    executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=setup)
+    results = _run(executor, _share_task, tasks, ordered, workers * TASKS_IN_FLIGHT_PER_WORKER,
+                   discard=_discard_segment)
+    try:
+        for name in results:
+            if name is not None:
+                yield SharedMessages(name)
+    finally:
+        results.close()
+        executor.shutdown()
+
+
+def parse_partitioned(paths, output, key=DEFAULT_PARTITION_KEY, fields=DEFAULT_FIELDS, workers=None,
+                      output_format='jsonl', batch_size=PARTITION_BATCH_SIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Parse HL7 files in parallel, keeping messages with the same key in order.
+
+    Like parse_files(), but the messages are sharded by the value of the
+    path ``key`` (by default the patient ID). There is one partition per
+    worker; messages without a key value all go to the same one. Rows of
+    one partition are written in input order, and rows of different
+    partitions are interleaved as they finish. Routing parses only the
+    key, in this process. Returns a PartitionSummary.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    if batch_size < 1:
+        raise ValueError("batch_size must be positive")
+    fields = tuple(fields)
+    key_path = compile_path(key)
+    key_projection = as_projection(fields_projection([key]))
+    paths = [str(path) for path in paths]
+    workers = workers or os.cpu_count() or 1
+
+    if output_format == 'csv':
+        csv.writer(output).writerow(('file',) + fields)
+    write_error = (_json_writer(output, fields) if output_format == 'jsonl' else _csv_writer(output))
+
+    setup = (fields, fields_projection(fields), output_format)
+    partitions = _Partitions(workers, setup, output)
+    key_counts = Counter()
+    buffers = [[] for _ in range(workers)]
+    try:
+        for file_path in paths:
+            try:
+                stream = open(file_path, 'rb')
+            except OSError as e:
+                partitions.errors += 1
+                write_error(file_path, None, str(e))
+                continue
+            with stream:
+                for record in _records(stream, chunk_size):
+                    if record[:3] != MESSAGE_HEADER.encode():
+                        # Batch envelope segments and stray text
+                        continue
+                    # The routing runs in the caller's thread, which may be a scheduler job
+                    checkpoint()
+                    value = _partition_value(record, key_path, key_projection)
+                    key_counts[value] += 1
+                    partition = partition_for(value, workers)
+                    batch = buffers[partition]
+                    batch.append((file_path, record))
+                    if len(batch) >= batch_size:
+                        partitions.submit(partition, batch)
+                        buffers[partition] = []
+        for partition, batch in enumerate(buffers):
+            if batch:
+                partitions.submit(partition, batch)
+        partitions.finish()
+    finally:
+        partitions.shutdown()
+
+    partition_keys = [0] * workers
+    for value in key_counts:
+        partition_keys[partition_for(value, workers)] += 1
+    messages = sum(partitions.messages)
+    return PartitionSummary(
+        files=len(paths),
+        tasks=partitions.tasks,
+        messages=messages,
+        errors=partitions.errors,
+        partition_messages=tuple(partitions.messages),
+        partition_keys=tuple(partition_keys),
+        unkeyed=key_counts[''],
+        max_key_messages=max(key_counts.values(), default=0),
+        skew=max(partitions.messages) * workers / messages if messages else 1.0,
+    )
+
+
+def partition_for(value, partitions):
+    """Return the partition of a key value; stable across processes and runs, unlike hash()"""
+    return zlib.crc32(value.encode('utf-8', 'surrogateescape')) % partitions
+
+
+def _partition_value(record, key_path, key_projection):
+    """Return the partition key of a message record, '' if it has none"""
+    try:
+        value = key_path.get(HL7Message(record, key_projection), '')
+    except ValueError:
+        # The worker reports the error
+        return ''
+    if isinstance(value, list):
+        value = '~'.join(item or '' for item in value)
+    return value or ''
+
+
+class _Partitions:
+    """One single-process executor per partition, so each partition's batches run in order"""
+
+    def __init__(self, workers, setup, output):
+        self.output = output
+        self.tasks = self.errors = 0
+        self.messages = [0] * workers
+        if workers == 1:
+            _init_worker(*setup)
+            self.executors = None
+        else:
+            self.executors = [ProcessPoolExecutor(1, initializer=_init_worker, initargs=setup)
+                              for _ in range(workers)]
+        self.in_flight = [deque() for _ in range(workers)]
+
+    def submit(self, partition, batch):
+        if self.executors is None:
+            self._write(partition, _parse_records(batch))
+            return
+        pending = self.in_flight[partition]
+        pending.append(self.executors[partition].submit(_parse_records, batch))
+        if len(pending) >= TASKS_IN_FLIGHT_PER_WORKER:
+            self._write(partition, pending.popleft().result())
+        # Write whatever the other partitions have finished, each in its own order
+        for partition, pending in enumerate(self.in_flight):
+            while pending and pending[0].done():
+                self._write(partition, pending.popleft().result())
+
+    def finish(self):
+        for partition, pending in enumerate(self.in_flight):
+            while pending:
+                self._write(partition, pending.popleft().result())
+
+    def shutdown(self):
+        for executor in self.executors or ():
+            executor.shutdown()
+
+    def _write(self, partition, result):
+        text, messages, errors = result
+        self.output.write(text)
+        self.tasks += 1
+        self.messages[partition] += messages
+        self.errors += errors
+
+
+def find_files(directory, pattern='*.hl7', recursive=False):
+    """Return the files in a directory matching a glob pattern, sorted"""
+    directory = Path(directory)
+    if not directory.is_dir():
+        raise ValueError(f"Not a directory: {directory}")
+    matches = directory.rglob(pattern) if recursive else directory.glob(pattern)
+    return sorted(str(path) for path in matches if path.is_file())
+
+
+def fields_projection(fields):
+    """Return the projection that parses just what a list of paths reads"""
+    projection = {}
+    for path in fields:
+        compiled = compile_path(path)
+        projection.setdefault(compiled.segment, set()).add(compiled.field)
+    return projection
+
+
+def split_tasks(paths, chunk_size=DEFAULT_TASK_SIZE):
+    """Yield tasks of about chunk_size input bytes each.
+
+    A task is a list of ``(path, start, end)`` byte ranges. Files smaller
+    than chunk_size are grouped into one task; larger files are split into
+    ranges cut at the first message boundary after each chunk_size bytes.
+    """
+    task, task_size = [], 0
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            # Reported as an error by the worker
+            size = 0
+        if size <= chunk_size:
+            task.append((path, 0, size))
+            task_size += size
+            if task_size >= chunk_size:
+                yield task
+                task, task_size = [], 0
+            continue
+
+        with open(path, 'rb') as f:
+            start = 0
+            while start < size:
+                end = _next_boundary(f, start + chunk_size, size)
+                yield [(path, start, end)]
+                start = end
+    if task:
+        yield task
+
+
+def _next_boundary(f, offset, size):
+    """Return the offset of the first record (MSH or envelope segment) at or after offset"""
+    if offset >= size:
+        return size
+    # The boundary pattern matches the terminator before the segment name
+    pos = offset - 1
+    while pos < size:
+        f.seek(pos)
+        block = f.read(_ALIGN_BLOCK_SIZE)
+        match = _BOUNDARY_BYTES.search(block)
+        if match is not None:
+            return pos + match.start() + 1
+        if len(block) < _ALIGN_BLOCK_SIZE:
+            break
+        # Keep the last characters; a boundary can straddle two blocks
+        pos += len(block) - 3
+    return size
+
+
+def _run(executor, function, tasks, ordered, max_pending, discard=None):
+    """Yield function(task) results while keeping at most max_pending tasks submitted.
+
+    If the caller stops early, discard() is called with the result of
+    every task that was already running.
+    """
+    pending = deque()
+    try:
+        for task in tasks:
+            # Workers run in other processes; the caller's thread yields here
+            checkpoint()
+            pending.append(executor.submit(function, task))
+            if len(pending) >= max_pending:
+                yield from _completed(pending, ordered)
+        while pending:
+            yield from _completed(pending, ordered)
+    finally:
+        for future in pending:
+            if not future.cancel() and discard is not None and future.exception() is None:
+                discard(future.result())
+
+
+def _completed(pending, ordered):
+    """Yield the results of the oldest task, or of whichever tasks finish first"""
+    if ordered:
+        yield pending.popleft().result()
+        return
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        pending.remove(future)
+        yield future.result()
+
+
+def _init_worker(fields, projection, output_format):
+    """Set up a worker process: load the definitions and compile the paths once"""
+    global _worker
+    definitions()  # loaded once per process, not per task
+    _worker = (tuple(compile_path(path) for path in fields), as_projection(projection), output_format)
+
+
+def _read_range(file_path, start, end):
+    """Return the bytes of a task range; an empty range means the whole file"""
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start) if end > start else f.read()
+
+
+def _parse_task(task):
+    """Parse the ranges of a task; returns (output text, messages, errors)"""
+    paths, projection, _ = _worker
+    out = io.StringIO()
+    write_row = _row_writer(out)
+    messages = errors = 0
+    for file_path, start, end in task:
+        try:
+            data = _read_range(file_path, start, end)
+        except OSError as e:
+            errors += 1
+            write_row(file_path, None, str(e))
+            continue
+        for message in MessageReader(io.BytesIO(data), projection=projection):
+            # Only has an effect with one worker, when this runs in the
+            # caller's thread; pool workers are checkpointed by the caller
+            checkpoint()
+            messages += 1
+            try:
+                values = [path.get(message, '') for path in paths]
+            except ValueError as e:
+                errors += 1
+                write_row(file_path, None, str(e))
+                continue
+            write_row(file_path, values, None)
+    return out.getvalue(), messages, errors
+
+
+def _parse_records(batch):
+    """Parse a partition's batch of (path, record) pairs; returns (output text, messages, errors)"""
+    paths, projection, _ = _worker
+    out = io.StringIO()
+    write_row = _row_writer(out)
+    errors = 0
+    for file_path, record in batch:
+        # See _parse_task: only in effect with one worker
+        checkpoint()
+        try:
+            message = HL7Message(record, projection)
+            values = [path.get(message, '') for path in paths]
+        except ValueError as e:
+            errors += 1
+            write_row(file_path, None, str(e))
+            continue
+        write_row(file_path, values, None)
+    return out.getvalue(), len(batch), errors
+
+
+def _row_writer(out):
+    paths, _, output_format = _worker
+    if output_format == 'jsonl':
+        return _json_writer(out, [path.path for path in paths])
+    return _csv_writer(out)
+
+
+def _share_task(task):
+    """Parse the ranges of a task into a shared memory segment; returns its name"""
+    projection = _worker[1]
+    messages = []
+    for file_path, start, end in task:
+        data = _read_range(file_path, start, end)
+        messages.extend(MessageReader(io.BytesIO(data), projection=projection))
+    return share_messages(messages)
+
+
+def _discard_segment(name):
+    """Free the shared memory segment of a result nobody will read"""
+    if name is not None:
+        SharedMessages(name).close()
+
+
+def _json_writer(out, names):
+    def write_row(file_path, values, error):
+        row = {'file': file_path}
+        if error is not None:
+            row['error'] = error
+        else:
+            row.update(zip(names, values))
+        out.write(json.dumps(row, ensure_ascii=False))
+        out.write('\n')
+    return write_row
+
+
+def _csv_writer(out):
+    writer = csv.writer(out)
+
+    def write_row(file_path, values, error):
+        if error is not None:
+            writer.writerow((file_path, f"ERROR: {error}"))
+            return
+        # Wildcard paths give lists; join them like HL7 repetitions
+        writer.writerow([file_path] + ['~'.join(value) if isinstance(value, list) else value
+                                       for value in values])
+    return write_row
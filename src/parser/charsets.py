@@ -0,0 +1,123 @@
+"""MSH-18 character sets and lazily decoded message buffers.
+
+Messages parsed from bytes are tokenized on the raw buffer and values are
+decoded one at a time when they are read, using the character set named
+in MSH-18 (HL7 table 0211). This only works for charsets in which the
+ASCII delimiters can never appear inside a multi-byte character; for the
+others the whole buffer is decoded once up front.
+"""
+import codecs
+import re
+
+# HL7 table 0211 (MSH-18) to Python codec names
+CHARSETS = {
+    'ASCII': 'ascii',
+    '8859/1': 'latin-1',
+    '8859/2': 'iso8859-2',
+    '8859/3': 'iso8859-3',
+    '8859/4': 'iso8859-4',
+    '8859/5': 'iso8859-5',
+    '8859/6': 'iso8859-6',
+    '8859/7': 'iso8859-7',
+    '8859/8': 'iso8859-8',
+    '8859/9': 'iso8859-9',
+    '8859/15': 'iso8859-15',
+    'UNICODE': 'utf-8',
+    'UNICODE UTF-8': 'utf-8',
+    'UNICODE UTF-16': 'utf-16',
+    'UNICODE UTF-32': 'utf-32',
+    'ISO IR87': 'iso2022_jp',
+    'ISO IR159': 'iso2022_jp_2',
+    'GB 18030-2000': 'gb18030',
+    'KS X 1001': 'euc_kr',
+    'BIG-5': 'big5',
+}
+
+# Used when MSH-18 is empty or unknown; ASCII feeds decode the same way
+DEFAULT_CODEC = 'utf-8'
+
+# Codecs whose encoded bytes below 0x80 are always plain ASCII characters,
+# so delimiters can be searched for in the undecoded buffer
+BYTE_TRANSPARENT_CODECS = frozenset(
+    {'ascii', 'latin-1', 'utf-8', 'euc_kr'} | {codec for codec in CHARSETS.values() if codec.startswith('iso8859-')}
+)
+
+# Codecs that never encode "MSH" as plain ASCII bytes
+WIDE_CODECS = frozenset({'utf-16', 'utf-32'})
+
+# Undecodable bytes never abort reading a value
+DECODE_ERRORS = 'replace'
+
+_FIRST_SEGMENT = re.compile(rb'[^\r\n]*')
+
+# Byte order marks and wide-character "MSH" headers; UTF-32 goes first
+# since its little-endian BOM starts with the UTF-16 one
+_WIDE_PREFIXES = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+    ('MSH'.encode('utf-32-le'), 'utf-32-le'),
+    ('MSH'.encode('utf-32-be'), 'utf-32-be'),
+    ('MSH'.encode('utf-16-le'), 'utf-16-le'),
+    ('MSH'.encode('utf-16-be'), 'utf-16-be'),
+)
+
+
+def codec_for(charset):
+    """Return the Python codec for an MSH-18 value"""
+    return CHARSETS.get(charset.strip().upper(), DEFAULT_CODEC) if charset else DEFAULT_CODEC
+
+
+def wide_codec(data):
+    """Return the codec of a UTF-16/UTF-32 buffer, or None for byte-based text.
+
+    Wide-character messages cannot be tokenized as bytes (not even their
+    MSH-18), so they are recognized by BOM or by how "MSH" is encoded.
+    """
+    for prefix, codec in _WIDE_PREFIXES:
+        if data.startswith(prefix):
+            return codec
+    return None
+
+
+def read_charset(data, encoding):
+    """Read the first MSH-18 character set from the MSH segment of a buffer"""
+    header = _FIRST_SEGMENT.match(data).group()
+    fields = header.split(encoding.field.encode('latin-1'))
+    # fields[0] is the segment name and fields[1] MSH-2, so MSH-n is fields[n - 1]
+    if len(fields) < 18:
+        return ''
+    charset = fields[17].split(encoding.repetition.encode('latin-1'))[0]
+    return charset.decode('ascii', DECODE_ERRORS).strip()
+
+
+class DecodedText:
+    """Read-only text over an encoded buffer; slices are decoded on access.
+
+    Offsets are byte offsets into the buffer, which is what the tokenizer
+    records when it runs on bytes.
+    """
+
+    __slots__ = ('buffer', 'codec')
+
+    def __init__(self, buffer, codec):
+        self.buffer = memoryview(buffer)
+        self.codec = codec
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return str(self.buffer[key], self.codec, DECODE_ERRORS)
+        return str(self.buffer[key:key + 1 or None], self.codec, DECODE_ERRORS)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __str__(self):
+        return str(self.buffer, self.codec, DECODE_ERRORS)
+
+    def __repr__(self):
+        return f"DecodedText({len(self.buffer)} bytes, {self.codec!r})"
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + self.buffer.nbytes
@@ -0,0 +1,412 @@
+"""Compiled, read-only form of the HL7 definitions.
+
+hl7_definitions keeps segment, field and ADT event descriptions as dict
+literals keyed by strings (``HL7_FIELDS['PID']['5']``), and importing it
+builds all of them. The compiled form holds the field descriptions of a
+segment as a tuple indexed by field number (``fields[5]``; index 0 and
+undefined fields are None), and only builds that tuple the first time a
+segment is looked up.
+
+There is one set of tables per HL7 version in SUPPORTED_VERSIONS, with
+the fields each version defined (VERSION_FIELD_COUNTS and
+VERSION_FIELD_NAMES of hl7_definitions). A set is loaded the first time a
+message of its version is described and then shared by all of them. Any
+other MSH-12 value resolves, once, to the nearest supported version:
+``2.5.2`` to 2.5, then DEFAULT_VERSION (``2.9``, ``3.0``, missing).
+
+An overlay file (JSON, or TOML) adds site-specific segments, fields,
+data types and events on top of every set, e.g. Z-segments::
+
+    {"segments": {"ZPD": "Patient Details"},
+     "fields": {"ZPD": {"1": "Set ID",
+                        "2": {"description": "Preferred Name", "type": "XPN"}}},
+     "data_types": {"XPN": ["Family Name", "Given Name"]},
+     "events": {"Z01": "Site transfer"}}
+
+Field descriptions of a data type's components replace ``Component n``.
+set_overlay() swaps the overlay of a running process; HL7PARSER_OVERLAY
+names one to use from the start. If that file cannot be read or is
+invalid, a RuntimeWarning is issued once and the built-in tables are used.
+
+Each set is compiled once from hl7_definitions, merged with the overlay,
+and cached in ``__pycache__`` next to hl7_definitions, as a header, a
+marshalled index and one marshalled entry per segment. Caches of overlaid
+sets are named by the SHA-256 of the overlay, so an unchanged overlay is
+hashed but never parsed or merged again. The cache is rebuilt when the
+size or mtime of hl7_definitions.py changes; loading it does not import
+hl7_definitions at all.
+
+File layout (version 2)::
+
+    header   struct HEADER_FORMAT: magic, version, source size,
+             source mtime_ns, index size
+    index    marshal: (segment descriptions, event descriptions, data
+             type component descriptions, {segment: (offset, length) of
+             its entry in the blob})
+    blob     marshal of (field descriptions, field data types) per segment
+"""
+import hashlib
+import json
+import marshal
+import os
+import struct
+import sys
+import threading
+import warnings
+from collections import namedtuple
+from functools import lru_cache
+
+DEFINITIONS_MAGIC = b'HL7DEF'
+DEFINITIONS_VERSION = 2
+
+# magic, version, source size, source mtime_ns, index size
+HEADER_FORMAT = '<6sHQqQ'
+
+# The definitions source the tables are compiled from
+SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hl7_definitions.py')
+
+# HL7 versions with their own set of tables, oldest first
+SUPPORTED_VERSIONS = ('2.3', '2.3.1', '2.4', '2.5', '2.5.1', '2.6', '2.7', '2.8')
+
+# Version of messages without a supported MSH-12 or its prefix
+DEFAULT_VERSION = '2.8'
+
+# Environment variable naming an overlay file to use from the start
+OVERLAY_VARIABLE = 'HL7PARSER_OVERLAY'
+
+# Tables an overlay may extend
+OVERLAY_TABLES = ('segments', 'fields', 'data_types', 'events')
+
+# An overlay file: absolute path, SHA-256 of its contents, the contents
+OverlayFile = namedtuple('OverlayFile', 'path digest data')
+
+
+class CompiledDefinitions:
+    """Segment, field and event descriptions; field tables are unpacked per segment on first use"""
+
+    __slots__ = ('segments', 'events', 'data_types', '_offsets', '_blob', '_fields')
+
+    def __init__(self, segments, events, data_types, offsets, blob):
+        # Segment name -> description, ADT event code -> description, data
+        # type -> descriptions of its components
+        self.segments = segments
+        self.events = events
+        self.data_types = data_types
+        # Segment name -> (offset, length) of its marshalled entry
+        self._offsets = offsets
+        self._blob = blob
+        self._fields = {}
+
+    @classmethod
+    def compile(cls, segments, fields, events, types=None, data_types=None):
+        """Compile dicts shaped like hl7_definitions' (string field numbers).
+
+        ``types`` gives the data types of fields in the same shape as
+        ``fields``, ``data_types`` the component descriptions of each type.
+        """
+        types = types or {}
+        offsets = {}
+        parts = []
+        position = 0
+        for segment_name in {**fields, **types}:
+            entry = tuple(_by_number(table.get(segment_name, {})) for table in (fields, types))
+            data = marshal.dumps(entry)
+            offsets[segment_name] = (position, len(data))
+            parts.append(data)
+            position += len(data)
+        data_types = {name: tuple(components) for name, components in (data_types or {}).items()}
+        return cls(dict(segments), dict(events), data_types, offsets, b''.join(parts))
+
+    def fields(self, segment_name):
+        """Return the field descriptions of a segment indexed by field number; () if unknown"""
+        return self._entry(segment_name)[0]
+
+    def components(self, segment_name, field_num):
+        """Return the component descriptions of a field's data type; () if it has none"""
+        types = self._entry(segment_name)[1]
+        if 0 < field_num < len(types) and types[field_num] is not None:
+            return self.data_types.get(types[field_num], ())
+        return ()
+
+    def _entry(self, segment_name):
+        """Return (field descriptions, field data types) of a segment"""
+        entry = self._fields.get(segment_name)
+        if entry is None:
+            span = self._offsets.get(segment_name)
+            if span is None:
+                return (), ()
+            offset, length = span
+            # Unpacking twice from two threads gives equal tuples
+            entry = self._fields[segment_name] = marshal.loads(self._blob[offset:offset + length])
+        return entry
+
+    def field(self, segment_name, field_num, default="Unknown Field"):
+        """Return the description of field ``field_num`` (an int) of a segment"""
+        fields = self.fields(segment_name)
+        if 0 < field_num < len(fields):
+            return fields[field_num] or default
+        return default
+
+    def save(self, path, source_size, source_mtime_ns):
+        """Write the tables to path, replacing any existing file atomically"""
+        index = marshal.dumps((self.segments, self.events, self.data_types, self._offsets))
+        header = struct.pack(HEADER_FORMAT, DEFINITIONS_MAGIC, DEFINITIONS_VERSION,
+                             source_size, source_mtime_ns, len(index))
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(header)
+            f.write(index)
+            f.write(self._blob)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, source_size, source_mtime_ns):
+        """Read cached tables; raises ValueError if the file is invalid or stale"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        header_size = struct.calcsize(HEADER_FORMAT)
+        if len(data) < header_size:
+            raise ValueError(f"Truncated definitions cache: {path}")
+        magic, version, size, mtime_ns, index_size = struct.unpack_from(HEADER_FORMAT, data)
+        if magic != DEFINITIONS_MAGIC or version != DEFINITIONS_VERSION:
+            raise ValueError(f"Not a definitions cache of version {DEFINITIONS_VERSION}: {path}")
+        if (size, mtime_ns) != (source_size, source_mtime_ns):
+            raise ValueError(f"Stale definitions cache: {path}")
+        try:
+            segments, events, data_types, offsets = marshal.loads(data[header_size:header_size + index_size])
+        except (EOFError, TypeError, ValueError):
+            raise ValueError(f"Corrupt definitions cache: {path}")
+        blob = data[header_size + index_size:]
+        if sum(length for _, length in offsets.values()) != len(blob):
+            raise ValueError(f"Truncated definitions cache: {path}")
+        return cls(segments, events, data_types, offsets, blob)
+
+
+def _by_number(table):
+    """Return the values of a {field number string: value} dict as a tuple indexed by number"""
+    if not table:
+        return ()
+    numbers = [int(number) for number in table]
+    values = [None] * (max(numbers, default=0) + 1)
+    for number, value in zip(numbers, table.values()):
+        values[number] = value
+    return tuple(values)
+
+
+def cache_path(version, overlay=None):
+    """Return the cache file of a version's tables, with an OverlayFile if given"""
+    name = f'{version}.{overlay.digest[:16]}' if overlay is not None else version
+    # marshal's format depends on the interpreter, like a .pyc
+    return os.path.join(os.path.dirname(SOURCE_PATH), '__pycache__',
+                        f'hl7_definitions.{name}.{sys.implementation.cache_tag}.defs')
+
+
+@lru_cache(maxsize=256)
+def resolve_version(version):
+    """Return the supported version whose tables describe messages of MSH-12 ``version``"""
+    while version:
+        if version in SUPPORTED_VERSIONS:
+            return version
+        version = version.rpartition('.')[0]
+    return DEFAULT_VERSION
+
+
+def read_overlay(path):
+    """Read an overlay file into an OverlayFile; it is only parsed if its tables are not cached"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return OverlayFile(os.path.abspath(path), hashlib.sha256(data).hexdigest(), data)
+
+
+def parse_overlay(overlay):
+    """Parse and check an OverlayFile; returns (segments, fields, types, data_types, events)"""
+    try:
+        if overlay.path.endswith('.toml'):
+            try:
+                import tomllib
+            except ImportError:
+                try:
+                    import tomli as tomllib
+                except ImportError:
+                    raise ValueError("TOML overlays need Python 3.11 or the tomli package")
+            content = tomllib.loads(overlay.data.decode('utf-8'))
+        else:
+            content = json.loads(overlay.data)
+        if not isinstance(content, dict):
+            raise ValueError("expected a table of " + ", ".join(OVERLAY_TABLES))
+        unknown = set(content) - set(OVERLAY_TABLES)
+        if unknown:
+            raise ValueError(f"unknown tables {', '.join(sorted(unknown))}")
+
+        segments = _names(content.get('segments', {}), 'segments')
+        events = _names(content.get('events', {}), 'events')
+        data_types = {}
+        for name, components in _table(content.get('data_types', {}), 'data_types').items():
+            if not isinstance(components, list) or not all(isinstance(c, str) for c in components):
+                raise ValueError(f"data type {name} must be a list of component descriptions")
+            data_types[name] = components
+        fields, types = {}, {}
+        for segment_name, entries in _table(content.get('fields', {}), 'fields').items():
+            fields[segment_name], types[segment_name] = {}, {}
+            for number, entry in _table(entries, f'fields of {segment_name}').items():
+                if not number.isdigit() or int(number) < 1:
+                    raise ValueError(f"{segment_name} field number {number!r} is not a positive integer")
+                # A table may give only the type, keeping the standard description
+                if isinstance(entry, dict) and set(entry) <= {'description', 'type'}:
+                    description, data_type = entry.get('description'), entry.get('type')
+                else:
+                    description, data_type = entry, None
+                if (not isinstance(description, (str, type(None))) or not isinstance(data_type, (str, type(None)))
+                        or description is data_type is None):
+                    raise ValueError(f"{segment_name}-{number} must be a description or "
+                                     "a table with a description and/or a type")
+                if description is not None:
+                    fields[segment_name][number] = description
+                if data_type is not None:
+                    types[segment_name][number] = data_type
+    except ValueError as e:
+        raise ValueError(f"Invalid overlay {overlay.path}: {e}")
+    return segments, fields, types, data_types, events
+
+
+def _table(value, name):
+    if not isinstance(value, dict):
+        raise ValueError(f"{name} must be a table")
+    return value
+
+
+def _names(value, name):
+    """Check a {code: description} table"""
+    for code, description in _table(value, name).items():
+        if not isinstance(description, str):
+            raise ValueError(f"{name}: the description of {code} must be a string")
+    return value
+
+
+def compile_definitions(version=DEFAULT_VERSION, overlay=None):
+    """Compile the tables of a supported version from hl7_definitions and an OverlayFile"""
+    from .hl7_definitions import HL7_SEGMENTS, HL7_FIELDS, ADT_CODES, VERSION_FIELD_COUNTS, VERSION_FIELD_NAMES
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unsupported HL7 version: {version}")
+    fields = dict(HL7_FIELDS)
+    for segment_name, count in VERSION_FIELD_COUNTS.get(version, {}).items():
+        fields[segment_name] = {number: description for number, description in fields[segment_name].items()
+                                if int(number) <= count}
+    for segment_name, names in VERSION_FIELD_NAMES.get(version, {}).items():
+        fields[segment_name] = {**fields[segment_name], **names}
+    if overlay is None:
+        return CompiledDefinitions.compile(HL7_SEGMENTS, fields, ADT_CODES)
+
+    segments, overlay_fields, types, data_types, events = parse_overlay(overlay)
+    for segment_name, names in overlay_fields.items():
+        fields[segment_name] = {**fields.get(segment_name, {}), **names}
+    return CompiledDefinitions.compile({**HL7_SEGMENTS, **segments}, fields, {**ADT_CODES, **events},
+                                       types, data_types)
+
+
+def load_definitions(version=DEFAULT_VERSION, rebuild=False, overlay=None):
+    """Return the tables of a supported version, from the cache if it matches hl7_definitions.py.
+
+    The cache is (re)written when missing or stale; if it cannot be written
+    the tables are still returned.
+    """
+    path = cache_path(version, overlay)
+    stat = os.stat(SOURCE_PATH)
+    if not rebuild:
+        try:
+            return CompiledDefinitions.load(path, stat.st_size, stat.st_mtime_ns)
+        except (OSError, ValueError):
+            pass
+    definitions = compile_definitions(version, overlay)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        definitions.save(path, stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        pass
+    return definitions
+
+
+# Loaded tables by supported version, with the overlay in use; both are
+# replaced together by set_overlay()
+_loaded = {}
+_overlay = None
+_environment_read = False
+_loaded_lock = threading.Lock()
+
+
+def definitions(version=None):
+    """Return the process-wide tables for MSH-12 ``version``, loading them on first use"""
+    version = resolve_version(version)
+    tables = _loaded.get(version)
+    if tables is None:
+        with _loaded_lock:
+            _read_environment()
+            tables = _loaded.get(version)
+            if tables is None:
+                tables = _loaded[version] = load_definitions(version, overlay=_overlay)
+    return tables
+
+
+def set_overlay(path):
+    """Use the overlay file at ``path`` from now on, or no overlay for None; returns its OverlayFile.
+
+    Structures built afterwards use the new tables; those built before keep
+    theirs. Setting the same overlay again reloads it only if its contents
+    changed. Raises ValueError, and keeps the current overlay, if the file
+    is invalid.
+    """
+    global _loaded, _overlay, _environment_read
+    overlay = read_overlay(path) if path is not None else None
+    with _loaded_lock:
+        _environment_read = True
+        if _overlay_key(overlay) != _overlay_key(_overlay):
+            # Check the new overlay before swapping; other versions load on first use
+            loaded = {DEFAULT_VERSION: load_definitions(DEFAULT_VERSION, overlay=overlay)}
+            _loaded, _overlay = loaded, overlay
+    return overlay
+
+
+def current_overlay():
+    """Return the OverlayFile in use, or None"""
+    with _loaded_lock:
+        _read_environment()
+        return _overlay
+
+
+def _overlay_key(overlay):
+    return None if overlay is None else (overlay.path, overlay.digest)
+
+
+def _read_environment():
+    """Use the overlay named by OVERLAY_VARIABLE unless set_overlay() came first; call with the lock held"""
+    global _overlay, _environment_read
+    if not _environment_read:
+        # Marked first, so a broken overlay is reported once, not on every lookup
+        _environment_read = True
+        path = os.environ.get(OVERLAY_VARIABLE)
+        if path:
+            try:
+                overlay = read_overlay(path)
+                # Parses the overlay if its tables are not cached yet
+                tables = load_definitions(DEFAULT_VERSION, overlay=overlay)
+            except (OSError, ValueError) as e:
+                warnings.warn(f"Ignoring {OVERLAY_VARIABLE}={path}, using the built-in definitions: {e}",
+                              RuntimeWarning, stacklevel=3)
+                return
+            _loaded[DEFAULT_VERSION] = tables
+            _overlay = overlay
+
+
+def segment_description(segment_name, default="Unknown Segment", version=None):
+    """Return the description of a segment"""
+    return definitions(version).segments.get(segment_name, default)
+
+
+def field_description(segment_name, field_num, default="Unknown Field", version=None):
+    """Return the description of field ``field_num`` (an int) of a segment"""
+    return definitions(version).field(segment_name, field_num, default)
+
+
+def event_description(event_code, version=None):
+    """Return the description of an ADT trigger event, or None"""
+    return definitions(version).events.get(event_code)
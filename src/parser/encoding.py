@@ -0,0 +1,129 @@
+"""Encoding characters read from MSH-1/MSH-2.
+
+Every message declares its own delimiters: MSH-1 is the field separator
+and MSH-2 lists the component, repetition, escape and subcomponent
+characters (plus an optional truncation character in v2.7+). Each
+distinct set is compiled once into an EncodingCharacters object holding
+the delimiter regex and escape decoder, and the object is shared by
+every message that uses the same set. Its ``binary`` counterpart holds
+the same delimiters as bytes for tokenizing undecoded buffers.
+"""
+import re
+from functools import lru_cache
+
+DEFAULT_FIELD_SEPARATOR = '|'
+DEFAULT_ENCODING_CHARACTERS = '^~\\&'
+SEGMENT_TERMINATORS = '\r\n'
+
+# Segments that declare the delimiters in their fields 1 and 2 (FHS and BHS
+# start batch files and batches the same way MSH starts a message)
+HEADER_SEGMENTS = ('MSH', 'FHS', 'BHS')
+
+
+class EncodingCharacters:
+    """Precompiled delimiters and escape decoder for one encoding set"""
+
+    __slots__ = (
+        'field', 'component', 'repetition', 'escape', 'subcomponent', 'truncation',
+        'value_delimiters', 'composite_delimiters', 'binary', '_escape_pattern', '_escapes',
+    )
+
+    def __init__(self, field, encoding_chars):
+        if len(field) != 1 or len(encoding_chars) < 2:
+            raise ValueError(f"Invalid HL7 encoding characters: {field!r} {encoding_chars!r}")
+        padded = encoding_chars + DEFAULT_ENCODING_CHARACTERS[len(encoding_chars):]
+        self.field = field
+        self.component = padded[0]
+        self.repetition = padded[1]
+        self.escape = padded[2]
+        self.subcomponent = padded[3]
+        self.truncation = padded[4] if len(padded) > 4 else None
+
+        # Characters that split a field repetition into components and subcomponents
+        self.value_delimiters = re.compile('[' + re.escape(self.component + self.subcomponent) + ']')
+        # Any of them or a repetition separator makes a field composite
+        self.composite_delimiters = re.compile(
+            '[' + re.escape(self.repetition + self.component + self.subcomponent) + ']')
+        # Delimiters outside ASCII cannot be searched for in encoded bytes
+        delimiters = field + padded[:4]
+        self.binary = BinaryDelimiters(self) if delimiters.isascii() else None
+
+        # \F\ \S\ \T\ \R\ \E\ and \Xhh..\ written with this set's escape character
+        esc = re.escape(self.escape)
+        self._escape_pattern = re.compile(f'{esc}(F|S|T|R|E|X(?:[0-9A-Fa-f]{{2}})+){esc}')
+        self._escapes = {
+            'F': self.field,
+            'S': self.component,
+            'T': self.subcomponent,
+            'R': self.repetition,
+            'E': self.escape,
+        }
+
+    def unescape(self, value):
+        """Decode escape sequences in a value in a single pass"""
+        if self.escape not in value:
+            return value
+        return self._escape_pattern.sub(self._replace_escape, value)
+
+    def _replace_escape(self, match):
+        code = match.group(1)
+        if code[0] == 'X':
+            return bytes.fromhex(code[1:]).decode('latin-1')
+        return self._escapes[code]
+
+    def __repr__(self):
+        return (f"EncodingCharacters({self.field!r}, "
+                f"{self.component + self.repetition + self.escape + self.subcomponent!r})")
+
+
+class BinaryDelimiters:
+    """The delimiters of an EncodingCharacters set as bytes"""
+
+    __slots__ = (
+        'field', 'component', 'repetition', 'escape', 'subcomponent', 'value_delimiters', 'composite_delimiters',
+    )
+
+    def __init__(self, encoding):
+        self.field = encoding.field.encode('ascii')
+        self.component = encoding.component.encode('ascii')
+        self.repetition = encoding.repetition.encode('ascii')
+        self.escape = encoding.escape.encode('ascii')
+        self.subcomponent = encoding.subcomponent.encode('ascii')
+        self.value_delimiters = re.compile(b'[' + re.escape(self.component + self.subcomponent) + b']')
+        self.composite_delimiters = re.compile(
+            b'[' + re.escape(self.repetition + self.component + self.subcomponent) + b']')
+
+
+@lru_cache(maxsize=64)
+def get_encoding(field=DEFAULT_FIELD_SEPARATOR, encoding_chars=DEFAULT_ENCODING_CHARACTERS):
+    """Return the shared EncodingCharacters for a delimiter set"""
+    return EncodingCharacters(field, encoding_chars)
+
+
+def read_encoding(text, pos=0):
+    """Read the encoding characters from the MSH segment starting at pos.
+
+    FHS and BHS headers are read the same way. Falls back to the standard
+    ``|^~\\&`` set when the text does not start with a usable header.
+    """
+    if not text.startswith(HEADER_SEGMENTS, pos) or len(text) < pos + 5:
+        return DEFAULT_ENCODING
+    field = text[pos + 3]
+    if field in SEGMENT_TERMINATORS:
+        return DEFAULT_ENCODING
+    end = pos + 4
+    while end < len(text) and text[end] != field and text[end] not in SEGMENT_TERMINATORS:
+        end += 1
+    encoding_chars = text[pos + 4:end]
+    if len(encoding_chars) < 2:
+        return DEFAULT_ENCODING
+    return get_encoding(field, encoding_chars)
+
+
+def read_binary_encoding(data):
+    """Read the encoding characters from the MSH segment at the start of a buffer"""
+    # MSH, MSH-1 and an MSH-2 of at most five characters fit well within this
+    return read_encoding(bytes(data[:32]).decode('latin-1'))
+
+
+DEFAULT_ENCODING = get_encoding(DEFAULT_FIELD_SEPARATOR, DEFAULT_ENCODING_CHARACTERS)
@@ -448,6 +448,24 @@ HL7_FIELDS = {
     }
 }
 
+# How the HL7 versions differ from the fields above, which are the union
+# of all of them: the number of fields every segment above had in each
+# supported version, and fields that were named differently
+VERSION_FIELD_COUNTS = {
+    '2.3': {'MSH': 19, 'EVN': 6, 'PID': 30, 'NK1': 37, 'PV1': 52, 'OBR': 43, 'OBX': 17},
+    '2.3.1': {'MSH': 20, 'EVN': 6, 'PID': 30, 'NK1': 37, 'PV1': 52, 'OBR': 43, 'OBX': 17},
+    '2.4': {'MSH': 21, 'EVN': 7, 'PID': 38, 'NK1': 39, 'PV1': 52, 'OBR': 47, 'OBX': 17},
+    '2.5': {'MSH': 21, 'EVN': 7, 'PID': 39, 'NK1': 39, 'PV1': 52, 'OBR': 49, 'OBX': 19},
+    '2.5.1': {'MSH': 21, 'EVN': 7, 'PID': 39, 'NK1': 39, 'PV1': 52, 'OBR': 49, 'OBX': 25},
+    '2.6': {'MSH': 21, 'EVN': 7, 'PID': 39, 'NK1': 39, 'PV1': 52, 'OBR': 50, 'OBX': 25},
+    '2.7': {'MSH': 25, 'EVN': 7, 'PID': 40, 'NK1': 41, 'PV1': 54, 'OBR': 53, 'OBX': 26},
+    '2.8': {'MSH': 25, 'EVN': 7, 'PID': 40, 'NK1': 41, 'PV1': 54, 'OBR': 54, 'OBX': 28}
+}
+
+VERSION_FIELD_NAMES = {
+    '2.4': {'MSH': {'21': 'Conformance Statement ID'}}
+}
+
 # ADT Event Codes
 ADT_CODES = {
     'A01': 'Admit/visit notification',
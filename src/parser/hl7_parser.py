@@ -1,35 +1,134 @@
-from hl7apy.parser import parse_message
-from hl7apy.core import Message
 import io
+import codecs
 import re
-import sys
-
-# Try to import definitions or provide fallback
-try:
-    from .hl7_definitions import HL7_SEGMENTS, HL7_FIELDS, ADT_CODES
-    print("Successfully imported HL7 definitions", file=sys.stderr)
-except ImportError as e:
-    print(f"Error importing HL7 definitions: {e}", file=sys.stderr)
-    # Fallback empty definitions
-    HL7_SEGMENTS = {}
-    HL7_FIELDS = {}
-    ADT_CODES = {}
+from functools import partial
+
+from .message import HL7Message
+from .projection import as_projection
+from .reader import iter_messages, DEFAULT_CHUNK_SIZE
+from .charsets import wide_codec, DECODE_ERRORS
+from .encoding import read_encoding
+from .tokenizer import segment_spans
+from .structure import StructureNode
+
+from .definitions import definitions
+
+# Parsing engines understood by HL7Parser
+ENGINE_NATIVE = 'native'
+ENGINE_HL7APY = 'hl7apy'
+ENGINES = (ENGINE_NATIVE, ENGINE_HL7APY)
+
+
+def parse(data, projection=None):
+    """Parse one HL7 message from text or bytes and return it as an HL7Message.
+
+    Bytes are decoded with the MSH-18 character set, as in
+    HL7Parser.parse_bytes(). The function keeps no state, and messages
+    are immutable (their lazily split values are cached, and filling a
+    cache twice is harmless), so any number of threads can call it and
+    share its results without locks.
+    """
+    projection = as_projection(projection)
+    if isinstance(data, str):
+        data = data.strip()
+        if not data.startswith('MSH'):
+            raise ValueError("Failed to parse HL7 message: message must start with an MSH segment")
+        return HL7Message(data, projection)
+
+    # Views (e.g. of a memory-mapped archive) are copied once, here
+    data = bytes(data)
+    codec = wide_codec(data)
+    if codec is not None:
+        # UTF-16/UTF-32 text has to be decoded as a whole first
+        return parse(data.decode(codec, DECODE_ERRORS), projection)
+    data = _strip_bytes(data)
+    if not data.startswith(b'MSH'):
+        raise ValueError("Failed to parse HL7 message: message must start with an MSH segment")
+    return HL7Message(data, projection)
+
 
 class HL7Parser:
-    def __init__(self):
+    def __init__(self, engine=ENGINE_NATIVE, projection=None):
+        """Create a parser using the native tokenizer or the hl7apy backend.
+
+        The native engine is the default for all HL7 versions. hl7apy is
+        only used when requested explicitly, as a validating backend.
+
+        ``projection`` (native engine only) selects the segments and fields
+        to parse, e.g. ``{"MSH": [7, 9, 10], "PID": [3, 5]}``; everything
+        else is skipped while scanning.
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown parsing engine: {engine}")
+        if projection is not None and engine != ENGINE_NATIVE:
+            raise ValueError("Projections are only supported by the native engine")
+        self.engine = engine
+        self.projection = as_projection(projection)
         self.message = None
         self.raw_message = None
         
     def parse_text(self, text):
         """Parse HL7 message from text input"""
+        # Remove any whitespace and process the message
+        text = text.strip()
+        self.raw_message = text
+
+        if self.engine == ENGINE_HL7APY:
+            return self._parse_hl7apy(text)
+
+        self.message = None
+        self.message = parse(text, self.projection)
+        return True
+
+    def parse(self, data):
+        """Parse one message from text or bytes and return it, leaving the parser unchanged.
+
+        Unlike parse_text() and parse_bytes(), this stores nothing on the
+        parser, so one configured parser can serve any number of threads
+        or executor tasks at once. Native engine only.
+        """
+        if self.engine != ENGINE_NATIVE:
+            raise ValueError("Stateless parsing is only supported by the native engine")
+        return parse(data, self.projection)
+
+    def parse_bytes(self, data):
+        """Parse an HL7 message from raw bytes.
+
+        With the native engine segment and field boundaries are found on
+        the undecoded buffer, and values are decoded one at a time when
+        read, using the character set named in MSH-18.
+        """
+        # Views (e.g. of a memory-mapped archive) are copied once, here
+        data = bytes(data)
+        codec = wide_codec(data)
+        if codec is not None:
+            # UTF-16/UTF-32 text has to be decoded as a whole first
+            return self.parse_text(data.decode(codec, DECODE_ERRORS))
+
+        data = _strip_bytes(data)
+        self.raw_message = data
+
+        if self.engine == ENGINE_HL7APY:
+            # hl7apy needs text; decode once with the message's own charset
+            return self.parse_text(HL7Message(data).raw_text[:])
+
+        self.message = None
+        self.message = parse(data, self.projection)
+        return True
+
+    def set_message(self, message):
+        """Use an already parsed HL7Message, e.g. one from iter_messages()"""
+        self.message = message
+        self.raw_message = message.raw_text if isinstance(message.raw_text, str) else message.buffer
+        return True
+
+    def _parse_hl7apy(self, text):
+        """Parse with hl7apy, the opt-in validating backend"""
         try:
-            # Remove any whitespace and process the message
-            text = text.strip()
-            self.raw_message = text
-            
-            # Detect HL7 version from the message
-            msh_segment = text.split('\n')[0]
-            version = self._extract_version(msh_segment)
+            from hl7apy.parser import parse_message
+
+            # Detect HL7 version from the first segment, whatever its terminator
+            version = self._extract_version(text)
             
             # Try to parse with version validation disabled if it's 2.5.1
             if version == '2.5.1':
@@ -37,8 +136,9 @@ class HL7Parser:
                 # Create a simple structure directly since hl7apy doesn't support forcing versions
                 self._create_simple_structure(text)
             else:
-                # Use default parser for supported versions
-                self.message = parse_message(text)
+                # Use default parser for supported versions; hl7apy only
+                # understands \r between segments
+                self.message = parse_message('\r'.join(text[start:end] for start, end in segment_spans(text)))
                 
             return True
         except Exception as e:
@@ -52,20 +152,45 @@ class HL7Parser:
                 
             raise ValueError(f"Failed to parse HL7 message: {str(e)}")
     
-    def parse_file(self, file_path):
-        """Parse HL7 message from file path"""
+    def parse_file(self, file_path, binary=False):
+        """Parse HL7 message from file path.
+
+        With ``binary=True`` the file is read as bytes and parsed with
+        parse_bytes(), so values are decoded with the MSH-18 charset
+        instead of the platform default encoding.
+        """
         try:
-            with open(file_path, 'r') as f:
+            if binary:
+                with open(file_path, 'rb') as f:
+                    return self.parse_bytes(f.read())
+            # newline='' keeps \r terminators as-is; the tokenizer handles them
+            with open(file_path, 'r', newline='') as f:
                 content = f.read().strip()
             return self.parse_text(content)
         except Exception as e:
             self.message = None
             raise ValueError(f"Failed to read or parse file: {str(e)}")
     
-    def _extract_version(self, msh_segment):
-        """Extract the HL7 version from the MSH segment"""
+    def iter_file(self, file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Parse every message of a (batch) file in turn, streaming.
+
+        Unlike parse_file(), which reads a whole file as one message, the
+        file is read ``chunk_size`` bytes at a time, so files of any size
+        use constant memory. Each message is yielded and also becomes
+        ``self.message`` until the next one is parsed. Native engine only.
+        """
+        if self.engine != ENGINE_NATIVE:
+            raise ValueError("Streaming files is only supported by the native engine")
+        for message in iter_messages(file_path, chunk_size, self.projection):
+            self.set_message(message)
+            yield message
+
+    def _extract_version(self, text):
+        """Extract the HL7 version from the MSH segment at the start of text"""
         try:
-            fields = msh_segment.split('|')
+            start, end = next(segment_spans(text))
+            msh_segment = text[start:end]
+            fields = msh_segment.split(read_encoding(msh_segment).field)
             if len(fields) >= 12:
                 return fields[11]
             return None
@@ -81,7 +206,7 @@ class HL7Parser:
         if not self.message:
             return None
         
-        if isinstance(self.message, SimpleHL7Message):
+        if isinstance(self.message, HL7Message):
             return self.message.get_structure()
         
         # First, scan the message to count total segments of each type
@@ -89,7 +214,10 @@ class HL7Parser:
         
         # Get the structure with segment counting
         segment_counts = {}
-        return self._traverse_element(self.message, segment_counts, segment_totals)
+        encoding = read_encoding(self.raw_message)
+        # Descriptions come from the definitions of the message's version
+        version = (self._extract_version(self.raw_message) or '').split(encoding.component)[0]
+        return self._traverse_element(self.message, segment_counts, segment_totals, encoding, definitions(version))
     
     def _count_segment_types(self, element):
         """Count how many of each segment type are in the message"""
@@ -107,13 +235,14 @@ class HL7Parser:
         
         return totals
         
-    def _traverse_element(self, element, segment_counts, segment_totals, parent_segment=None):
-        """Recursively traverse HL7 elements to build a hierarchical structure"""
+    def _traverse_element(self, element, segment_counts, segment_totals, encoding, tables, parent_segment=None):
+        """Build the lazy structure node for an hl7apy element and its descendants"""
         element_name = element.name
         display_name = element_name
         
         # If this is a segment (3 letter name at top level)
-        if len(element_name) == 3 and element_name.isalpha() and parent_segment is None:
+        is_segment = len(element_name) == 3 and element_name.isalpha() and parent_segment is None
+        if is_segment:
             # Initialize counter for this segment type if not exists
             if element_name not in segment_counts:
                 segment_counts[element_name] = 1
@@ -135,182 +264,85 @@ class HL7Parser:
             elif element_name.isdigit():
                 display_name = element_name
             
-        # Add segment/field description
-        description = ""
-        if len(element_name) == 3 and element_name.isalpha() and parent_segment is None:
-            # Segment description
-            description = HL7_SEGMENTS.get(element_name, "Unknown Segment")
-        elif parent_segment is not None and element_name.isdigit():
-            # Field description
-            if parent_segment in HL7_FIELDS and element_name in HL7_FIELDS[parent_segment]:
-                description = HL7_FIELDS[parent_segment][element_name]
-            else:
-                description = f"Field {element_name}"
-                
         value = str(element.value) if hasattr(element, 'value') else None
         
         # Special case for MSH-1 field - field separator character
         if parent_segment == 'MSH' and element_name == '1':
-            # MSH-1 is always the field separator character (|)
-            value = '|'
-        
+            # MSH-1 is the field separator declared by the message itself
+            value = encoding.field
+
+        # Descriptions and children are only resolved when first read
+        children = None
+        if hasattr(element, 'children'):
+            children = partial(self._traverse_children, element, segment_counts, segment_totals, encoding, tables,
+                               parent_segment)
+
+        return StructureNode(
+            display_name,  # Use the appropriate display name
+            raw_name=element_name,  # Keep the original name
+            description=partial(self._describe_element, element_name, is_segment, parent_segment, value, encoding,
+                                tables),
+            value=value,
+            children=children,
+            has_children=bool(children) and len(element.children) > 0
+        )
+
+    def _traverse_children(self, element, segment_counts, segment_totals, encoding, tables, parent_segment):
+        """Build the structure nodes for the children of an hl7apy element"""
+        return [self._traverse_element(child, segment_counts, segment_totals, encoding, tables, parent_segment)
+                for child in element.children]
+
+    def _describe_element(self, element_name, is_segment, parent_segment, value, encoding, tables):
+        """Look up the description of a segment or field in the definitions ``tables``"""
+        description = ""
+        if is_segment:
+            # Segment description
+            description = tables.segments.get(element_name, "Unknown Segment")
+        elif parent_segment is not None and element_name.isdigit():
+            # Field description
+            description = tables.field(parent_segment, int(element_name), f"Field {element_name}")
+
         # Special handling for MSH-9 (Message Type) field
-        if parent_segment == 'MSH' and element_name == '9' and value and '^' in value:
+        component = encoding.component
+        if parent_segment == 'MSH' and element_name == '9' and value and component in value:
             # Try to extract the message type and trigger event
-            parts = value.split('^')
+            parts = value.split(component)
             if len(parts) >= 2 and parts[0] == 'ADT':
-                event_code = parts[1]
-                if event_code in ADT_CODES:
-                    description += f" - {ADT_CODES[event_code]}"
-                    
-        result = {
-            'name': display_name,  # Use the appropriate display name 
-            'raw_name': element_name,  # Keep the original name
-            'description': description,
-            'value': value,
-            'children': []
-        }
-        
-        # If the element has children
-        if hasattr(element, 'children'):
-            for child in element.children:
-                result['children'].append(self._traverse_element(child, segment_counts, segment_totals, parent_segment))
-                
-        return result
+                event = tables.events.get(parts[1])
+                if event is not None:
+                    description += f" - {event}"
 
+        return description
 
-class SimpleHL7Message:
-    """A simple HL7 message parser for when hl7apy fails due to version incompatibility"""
-    
-    def __init__(self, raw_text):
-        self.raw_text = raw_text
-        self.segments = []
-        self._parse()
-        
-    def _parse(self):
-        """Parse the raw HL7 message into segments"""
-        lines = self.raw_text.split('\n')
-        
-        for line in lines:
-            if not line.strip():
-                continue
-                
-            # Split the segment into fields
-            fields = line.split('|')
-            segment_name = fields[0]
-            
-            segment = {
-                'name': segment_name,
-                'fields': []
-            }
-            
-            # Special case for MSH segment - handle MSH-1 field correctly
-            if segment_name == 'MSH':
-                # MSH-1 is the field separator character (|)
-                segment['fields'].append({
-                    'index': 1,
-                    'value': '|'  # This is always | per HL7 standard
-                })
-                
-                # Continue with the rest of fields, but offset by 1
-                for i, field in enumerate(fields[1:], 2):
-                    segment['fields'].append({
-                        'index': i,
-                        'value': field
-                    })
-            else:
-                # Regular segment - add each field to the segment
-                for i, field in enumerate(fields[1:], 1):
-                    segment['fields'].append({
-                        'index': i,
-                        'value': field
-                    })
-                
-            self.segments.append(segment)
-    
-    def get_structure(self):
-        """Get a hierarchical structure of the message"""
-        if not self.segments:
-            return None
-            
-        result = {
-            'name': 'Message',
-            'value': "",  # Remove Simplified Parser text
-            'description': "HL7 Message",
-            'children': []
-        }
-        
-        # First pass - count total segments of each type
-        segment_totals = {}
-        for segment in self.segments:
-            segment_name = segment['name']
-            segment_totals[segment_name] = segment_totals.get(segment_name, 0) + 1
-            
-        # Track segment counts for the second pass
-        segment_counts = {}
-        
-        # Add each segment as a child
-        for segment in self.segments:
-            segment_name = segment['name']
-            
-            # Count segments of the same type
-            if segment_name not in segment_counts:
-                segment_counts[segment_name] = 1
-            else:
-                segment_counts[segment_name] += 1
-            
-            # Only add segment number if there are multiple segments of this type
-            display_name = segment_name
-            if segment_totals[segment_name] > 1:
-                display_name = f"{segment_name} #{segment_counts[segment_name]}"
-            
-            segment_node = {
-                'name': display_name,
-                'raw_name': segment_name,
-                'description': HL7_SEGMENTS.get(segment_name, "Unknown Segment"),
-                'value': '',
-                'children': []
-            }
-            
-            # Add fields as children of the segment
-            for field in segment['fields']:
-                field_index = str(field['index'])
-                description = "Unknown Field"
-                
-                # Look up field description if available
-                if segment_name in HL7_FIELDS and field_index in HL7_FIELDS[segment_name]:
-                    description = HL7_FIELDS[segment_name][field_index]
-                
-                # Special handling for MSH-9 (Message Type) field
-                if segment_name == 'MSH' and field_index == '9' and field['value'] and '^' in field['value']:
-                    # Try to extract the message type and trigger event
-                    parts = field['value'].split('^')
-                    if len(parts) >= 2 and parts[0] == 'ADT':
-                        event_code = parts[1]
-                        if event_code in ADT_CODES:
-                            description += f" - {ADT_CODES[event_code]}"
-                
-                field_node = {
-                    'name': f"{segment_name}-{field_index}",  # Use dash format for segment fields
-                    'raw_name': field_index,
-                    'description': description,
-                    'value': field['value'],
-                    'children': []
-                }
-                segment_node['children'].append(field_node)
-                
-            result['children'].append(segment_node)
-            
-        return result
-        
-    @property
-    def value(self):
-        return None
-        
-    @property
-    def name(self):
-        return "HL7Message"
-        
-    @property
-    def children(self):
-        return []
\ No newline at end of file
+
+def _strip_bytes(data):
+    """Strip surrounding whitespace, copying the buffer only when needed.
+
+    Trailing segment terminators and an MLLP end block are left in place
+    since the tokenizer skips them anyway. A UTF-8 byte order mark is
+    removed as well.
+    """
+    if data.startswith(codecs.BOM_UTF8):
+        data = data[len(codecs.BOM_UTF8):]
+    start, end = 0, len(data)
+    while start < end and data[start] in _WHITESPACE:
+        start += 1
+    while end > start and data[end - 1] in _WHITESPACE:
+        end -= 1
+    if start == 0 and not data[end:].strip(b'\r\n'):
+        return data
+    return data[start:end]
+
+
+# bytes.isspace() characters
+_WHITESPACE = b' \t\n\r\x0b\x0c'
+
+
+class SimpleHL7Message(HL7Message):
+    """Fallback structure used when hl7apy rejects a message version.
+
+    It is backed by the native tokenizer, so it produces the same
+    structure as the default engine.
+    """
+
+    __slots__ = ()
@@ -0,0 +1,258 @@
+"""Persistent sidecar index for HL7 archives.
+
+An ArchiveIndex records, for every message of an archive, its byte
+offset and length, MSH-10 control ID, MSH-7 timestamp, MSH-9 message type
+and a CRC-32 of its bytes. It is saved next to the archive as
+``<archive>.idx`` together with the archive's size and mtime, and is
+rebuilt automatically when either changes.
+
+Everything is kept in ``array`` tables and one string blob, so an index
+costs well under 100 bytes per message in memory. Lookups by control ID
+and by time range binary-search permutations of the messages sorted by
+control ID and by timestamp, which are stored in the index file.
+
+File layout (version 1), integers in the byte order named in the header::
+
+    header   struct HEADER_FORMAT: magic, version, byte order, source size,
+             source mtime_ns, message count, string blob size
+    arrays   offsets (Q), lengths (Q), timestamps (q), checksums (I),
+             by_time (Q), by_control_id (Q), each ``count`` items, then
+             string_offsets (Q), ``2 * count + 1`` items
+    strings  UTF-8 blob: all control IDs, then all message types
+"""
+import os
+import struct
+import sys
+import zlib
+from array import array
+from collections import namedtuple
+from datetime import datetime
+
+from .hl7_parser import HL7Parser
+
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'HL7IDX'
+INDEX_VERSION = 1
+
+# magic, version, byte order ('<' or '>'), size, mtime_ns, count, blob size
+HEADER_FORMAT = '<6sHcQqQQ'
+
+# Only the indexed header fields are parsed while building
+INDEX_PROJECTION = {'MSH': [7, 9, 10]}
+
+IndexEntry = namedtuple('IndexEntry', 'offset length control_id timestamp message_type checksum')
+
+
+class StaleIndexError(ValueError):
+    """The index file does not match its archive and must be rebuilt"""
+
+
+class ArchiveIndex:
+    """Per-message offsets and MSH header fields of one archive"""
+
+    def __init__(self, source_size=0, source_mtime_ns=0):
+        self.source_size = source_size
+        self.source_mtime_ns = source_mtime_ns
+        self.offsets = array('Q')
+        self.lengths = array('Q')
+        self.timestamps = array('q')
+        self.checksums = array('I')
+        self.by_time = array('Q')
+        self.by_control_id = array('Q')
+        # Control ID n is strings[string_offsets[n]:string_offsets[n + 1]];
+        # message types follow the control IDs
+        self.string_offsets = array('Q', [0])
+        self.strings = b''
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def control_id(self, n):
+        """Return the MSH-10 control ID of message n"""
+        return self._string(n).decode('utf-8')
+
+    def message_type(self, n):
+        """Return the MSH-9 message type of message n"""
+        return self._string(len(self) + n).decode('utf-8')
+
+    def _string(self, k):
+        return self.strings[self.string_offsets[k]:self.string_offsets[k + 1]]
+
+    def entry(self, n):
+        """Return the IndexEntry of message n"""
+        return IndexEntry(self.offsets[n], self.lengths[n], self.control_id(n),
+                          self.timestamps[n], self.message_type(n), self.checksums[n])
+
+    def find(self, control_id):
+        """Return the numbers of the messages with an MSH-10 control ID"""
+        key = control_id.encode('utf-8')
+        order = self.by_control_id
+        pos = _bisect(len(order), lambda mid: self._string(order[mid]) < key)
+        found = []
+        while pos < len(order) and self._string(order[pos]) == key:
+            found.append(order[pos])
+            pos += 1
+        return sorted(found)
+
+    def between(self, start=None, end=None):
+        """Return the numbers of the messages with start <= MSH-7 < end, in time order.
+
+        Bounds may be datetimes or HL7 timestamps (``20230101``,
+        ``20230101120000``); None leaves that side open.
+        """
+        timestamps, order = self.timestamps, self.by_time
+        low, high = 0, len(order)
+        if start is not None:
+            key = timestamp_key(start)
+            low = _bisect(len(order), lambda mid: timestamps[order[mid]] < key)
+        if end is not None:
+            key = timestamp_key(end)
+            high = _bisect(len(order), lambda mid: timestamps[order[mid]] < key)
+        return order[low:high].tolist()
+
+    def matches(self, path):
+        """True if this index was built from the file at path as it is now"""
+        stat = os.stat(path)
+        return stat.st_size == self.source_size and stat.st_mtime_ns == self.source_mtime_ns
+
+    @classmethod
+    def build(cls, archive):
+        """Build the index of an open HL7Archive"""
+        stat = os.stat(archive.path)
+        index = cls(stat.st_size, stat.st_mtime_ns)
+        parser = HL7Parser(projection=INDEX_PROJECTION)
+        control_ids, message_types = [], []
+        for n in range(len(archive)):
+            start, end = archive.span(n)
+            view = archive.raw(n)
+            try:
+                checksum = zlib.crc32(view)
+                message = parser.parse(view)
+            finally:
+                view.release()
+            index.offsets.append(start)
+            index.lengths.append(end - start)
+            index.checksums.append(checksum)
+            index.timestamps.append(timestamp_key(message.get('MSH-7', '')))
+            control_ids.append(message.get('MSH-10', '').encode('utf-8'))
+            message_types.append(message.get('MSH-9', '').encode('utf-8'))
+
+        for value in control_ids + message_types:
+            index.string_offsets.append(index.string_offsets[-1] + len(value))
+        index.strings = b''.join(control_ids + message_types)
+        index.by_time = array('Q', sorted(range(len(index)), key=index.timestamps.__getitem__))
+        index.by_control_id = array('Q', sorted(range(len(index)), key=control_ids.__getitem__))
+        return index
+
+    def save(self, path):
+        """Write the index to path, replacing any existing file atomically"""
+        header = struct.pack(HEADER_FORMAT, INDEX_MAGIC, INDEX_VERSION, _BYTE_ORDER,
+                             self.source_size, self.source_mtime_ns, len(self), len(self.strings))
+        temp_path = path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(header)
+                for table in self._tables():
+                    table.tofile(f)
+                f.write(self.strings)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """Read an index file; raises ValueError if it is not a valid index"""
+        with open(path, 'rb') as f:
+            header = f.read(struct.calcsize(HEADER_FORMAT))
+            if len(header) != struct.calcsize(HEADER_FORMAT):
+                raise ValueError(f"Truncated index file: {path}")
+            magic, version, byteorder, size, mtime_ns, count, strings_size = struct.unpack(HEADER_FORMAT, header)
+            if magic != INDEX_MAGIC:
+                raise ValueError(f"Not an HL7 index file: {path}")
+            if version != INDEX_VERSION:
+                raise StaleIndexError(f"Unsupported index version {version}: {path}")
+
+            index = cls(size, mtime_ns)
+            index.string_offsets = array('Q')
+            try:
+                for table in index._tables():
+                    table.fromfile(f, 2 * count + 1 if table is index.string_offsets else count)
+            except EOFError:
+                raise ValueError(f"Truncated index file: {path}")
+            index.strings = f.read(strings_size)
+            if len(index.strings) != strings_size:
+                raise ValueError(f"Truncated index file: {path}")
+
+        if byteorder != _BYTE_ORDER:
+            for table in index._tables():
+                table.byteswap()
+        return index
+
+    def _tables(self):
+        return (self.offsets, self.lengths, self.timestamps, self.checksums,
+                self.by_time, self.by_control_id, self.string_offsets)
+
+
+# Byte order of the arrays this platform writes
+_BYTE_ORDER = b'<' if sys.byteorder == 'little' else b'>'
+
+
+def _bisect(size, is_before):
+    """Return the first position in 0..size for which is_before(position) is false"""
+    low, high = 0, size
+    while low < high:
+        mid = (low + high) // 2
+        if is_before(mid):
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+
+def timestamp_key(value):
+    """Return an HL7 timestamp or datetime as a sortable YYYYMMDDHHMMSS integer.
+
+    Fractional seconds and the time zone offset are ignored; missing parts
+    count as zero and unreadable values sort first (0).
+    """
+    if isinstance(value, datetime):
+        value = value.strftime('%Y%m%d%H%M%S')
+    digits = value.strip()[:14]
+    for pos, char in enumerate(digits):
+        if not char.isdigit():
+            digits = digits[:pos]
+            break
+    if len(digits) < 4:
+        return 0
+    return int(digits.ljust(14, '0'))
+
+
+def index_path(archive_path):
+    """Return the sidecar index path of an archive"""
+    return str(archive_path) + INDEX_SUFFIX
+
+
+def open_index(archive, rebuild=False):
+    """Return the up-to-date index of an open HL7Archive.
+
+    The sidecar file is used if it matches the archive's current size and
+    mtime; otherwise the index is built and the sidecar (re)written. If
+    the sidecar cannot be read or written, e.g. next to an archive in a
+    read-only directory, the index is only kept in memory.
+    """
+    path = index_path(archive.path)
+    if not rebuild and os.path.exists(path):
+        try:
+            index = ArchiveIndex.load(path)
+            if index.matches(archive.path):
+                return index
+        except (ValueError, OSError):
+            pass
+    index = ArchiveIndex.build(archive)
+    try:
+        index.save(path)
+    except OSError:
+        pass
+    return index
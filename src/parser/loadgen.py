@@ -0,0 +1,244 @@
+"""MLLP load generator and replay client.
+
+LoadGenerator sends messages to an MLLP receiver (an interface engine,
+or mllp.MLLPServer) over a pool of persistent connections. Each
+connection pipelines up to ``window`` unacknowledged messages, and every
+ACK is matched to its message to measure the round trip. Each message
+goes to the connection with the fewest unacknowledged messages, so one
+slow connection does not hold up the others.
+
+Messages come from replay_file(), which streams the messages of a file
+or archive through HL7Parser.iter_file() without loading it, or from
+generate_corpus(), which makes synthetic ADT traffic. Sending is paced
+in one of three ways: as fast as the receiver acknowledges, at a fixed
+``rate`` in messages/s, or following the messages' MSH-7 timestamps
+compressed by ``speed`` (``speed=60`` replays an hour in a minute).
+
+run() returns a LoadReport with counts, throughput and ACK latency
+percentiles.
+"""
+import asyncio
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+
+from .hl7_parser import HL7Parser
+from .index import timestamp_key
+from .mllp import frame, END_BLOCK, DEFAULT_HOST, DEFAULT_PORT
+
+DEFAULT_CONNECTIONS = 4
+# Unacknowledged messages per connection
+DEFAULT_WINDOW = 32
+# Seconds to wait for the last ACKs once everything is sent
+DEFAULT_TIMEOUT = 30.0
+
+LATENCY_PERCENTILES = (50, 90, 99)
+
+# ACK codes counted as accepted (original and enhanced mode)
+_ACCEPTED = (b'AA', b'CA')
+
+LoadReport = namedtuple('LoadReport', 'sent acked errors elapsed rate latency_ms max_latency_ms')
+
+
+class LoadGenerator:
+    """Send messages over a pool of pipelined MLLP connections and time the ACKs.
+
+    ``rate`` (messages/s) and ``speed`` (MSH-7 time compression) are
+    mutually exclusive; with neither, messages are sent as fast as the
+    windows allow.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, connections=DEFAULT_CONNECTIONS,
+                 window=DEFAULT_WINDOW, rate=None, speed=None, timeout=DEFAULT_TIMEOUT):
+        if connections < 1 or window < 1:
+            raise ValueError("connections and window must be positive")
+        if rate is not None and speed is not None:
+            raise ValueError("Use either a fixed rate or a replay speed, not both")
+        if (rate is not None and rate <= 0) or (speed is not None and speed <= 0):
+            raise ValueError("rate and speed must be positive")
+        self.host = host
+        self.port = port
+        self.connections = connections
+        self.window = window
+        self.rate = rate
+        self.speed = speed
+        self.timeout = timeout
+
+    def run(self, messages):
+        """Send (payload, timestamp) pairs and return a LoadReport"""
+        return asyncio.run(self.send(messages))
+
+    async def send(self, messages):
+        """Coroutine version of run()"""
+        loop = asyncio.get_running_loop()
+        # Set whenever a connection receives an ACK or fails
+        acked = asyncio.Event()
+        opened = await asyncio.gather(
+            *(_Connection.open(self.host, self.port, self.window, acked) for _ in range(self.connections)),
+            return_exceptions=True)
+        pool = [connection for connection in opened if isinstance(connection, _Connection)]
+        started = loop.time()
+        first_timestamp = None
+        sent = 0
+        try:
+            for connection in opened:
+                if not isinstance(connection, _Connection):
+                    raise connection
+            for payload, timestamp in messages:
+                if self.rate is not None:
+                    due = started + sent / self.rate
+                elif self.speed is not None and timestamp is not None:
+                    if first_timestamp is None:
+                        first_timestamp = timestamp
+                    due = started + (timestamp - first_timestamp) / self.speed
+                else:
+                    due = None
+                if due is not None and due > loop.time():
+                    await asyncio.sleep(due - loop.time())
+                connection = min(pool, key=_Connection.pending)
+                while connection.pending() >= self.window and connection.error is None:
+                    # Every window is full; wait for the first ACK on any connection
+                    acked.clear()
+                    await acked.wait()
+                    connection = min(pool, key=_Connection.pending)
+                await connection.send(payload)
+                sent += 1
+            await asyncio.wait_for(asyncio.gather(*(connection.drain() for connection in pool)), self.timeout)
+        finally:
+            for connection in pool:
+                await connection.close()
+        elapsed = loop.time() - started
+        return _report(pool, sent, elapsed)
+
+
+class _Connection:
+    """One persistent connection; ACKs arrive in the order messages were sent"""
+
+    def __init__(self, reader, writer, window, acked):
+        self.reader = reader
+        self.writer = writer
+        self.acked = acked
+        self.window_size = window
+        self.window = asyncio.Semaphore(window)
+        self.sent_at = deque()
+        self.latencies = []
+        self.errors = 0
+        self.error = None
+        self.receiver = asyncio.ensure_future(self._receive())
+
+    @classmethod
+    async def open(cls, host, port, window, acked):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer, window, acked)
+
+    def pending(self):
+        """Number of messages sent and not acknowledged yet"""
+        return len(self.sent_at)
+
+    async def send(self, payload):
+        await self.window.acquire()
+        if self.error is not None:
+            raise self.error
+        self.sent_at.append(time.perf_counter())
+        self.writer.write(frame(payload))
+        await self.writer.drain()
+
+    async def _receive(self):
+        """Match each ACK to the oldest unacknowledged message"""
+        try:
+            while True:
+                ack = await self.reader.readuntil(END_BLOCK)
+                now = time.perf_counter()
+                if not self.sent_at:
+                    continue
+                self.latencies.append(now - self.sent_at.popleft())
+                msa = ack.find(b'MSA')
+                if msa < 0 or ack[msa + 4:msa + 6] not in _ACCEPTED:
+                    self.errors += 1
+                self.window.release()
+                self.acked.set()
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            self.error = ConnectionError(f"MLLP connection closed with {len(self.sent_at)} messages unacknowledged")
+            if not isinstance(e, asyncio.IncompleteReadError):
+                self.error.__cause__ = e
+            # Wake up senders waiting for the window
+            for _ in range(self.window_size):
+                self.window.release()
+            self.acked.set()
+
+    async def drain(self):
+        """Wait until every sent message is acknowledged"""
+        for _ in range(self.window_size):
+            await self.window.acquire()
+        if self.error is not None and self.sent_at:
+            raise self.error
+
+    async def close(self):
+        self.writer.close()
+        self.receiver.cancel()
+        await asyncio.gather(self.receiver, return_exceptions=True)
+
+
+def _report(pool, sent, elapsed):
+    latencies = sorted(latency for connection in pool for latency in connection.latencies)
+    acked = len(latencies)
+    return LoadReport(
+        sent=sent,
+        acked=acked,
+        errors=sum(connection.errors for connection in pool),
+        elapsed=elapsed,
+        rate=acked / elapsed if elapsed > 0 else 0.0,
+        latency_ms={p: percentile(latencies, p) * 1000 for p in LATENCY_PERCENTILES},
+        max_latency_ms=latencies[-1] * 1000 if latencies else 0.0,
+    )
+
+
+def percentile(ordered, p):
+    """Return the nearest-rank p-th percentile of a sorted list (0.0 if empty)"""
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def replay_file(path):
+    """Yield (payload, MSH-7 seconds) for each message of a file, streaming.
+
+    Messages are sent byte for byte as stored; only MSH-7 is parsed.
+    """
+    parser = HL7Parser(projection={'MSH': [7]})
+    for message in parser.iter_file(path):
+        buffer = message.buffer
+        payload = buffer.encode(message.charset or 'utf-8') if isinstance(buffer, str) else bytes(buffer)
+        yield payload, timestamp_seconds(message.get('MSH-7', ''))
+
+
+def timestamp_seconds(value):
+    """Return an HL7 timestamp as POSIX seconds (local time), or None if unreadable"""
+    key = timestamp_key(value)
+    if not key:
+        return None
+    try:
+        return datetime.strptime(str(key), '%Y%m%d%H%M%S').timestamp()
+    except ValueError:
+        return None
+
+
+def generate_corpus(count, start=None, interval=1.0):
+    """Yield (payload, seconds) for count synthetic ADT messages, interval seconds apart.
+
+    Patients cycle through A01 (admit), A08 (update) and A03 (discharge).
+    """
+    start = start or datetime(2023, 1, 1)
+    events = ('A01', 'A08', 'A03')
+    for n in range(count):
+        when = start + timedelta(seconds=n * interval)
+        stamp = when.strftime('%Y%m%d%H%M%S')
+        patient = n // len(events)
+        payload = (
+            f"MSH|^~\\&|LOADGEN|HOSP|RECEIVER|HOSP|{stamp}||ADT^{events[n % len(events)]}|LG{n:08d}|P|2.5.1\r"
+            f"EVN|{events[n % len(events)]}|{stamp}\r"
+            f"PID|1||{patient:06d}^^^HOSP^MR||PATIENT^TEST^{patient}||19700101|U\r"
+            f"PV1|1|I|WARD^{patient % 40:02d}^1"
+        ).encode('ascii')
+        yield payload, when.timestamp()
@@ -0,0 +1,550 @@
+"""Message objects produced by the native tokenizer engine.
+
+A message keeps its original text exactly once plus the tokenizer's
+offset tables. Segments, fields, repetitions and components are exposed
+through small ``__slots__`` view objects that slice their values out of
+the text only when they are read.
+
+Only segment and field boundaries are found up front. A field is split
+into repetitions, and a repetition into components and subcomponents,
+the first time a consumer asks for it; the result is cached on the
+message so each split happens at most once.
+
+A message can also be built from bytes. It is then tokenized on the raw
+buffer, and ``raw_text`` decodes each slice on access using the MSH-18
+character set (see charsets.py).
+"""
+import sys
+from functools import partial
+
+from .tokenizer import tokenize, repetition_spans, tokenize_value
+from .encoding import read_encoding, read_binary_encoding
+from .charsets import (
+    DecodedText, read_charset, codec_for, BYTE_TRANSPARENT_CODECS, WIDE_CODECS, DEFAULT_CODEC, DECODE_ERRORS,
+)
+from .structure import StructureNode
+from .paths import compile_path
+from .projection import as_projection
+from .templates import structure_template
+
+# The MLLP end block (see mllp.py)
+_END_BLOCK = b'\x1c'
+
+
+class HL7Message:
+    """An HL7 message backed by the original text and tokenizer offsets.
+
+    ``raw_text`` is either the message ``str`` or, for messages given as
+    bytes, a DecodedText over the buffer; both are sliced with the token
+    offsets. ``buffer`` is what the tokenizer ran on and ``delimiters`` the
+    matching delimiter set. ``charset`` is the codec values are decoded
+    with, or None for messages given as text.
+    """
+
+    __slots__ = (
+        'raw_text', 'buffer', 'charset', 'encoding', 'delimiters', 'projection', 'tokens',
+        '_segment_index', '_repetitions', '_values',
+    )
+
+    def __init__(self, raw_text, projection=None):
+        # With a projection only the listed segments and fields are tokenized
+        projection = as_projection(projection)
+        if isinstance(raw_text, str):
+            buffer, charset = raw_text, None
+            # Shared, precompiled delimiters for this message's MSH-1/MSH-2
+            encoding = delimiters = read_encoding(raw_text)
+        else:
+            raw_text, buffer, charset, encoding, delimiters = _read_bytes(bytes(raw_text))
+        self._setup(raw_text, buffer, charset, encoding, delimiters, projection,
+                    tokenize(buffer, delimiters, projection))
+
+    @classmethod
+    def from_tokens(cls, buffer, tokens, charset):
+        """Rebuild a message from an encoded buffer and its offset tables.
+
+        Nothing is tokenized or copied: ``buffer`` may be a memoryview and
+        the tables memoryviews cast to offsets (see packed.py). The
+        buffer's delimiters must be ASCII.
+        """
+        message = cls.__new__(cls)
+        encoding = read_binary_encoding(buffer)
+        message._setup(DecodedText(buffer, charset), buffer, charset, encoding, encoding.binary, None, tokens)
+        return message
+
+    def _setup(self, raw_text, buffer, charset, encoding, delimiters, projection, tokens):
+        """Set every slot once; afterwards the message is read-only"""
+        setattr_ = object.__setattr__
+        setattr_(self, 'raw_text', raw_text)
+        setattr_(self, 'buffer', buffer)
+        setattr_(self, 'charset', charset)
+        setattr_(self, 'encoding', encoding)
+        setattr_(self, 'delimiters', delimiters)
+        setattr_(self, 'projection', projection)
+        setattr_(self, 'tokens', tokens)
+        # Segment indexes by name, built on the first path query
+        setattr_(self, '_segment_index', None)
+        # Lazily split sub-field levels, keyed by field index / (field, repeat)
+        setattr_(self, '_repetitions', {})
+        setattr_(self, '_values', {})
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} objects are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} objects are immutable")
+
+    def __str__(self):
+        return str(self.raw_text)
+
+    def __len__(self):
+        return len(self.tokens.segment_start)
+
+    def __getitem__(self, seg_index):
+        if seg_index < 0:
+            seg_index += len(self)
+        if not 0 <= seg_index < len(self):
+            raise IndexError("segment index out of range")
+        return Segment(self, seg_index)
+
+    @property
+    def segments(self):
+        """Segment views in message order"""
+        return [Segment(self, i) for i in range(len(self))]
+
+    def nbytes(self):
+        """Return the memory held by the text and the offset tables"""
+        return sys.getsizeof(self.raw_text) + self.tokens.nbytes()
+
+    def segment_name(self, seg_index):
+        """Return the three-character name of the segment at seg_index"""
+        tokens = self.tokens
+        field = tokens.segment_first[seg_index]
+        return self.raw_text[tokens.field_start[field]:tokens.field_end[field]]
+
+    def segment_names(self):
+        """Return the names of all segments in message order"""
+        return [self.segment_name(i) for i in range(len(self))]
+
+    def segment_indexes(self, name):
+        """Return the indexes of all segments with the given name, in order"""
+        index = self._segment_index
+        if index is None:
+            # Built in full before it is published, so other threads never
+            # see a partial index
+            index = {}
+            for seg_index, segment_name in enumerate(self.segment_names()):
+                index.setdefault(segment_name, []).append(seg_index)
+            object.__setattr__(self, '_segment_index', index)
+        return index.get(name, [])
+
+    def get(self, path, default=None):
+        """Return the value at an HL7 path such as ``PID-5.1`` or ``OBX[*]-5``.
+
+        See paths.py for the path syntax. Paths are compiled once and
+        cached, and no structure tree is built.
+        """
+        return compile_path(path).get(self, default)
+
+    def field_count(self, seg_index):
+        """Return the number of fields in a segment, excluding the name"""
+        first = self.tokens.segment_first
+        return first[seg_index + 1] - first[seg_index] - 1
+
+    def field_value(self, seg_index, field_num):
+        """Return the raw value of a field, or '' if it is not present"""
+        tokens = self.tokens
+        first = tokens.segment_first[seg_index]
+        field = first + field_num
+        if field_num < 0 or field >= tokens.segment_first[seg_index + 1]:
+            return ''
+        return self.raw_text[tokens.field_start[field]:tokens.field_end[field]]
+
+    def repetitions(self, field):
+        """Return the (start, end) spans of a field's repetitions, splitting on first use"""
+        spans = self._repetitions.get(field)
+        if spans is None:
+            tokens = self.tokens
+            start, end = tokens.field_start[field], tokens.field_end[field]
+            if field in tokens.literal_fields:
+                spans = [(start, end)]
+            else:
+                spans = repetition_spans(self.buffer, start, end, self.delimiters.repetition)
+            self._repetitions[field] = spans
+        return spans
+
+    def value_tokens(self, field, repeat=0):
+        """Return the component offsets of one repetition, splitting on first use"""
+        key = (field, repeat)
+        value = self._values.get(key)
+        if value is None:
+            start, end = self.repetitions(field)[repeat]
+            # MSH-1/MSH-2 hold the delimiters themselves and stay whole
+            delimiters = None if field in self.tokens.literal_fields else self.delimiters
+            value = self._values[key] = tokenize_value(self.buffer, start, end, delimiters)
+        return value
+
+    def is_composite(self, field):
+        """True if a field has repetitions, components or subcomponents"""
+        tokens = self.tokens
+        if field in tokens.literal_fields:
+            return False
+        # Searched in place, so this also works on memoryview buffers
+        composite = self.delimiters.composite_delimiters
+        return composite.search(self.buffer, tokens.field_start[field], tokens.field_end[field]) is not None
+
+    def get_structure(self):
+        """Get a hierarchical structure of the message.
+
+        Only the root node is built here; segment, field, repetition and
+        component nodes are created when their parent's children are
+        first read.
+        """
+        if not len(self):
+            return None
+
+        return StructureNode(
+            'Message',
+            description="HL7 Message",
+            value="",
+            children=self._segment_nodes,
+            has_children=True
+        )
+
+    def _segment_nodes(self):
+        """Build the (lazy) nodes for every segment of the message.
+
+        Names and descriptions come from the template of the message's
+        shape, shared with every message of the same shape.
+        """
+        names = self.segment_names()
+        template = structure_template(self, names)
+        return [
+            StructureNode(
+                segment.display_name,
+                raw_name=segment.name,
+                description=segment.description,
+                value='',
+                children=partial(self._field_nodes, seg_index, segment, template),
+                has_children=self.field_count(seg_index) > 0
+            )
+            for seg_index, segment in enumerate(template.segments)
+        ]
+
+    def _field_nodes(self, seg_index, segment, template):
+        """Build the (lazy) nodes for the fields of one segment"""
+        tokens = self.tokens
+        text = self.raw_text
+        unescape = self.encoding.unescape
+        literal_fields = tokens.literal_fields
+        first = tokens.segment_first[seg_index]
+        count = self.field_count(seg_index)
+        nodes = []
+        for field_num, (field_name, raw_name, description, components) in enumerate(segment.fields(count)[:count], 1):
+            field = first + field_num
+            value = text[tokens.field_start[field]:tokens.field_end[field]]
+            composite = self.is_composite(field)
+            nodes.append(StructureNode(
+                field_name,
+                raw_name=raw_name,
+                description=description,
+                # Leaf values are shown with escape sequences decoded; MSH-1
+                # and MSH-2 are the delimiters themselves
+                value=value if composite or field in literal_fields else unescape(value),
+                children=partial(self._field_children, field, field_name, template, components) if composite else None,
+                has_children=composite
+            ))
+        return nodes
+
+    def _field_children(self, field, field_name, template, components=()):
+        """Build repetition nodes, or the components of a single repetition"""
+        spans = self.repetitions(field)
+        if len(spans) == 1:
+            return self._component_nodes(field, 0, field_name, template, components)
+
+        text = self.raw_text
+        encoding = self.encoding
+        nodes = []
+        for repeat, (start, end) in enumerate(spans):
+            value = text[start:end]
+            composite = encoding.component in value or encoding.subcomponent in value
+            repeat_name = f"{field_name}[{repeat + 1}]"
+            nodes.append(StructureNode(
+                repeat_name,
+                raw_name=str(repeat + 1),
+                description=f"Repetition {repeat + 1}",
+                value=value if composite else encoding.unescape(value),
+                # Each repeat is only split into components when expanded
+                children=(partial(self._component_nodes, field, repeat, repeat_name, template, components)
+                          if composite else None),
+                has_children=composite
+            ))
+        return nodes
+
+    def _component_nodes(self, field, repeat, parent_name, template, components=()):
+        """Build the component nodes of one field repetition, described by the field's data type"""
+        value = self.value_tokens(field, repeat)
+        text = self.raw_text
+        unescape = self.encoding.unescape
+        component_first = value.component_first
+        count = len(value)
+        nodes = []
+        for comp, (comp_name, raw_name, description) in enumerate(
+                template.children(parent_name, count, "Component", components)[:count]):
+            comp_value = text[value.component_start[comp]:value.component_end[comp]]
+            composite = component_first[comp + 1] - component_first[comp] > 1
+            nodes.append(StructureNode(
+                comp_name,
+                raw_name=raw_name,
+                description=description,
+                value=comp_value if composite else unescape(comp_value),
+                children=partial(self._subcomponent_nodes, value, comp, comp_name, template) if composite else None,
+                has_children=composite
+            ))
+        return nodes
+
+    def _subcomponent_nodes(self, value, comp, comp_name, template):
+        """Build the subcomponent nodes of a component with more than one"""
+        text = self.raw_text
+        unescape = self.encoding.unescape
+        sub_first, sub_last = value.component_first[comp], value.component_first[comp + 1]
+        names = template.children(comp_name, sub_last - sub_first, "Subcomponent")
+        return [
+            StructureNode(
+                name,
+                raw_name=raw_name,
+                description=description,
+                value=unescape(text[value.subcomponent_start[sub]:value.subcomponent_end[sub]])
+            )
+            for (name, raw_name, description), sub in zip(names, range(sub_first, sub_last))
+        ]
+
+    @property
+    def value(self):
+        return None
+
+    @property
+    def name(self):
+        return "HL7Message"
+
+    @property
+    def children(self):
+        return []
+
+
+def _read_bytes(data):
+    """Return (raw_text, buffer, charset, encoding, delimiters) for a message given as bytes.
+
+    Decoding is lazy where the charset allows it.
+    """
+    encoding = read_binary_encoding(data)
+    charset = codec_for(read_charset(data, encoding))
+    if charset in WIDE_CODECS:
+        # An MSH header readable as bytes means the label is wrong
+        charset = DEFAULT_CODEC
+    # An MLLP frame may still end with its end block; the tokenizer skips
+    # it, and the text stops before it
+    end = data.find(_END_BLOCK, len(data) - 2)
+    view = memoryview(data)[:end] if end >= 0 else data
+    if charset in BYTE_TRANSPARENT_CODECS and encoding.binary is not None:
+        return DecodedText(view, charset), data, charset, encoding, encoding.binary
+    # Delimiter bytes may occur inside characters: decode it all once
+    text = str(view, charset, DECODE_ERRORS)
+    return text, text, charset, encoding, encoding
+
+
+class Segment:
+    """View of one segment of an HL7Message"""
+
+    __slots__ = ('message', 'index')
+
+    def __init__(self, message, index):
+        self.message = message
+        self.index = index
+
+    @property
+    def name(self):
+        return self.message.segment_name(self.index)
+
+    @property
+    def value(self):
+        tokens = self.message.tokens
+        return self.message.raw_text[tokens.segment_start[self.index]:tokens.segment_end[self.index]]
+
+    @property
+    def fields(self):
+        """Field views for fields 1..n (the segment name is not included)"""
+        first = self.message.tokens.segment_first[self.index]
+        return [Field(self.message, first + num, num) for num in range(1, len(self) + 1)]
+
+    def field(self, field_num):
+        """Return the view of a field by HL7 field number, or None if absent"""
+        if not 0 < field_num <= len(self):
+            return None
+        return Field(self.message, self.message.tokens.segment_first[self.index] + field_num, field_num)
+
+    def __len__(self):
+        return self.message.field_count(self.index)
+
+    def __getitem__(self, key):
+        # String keys keep the old SimpleHL7Message segment dicts working
+        if key == 'name':
+            return self.name
+        if key == 'fields':
+            return self.fields
+        if isinstance(key, int):
+            field = self.field(key)
+            if field is None:
+                raise IndexError("field number out of range")
+            return field
+        raise KeyError(key)
+
+    def __str__(self):
+        return self.value
+
+    def __repr__(self):
+        return f"Segment({self.name!r}, index={self.index})"
+
+
+class Field:
+    """View of one field; ``index`` is its position in the offset tables.
+
+    Integer indexing and ``components`` refer to the first repetition,
+    which is what ``PID-5.1`` means in HL7 notation; use ``repetitions``
+    or ``repetition(n)`` to reach the others.
+    """
+
+    __slots__ = ('message', 'index', 'number')
+
+    def __init__(self, message, index, number):
+        self.message = message
+        self.index = index
+        self.number = number
+
+    @property
+    def value(self):
+        tokens = self.message.tokens
+        return self.message.raw_text[tokens.field_start[self.index]:tokens.field_end[self.index]]
+
+    @property
+    def decoded(self):
+        """The value with escape sequences decoded"""
+        return self.message.encoding.unescape(self.value)
+
+    @property
+    def repetitions(self):
+        """Repetition views, one per repeat"""
+        return [Repetition(self.message, self.index, repeat)
+                for repeat in range(len(self.message.repetitions(self.index)))]
+
+    def repetition(self, number):
+        """Return the view of a repetition by 1-based number, or None if absent"""
+        if not 0 < number <= len(self.message.repetitions(self.index)):
+            return None
+        return Repetition(self.message, self.index, number - 1)
+
+    @property
+    def components(self):
+        return Repetition(self.message, self.index, 0).components
+
+    def __len__(self):
+        return len(Repetition(self.message, self.index, 0))
+
+    def __getitem__(self, key):
+        # String keys keep the old SimpleHL7Message field dicts working
+        if key == 'index':
+            return self.number
+        if key == 'value':
+            return self.value
+        if isinstance(key, int):
+            return Repetition(self.message, self.index, 0)[key]
+        raise KeyError(key)
+
+    def __str__(self):
+        return self.value
+
+    def __repr__(self):
+        return f"Field({self.number}, {self.value!r})"
+
+
+class Repetition:
+    """View of one repetition of a field; ``repeat`` is 0-based"""
+
+    __slots__ = ('message', 'field', 'repeat')
+
+    def __init__(self, message, field, repeat):
+        self.message = message
+        self.field = field
+        self.repeat = repeat
+
+    @property
+    def number(self):
+        return self.repeat + 1
+
+    @property
+    def value(self):
+        start, end = self.message.repetitions(self.field)[self.repeat]
+        return self.message.raw_text[start:end]
+
+    @property
+    def decoded(self):
+        """The value with escape sequences decoded"""
+        return self.message.encoding.unescape(self.value)
+
+    @property
+    def components(self):
+        value = self.message.value_tokens(self.field, self.repeat)
+        return [Component(self.message, value, comp) for comp in range(len(value))]
+
+    def __len__(self):
+        return len(self.message.value_tokens(self.field, self.repeat))
+
+    def __getitem__(self, number):
+        value = self.message.value_tokens(self.field, self.repeat)
+        if not 0 < number <= len(value):
+            raise IndexError("component number out of range")
+        return Component(self.message, value, number - 1)
+
+    def __str__(self):
+        return self.value
+
+    def __repr__(self):
+        return f"Repetition({self.number}, {self.value!r})"
+
+
+class Component:
+    """View of one component of a field repetition"""
+
+    __slots__ = ('message', 'tokens', 'index')
+
+    def __init__(self, message, tokens, index):
+        self.message = message
+        self.tokens = tokens
+        self.index = index
+
+    @property
+    def number(self):
+        return self.index + 1
+
+    @property
+    def value(self):
+        tokens = self.tokens
+        return self.message.raw_text[tokens.component_start[self.index]:tokens.component_end[self.index]]
+
+    @property
+    def decoded(self):
+        """The value with escape sequences decoded"""
+        return self.message.encoding.unescape(self.value)
+
+    @property
+    def subcomponents(self):
+        tokens = self.tokens
+        text = self.message.raw_text
+        unescape = self.message.encoding.unescape
+        return [unescape(text[tokens.subcomponent_start[sub]:tokens.subcomponent_end[sub]])
+                for sub in range(tokens.component_first[self.index], tokens.component_first[self.index + 1])]
+
+    def __str__(self):
+        return self.value
+
+    def __repr__(self):
+        return f"Component({self.number}, {self.value!r})"
@@ -0,0 +1,280 @@
+"""MLLP (Minimal Lower Layer Protocol) framing and an asyncio listener.
+
+MLLP wraps every message as ``0x0B <message> 0x1C 0x0D``. MLLPServer
+accepts any number of connections, reads frames straight out of the
+stream's buffer (one search and one copy per frame, never a byte-by-byte
+loop), parses each message and answers with an ACK built from its
+MSH-10: AA when it was parsed and handled, AE with the error otherwise.
+
+Messages on one connection are processed concurrently and acknowledged
+in the order they arrived, so senders may pipeline. Flow control works
+at two levels:
+
+* per connection, at most ``max_pending`` messages may be unacknowledged;
+  past that the server stops reading that socket, and TCP pushes back on
+  the sender
+* across connections, at most ``max_in_flight`` messages are being
+  parsed at once
+
+By default messages are parsed on the event loop thread, which is the
+fastest choice for ordinary messages. Pass a thread or process pool as
+``executor`` when a handler does heavy or blocking work. If the pool
+itself fails (a broken process pool, a handler that cannot be pickled),
+the affected messages get AE ACKs naming the error.
+"""
+import asyncio
+from datetime import datetime
+
+from .encoding import DEFAULT_ENCODING
+from .hl7_parser import parse
+
+START_BLOCK = b'\x0b'
+END_BLOCK = b'\x1c\r'
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 2575
+
+# Unacknowledged messages per connection before the server stops reading it
+DEFAULT_MAX_PENDING = 64
+# Messages being parsed at once, across all connections
+DEFAULT_MAX_IN_FLIGHT = 256
+DEFAULT_MAX_CONNECTIONS = 100
+# Frames larger than this close the connection
+DEFAULT_MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+ACK_ACCEPT = 'AA'
+ACK_ERROR = 'AE'
+
+
+def frame(data):
+    """Wrap encoded message bytes in an MLLP frame"""
+    return START_BLOCK + data + END_BLOCK
+
+
+def build_ack(message, code=ACK_ACCEPT, text=''):
+    """Return the encoded ACK for a parsed message, or for None if it was unreadable.
+
+    The ACK swaps the sending and receiving application and facility,
+    echoes MSH-10 in MSA-2 and uses the message's own delimiters and
+    character set.
+    """
+    if message is None:
+        encoding, charset, get = DEFAULT_ENCODING, 'utf-8', lambda path: ''
+    else:
+        encoding, charset = message.encoding, message.charset or 'utf-8'
+
+        def get(path):
+            value = message.get(path, '')
+            return value if isinstance(value, str) else ''
+
+    field = encoding.field
+    encoding_chars = encoding.component + encoding.repetition + encoding.escape + encoding.subcomponent
+    trigger = get('MSH-9.2')
+    msh = [
+        'MSH', encoding_chars, get('MSH-5'), get('MSH-6'), get('MSH-3'), get('MSH-4'),
+        datetime.now().strftime('%Y%m%d%H%M%S'), '',
+        encoding.component.join(('ACK', trigger, 'ACK')) if trigger else 'ACK',
+        get('MSH-10'), get('MSH-11') or 'P', get('MSH-12') or '2.5',
+    ]
+    msa = ['MSA', code, get('MSH-10'), _escape(text, encoding)]
+    return (field.join(msh) + '\r' + field.join(msa)).encode(charset, 'replace')
+
+
+def _escape(text, encoding):
+    """Escape delimiters in free text, escape character first"""
+    esc = encoding.escape
+    text = text.replace(esc, f'{esc}E{esc}')
+    for char, code in ((encoding.field, 'F'), (encoding.component, 'S'),
+                       (encoding.repetition, 'R'), (encoding.subcomponent, 'T')):
+        text = text.replace(char, f'{esc}{code}{esc}')
+    return text.replace('\r', ' ').replace('\n', ' ')
+
+
+def process_message(data, handler=None):
+    """Parse one message and run handler on it; returns (ACK code, encoded ACK).
+
+    Any exception from parsing or from the handler turns into an AE ACK
+    carrying its text. Module level, so it can run in a process pool.
+    """
+    try:
+        message = parse(data)
+    except ValueError as e:
+        return ACK_ERROR, build_ack(None, ACK_ERROR, str(e))
+    try:
+        if handler is not None:
+            handler(message)
+    except Exception as e:
+        return ACK_ERROR, build_ack(message, ACK_ERROR, str(e) or type(e).__name__)
+    return ACK_ACCEPT, build_ack(message)
+
+
+def _executor_error_ack(data, error):
+    """Return the AE ACK for a message whose processing could not run"""
+    try:
+        message = parse(data)
+    except ValueError:
+        message = None
+    text = type(error).__name__ + (f": {error}" if str(error) else '')
+    return build_ack(message, ACK_ERROR, text)
+
+
+class MLLPServer:
+    """An asyncio MLLP listener that parses and acknowledges every message.
+
+    ``handler(message)`` is called with each parsed HL7Message; raise to
+    send an AE ACK. It runs on the event loop unless ``executor`` (a
+    concurrent.futures pool) is given; with a process pool it must be
+    picklable. Use ``await server.start()`` then ``serve_forever()``, or
+    ``async with server:``. ``port=0`` binds a free port, see ``port``.
+    """
+
+    def __init__(self, handler=None, host=DEFAULT_HOST, port=DEFAULT_PORT, executor=None,
+                 max_pending=DEFAULT_MAX_PENDING, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, max_message_size=DEFAULT_MAX_MESSAGE_SIZE):
+        if max_pending < 1 or max_in_flight < 1 or max_connections < 1:
+            raise ValueError("MLLP server limits must be positive")
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.executor = executor
+        self.max_pending = max_pending
+        self.max_in_flight = max_in_flight
+        self.max_connections = max_connections
+        self.max_message_size = max_message_size
+        self.connections = 0
+        self.messages = 0
+        self.errors = 0
+        self.refused = 0
+        self._server = None
+        self._in_flight = None
+        # Connection handler tasks and their writers, closed by close()
+        self._tasks = {}
+
+    async def start(self):
+        """Start listening; the bound port is in ``port`` afterwards"""
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._server = await asyncio.start_server(self._serve, self.host, self.port,
+                                                  limit=self.max_message_size)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()
+
+    def close(self):
+        """Stop listening and drop all connections"""
+        if self._server is not None:
+            self._server.close()
+        for writer in self._tasks.values():
+            # The handler sees end of file and finishes normally
+            writer.transport.abort()
+
+    async def wait_closed(self):
+        if self._server is not None:
+            await self._server.wait_closed()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+        await self.wait_closed()
+
+    async def _serve(self, reader, writer):
+        """Read the frames of one connection; ACKs are sent by _send_acks"""
+        if self.connections >= self.max_connections:
+            self.refused += 1
+            writer.close()
+            return
+        self.connections += 1
+        task = asyncio.current_task()
+        self._tasks[task] = writer
+        # Bounded: when max_pending ACKs are outstanding, reading waits
+        acks = asyncio.Queue(self.max_pending)
+        sender = asyncio.ensure_future(self._send_acks(acks, writer))
+        try:
+            while not sender.done():
+                try:
+                    # Bytes between frames are read and dropped with the
+                    # start block, so the frame itself comes out of the
+                    # stream buffer starting at its MSH
+                    await reader.readuntil(START_BLOCK)
+                    data = await reader.readuntil(END_BLOCK)
+                except asyncio.IncompleteReadError:
+                    # Connection closed; an unfinished frame is dropped
+                    break
+                except asyncio.LimitOverrunError:
+                    # No start or end block within max_message_size
+                    break
+                # Parsed as read: the tokenizer skips the trailing end
+                # block, so the frame is never sliced again
+                await acks.put((data, await self._submit(data)))
+            if not sender.done():
+                # Acknowledge everything read before closing
+                await acks.put(None)
+                await sender
+        except ConnectionError:
+            pass
+        finally:
+            sender.cancel()
+            self.connections -= 1
+            self._tasks.pop(task, None)
+            writer.close()
+
+    async def _submit(self, data):
+        """Start processing a message; returns a future of its ACK"""
+        await self._in_flight.acquire()
+        loop = asyncio.get_running_loop()
+        if self.executor is None:
+            future = loop.create_future()
+            try:
+                future.set_result(process_message(data, self.handler))
+            finally:
+                self._in_flight.release()
+            return future
+        future = loop.run_in_executor(self.executor, process_message, data, self.handler)
+        future.add_done_callback(lambda _: self._in_flight.release())
+        return future
+
+    async def _send_acks(self, acks, writer):
+        """Write ACKs in arrival order, flushing when no more are ready"""
+        try:
+            while True:
+                item = await acks.get()
+                if item is None:
+                    break
+                data, future = item
+                try:
+                    code, ack = await future
+                except Exception as e:
+                    # The executor failed, not the message: e.g. a broken
+                    # process pool or a handler that cannot be pickled
+                    code, ack = ACK_ERROR, _executor_error_ack(data, e)
+                self.messages += 1
+                if code != ACK_ACCEPT:
+                    self.errors += 1
+                writer.write(frame(ack))
+                if acks.empty():
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            # Anything still queued will not be acknowledged
+            while not acks.empty():
+                item = acks.get_nowait()
+                if item is not None:
+                    item[1].cancel()
+
+    def __repr__(self):
+        return f"MLLPServer({self.host!r}, {self.port})"
+
+
+def serve(handler=None, host=DEFAULT_HOST, port=DEFAULT_PORT, **options):
+    """Run an MLLPServer until interrupted"""
+    async def main():
+        async with MLLPServer(handler, host, port, **options) as server:
+            await server.serve_forever()
+    asyncio.run(main())
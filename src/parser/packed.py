@@ -0,0 +1,224 @@
+"""Flat, pickle-free form of parsed messages for handing them between processes.
+
+pack_messages() lays out any number of parsed HL7Messages in one flat
+buffer: per message its encoded bytes, the tokenizer's offset tables and
+the name of its codec. PackedMessages reads such a buffer back; each
+message is rebuilt as an HL7Message whose buffer and offset tables are
+memoryviews into the block, so nothing is copied or tokenized again and
+values are decoded only when read.
+
+share_messages() writes the block into a ``multiprocessing.shared_memory``
+segment, which is how worker processes hand results to the parent (see
+batch.parse_messages()); SharedMessages attaches to it on the other side.
+Offsets are stored in native byte order, so a block is only readable on
+the machine that wrote it.
+
+Block layout::
+
+    header   struct BLOCK_FORMAT: magic, version, message count
+    offsets  'Q' table: start of each message record in the block
+    records  struct RECORD_FORMAT: buffer size, segment count, field
+             count, literal field count, codec name size; then the 'I'
+             tables segment_start, segment_end, segment_first (count + 1),
+             field_start, field_end, literal_fields; the codec name; and
+             the message bytes, padded to 8 bytes
+"""
+import struct
+from array import array
+from collections.abc import Sequence
+from multiprocessing import shared_memory
+
+from .charsets import DEFAULT_CODEC
+from .encoding import read_binary_encoding
+from .message import HL7Message
+from .tokenizer import Tokens, OFFSET_TYPECODE, tokenize
+
+PACK_MAGIC = b'HL7PAK'
+PACK_VERSION = 1
+
+# magic, version, message count (padded to 16 bytes)
+BLOCK_FORMAT = '=6sHI4x'
+# buffer size, segments, fields, literal fields, codec name size (padded to 24 bytes)
+RECORD_FORMAT = '=IIIII4x'
+
+_BLOCK = struct.Struct(BLOCK_FORMAT)
+_RECORD = struct.Struct(RECORD_FORMAT)
+_OFFSET_SIZE = struct.calcsize(OFFSET_TYPECODE)
+# Record offsets are 'Q'; records start on 8-byte boundaries so the
+# offset tables can be cast in place
+_ALIGNMENT = 8
+
+
+def pack_messages(messages):
+    """Return the packed block of a list of HL7Messages as a bytearray"""
+    records = [_record(message) for message in messages]
+    block = bytearray(_block_size(records))
+    _write_block(records, block)
+    return block
+
+
+def share_messages(messages):
+    """Pack HL7Messages into a new shared memory segment and return its name.
+
+    The segment stays alive after this process lets go of it; the reader
+    (SharedMessages) unlinks it. Returns None if there are no messages.
+    """
+    records = [_record(message) for message in messages]
+    if not records:
+        return None
+    size = _block_size(records)
+    segment = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        _write_block(records, segment.buf)
+    except BaseException:
+        segment.close()
+        segment.unlink()
+        raise
+    segment.close()
+    return segment.name
+
+
+class PackedMessages(Sequence):
+    """Read-only sequence of the messages in a packed block.
+
+    ``buffer`` is any bytes-like object holding the block. Items are
+    HL7Messages sharing the block's memory; keep the block alive (and do
+    not modify it) while they are in use.
+    """
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        if len(self._view) < _BLOCK.size:
+            raise ValueError("Truncated packed message block")
+        magic, version, count = _BLOCK.unpack_from(self._view)
+        if magic != PACK_MAGIC:
+            raise ValueError("Not a packed message block")
+        if version != PACK_VERSION:
+            raise ValueError(f"Unsupported packed message version {version}")
+        self._offsets = self._view[_BLOCK.size:_BLOCK.size + 8 * count].cast('Q')
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[n] for n in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("message index out of range")
+        return self._unpack(self._offsets[index])
+
+    def _unpack(self, pos):
+        """Rebuild the message whose record starts at pos"""
+        view = self._view
+        buffer_size, segments, fields, literals, codec_size = _RECORD.unpack_from(view, pos)
+        pos += _RECORD.size
+
+        tokens = Tokens.__new__(Tokens)
+        for name, count in (('segment_start', segments), ('segment_end', segments),
+                            ('segment_first', segments + 1), ('field_start', fields),
+                            ('field_end', fields)):
+            end = pos + count * _OFFSET_SIZE
+            setattr(tokens, name, view[pos:end].cast(OFFSET_TYPECODE))
+            pos = end
+        end = pos + literals * _OFFSET_SIZE
+        tokens.literal_fields = set(view[pos:end].cast(OFFSET_TYPECODE))
+        pos = end
+
+        codec = str(view[pos:pos + codec_size], 'ascii')
+        pos += codec_size
+        return HL7Message.from_tokens(view[pos:pos + buffer_size], tokens, codec)
+
+    def release(self):
+        """Release this reader's views of the block"""
+        self._offsets.release()
+        self._view.release()
+
+
+class SharedMessages(PackedMessages):
+    """The packed messages in a shared memory segment written by share_messages().
+
+    The segment is unlinked as soon as it is attached, so its memory is
+    freed once this object is closed, even if the writer is gone. Messages
+    read from it must be dropped before close().
+    """
+
+    def __init__(self, name):
+        self._segment = shared_memory.SharedMemory(name=name)
+        self._segment.unlink()
+        try:
+            super().__init__(self._segment.buf)
+        except BaseException:
+            self._segment.close()
+            raise
+
+    def close(self):
+        """Detach from the segment; raises BufferError while messages still use it"""
+        self.release()
+        self._segment.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _record(message):
+    """Return (buffer, tokens, codec) of a message, with the buffer as bytes"""
+    buffer, tokens, codec = message.buffer, message.tokens, message.charset or DEFAULT_CODEC
+    if isinstance(buffer, str):
+        # Text messages are stored as UTF-8; their offsets count characters,
+        # so non-ASCII text is tokenized again to get byte offsets
+        data = buffer.encode(DEFAULT_CODEC)
+        codec = DEFAULT_CODEC
+        if len(data) != len(buffer):
+            binary = read_binary_encoding(data).binary
+            if binary is None:
+                raise ValueError("Messages with non-ASCII delimiters cannot be packed")
+            tokens = tokenize(data, binary, message.projection)
+        buffer = data
+    elif message.encoding.binary is None:
+        raise ValueError("Messages with non-ASCII delimiters cannot be packed")
+    return bytes(buffer), tokens, codec.encode('ascii')
+
+
+def _record_size(record):
+    buffer, tokens, codec = record
+    tables = (len(tokens.segment_start) + len(tokens.segment_end) + len(tokens.segment_first)
+              + len(tokens.field_start) + len(tokens.field_end) + len(tokens.literal_fields))
+    size = _RECORD.size + tables * _OFFSET_SIZE + len(codec) + len(buffer)
+    return -(-size // _ALIGNMENT) * _ALIGNMENT
+
+
+def _block_size(records):
+    return _BLOCK.size + 8 * len(records) + sum(_record_size(record) for record in records)
+
+
+def _write_block(records, block):
+    """Write the header, offset table and records into a writable buffer"""
+    _BLOCK.pack_into(block, 0, PACK_MAGIC, PACK_VERSION, len(records))
+    pos = _BLOCK.size + 8 * len(records)
+    for n, record in enumerate(records):
+        struct.pack_into('=Q', block, _BLOCK.size + 8 * n, pos)
+        pos = _write_record(record, block, pos)
+
+
+def _write_record(record, block, pos):
+    """Write one record at pos; return where the next one starts"""
+    start = pos
+    buffer, tokens, codec = record
+    _RECORD.pack_into(block, pos, len(buffer), len(tokens.segment_start), len(tokens.field_start),
+                      len(tokens.literal_fields), len(codec))
+    pos += _RECORD.size
+    literal_fields = array(OFFSET_TYPECODE, sorted(tokens.literal_fields))
+    for table in (tokens.segment_start, tokens.segment_end, tokens.segment_first,
+                  tokens.field_start, tokens.field_end, literal_fields):
+        data = memoryview(table).cast('B')
+        block[pos:pos + len(data)] = data
+        pos += len(data)
+    block[pos:pos + len(codec)] = codec
+    pos += len(codec)
+    block[pos:pos + len(buffer)] = buffer
+    return start + _record_size(record)
@@ -0,0 +1,154 @@
+"""Compiled path queries such as ``PID-5.1``, ``OBX[3]-5`` and ``PID-3[*].1``.
+
+A path names a segment, optionally which occurrence of it (``OBX[3]``,
+1-based, or ``OBX[*]`` for all), a field number, optionally a field
+repetition (``PID-3[2]`` or ``PID-3[*]``), and then a component and a
+subcomponent (``PID-3[1].4.2``). Without an occurrence the first segment
+is used; ``PID-3.1`` reads the first repetition of PID-3.
+
+compile_path() parses a path once into a CompiledPath and keeps it in an
+LRU cache, so the same few paths used against millions of messages are
+parsed only once. Reading a path goes straight from the message's
+segment index to the field offsets and splits only that one field; no
+structure tree is built.
+"""
+import re
+from functools import lru_cache
+
+_PATH = re.compile(r"""
+    (?P<segment>[A-Z][A-Z0-9]{2})
+    (?:\[(?P<segment_repeat>\d+|\*)\])?
+    -(?P<field>\d+)
+    (?:\[(?P<repeat>\d+|\*)\])?
+    (?:\.(?P<component>\d+)
+        (?:\.(?P<subcomponent>\d+))?
+    )?
+""", re.VERBOSE)
+
+# Marks a [*] level in a compiled path
+ALL = '*'
+
+
+class CompiledPath:
+    """A parsed path query that can be applied to any HL7Message.
+
+    Positions are stored 0-based (``field`` is the HL7 field number);
+    ``ALL`` marks a ``[*]`` wildcard and ``component``/``subcomponent`` are
+    None when the path stops above that level. Paths containing a wildcard
+    return a list with one entry per matched segment and repetition.
+    """
+
+    __slots__ = ('path', 'segment', 'segment_repeat', 'field', 'repeat', 'component', 'subcomponent', 'multiple')
+
+    def __init__(self, path):
+        match = _PATH.fullmatch(path)
+        if match is None:
+            raise ValueError(f"Invalid HL7 path: {path!r}")
+        self.path = path
+        self.segment = match.group('segment')
+        self.segment_repeat = _position(match.group('segment_repeat'), default=0)
+        self.field = int(match.group('field'))
+        self.repeat = _position(match.group('repeat'), default=None)
+        self.component = _position(match.group('component'), default=None)
+        self.subcomponent = _position(match.group('subcomponent'), default=None)
+        if self.field < 1 or -1 in (self.segment_repeat, self.repeat, self.component, self.subcomponent):
+            raise ValueError(f"HL7 path positions start at 1: {path!r}")
+        self.multiple = ALL in (self.segment_repeat, self.repeat)
+
+    def get(self, message, default=None):
+        """Return the value at this path in message.
+
+        Leaf values are returned with escape sequences decoded; values that
+        still contain lower-level delimiters are returned raw. Anything not
+        present in the message, or left out by its projection, reads as
+        ``default``.
+        """
+        segments = message.segment_indexes(self.segment)
+        if self.segment_repeat is not ALL:
+            segments = segments[self.segment_repeat:self.segment_repeat + 1]
+
+        if not self.multiple:
+            if not segments:
+                return default
+            values = self._read(message, segments[0], default)
+            return values[0] if values else default
+
+        values = []
+        for seg_index in segments:
+            values.extend(self._read(message, seg_index, default))
+        return values
+
+    __call__ = get
+
+    def _read(self, message, seg_index, default):
+        """Return the values this path selects in one segment"""
+        projection = message.projection
+        if projection is not None and not projection.keeps(self.segment, self.field):
+            # Stored as an empty span, which is not the field's real value
+            return [default]
+        tokens = message.tokens
+        field = tokens.segment_first[seg_index] + self.field
+        if field >= tokens.segment_first[seg_index + 1]:
+            return [default]
+        value = message.raw_text[tokens.field_start[field]:tokens.field_end[field]]
+        encoding = message.encoding
+
+        if field in tokens.literal_fields:
+            # MSH-1/MSH-2 are the delimiters themselves and are never split
+            if self.repeat not in (None, ALL, 0) or self.component or self.subcomponent:
+                return [default]
+            return [value]
+
+        if self.repeat is None and self.component is None:
+            # The whole field, across all of its repetitions
+            return [_leaf(value, encoding, encoding.repetition + encoding.component + encoding.subcomponent)]
+
+        repeats = value.split(encoding.repetition)
+        if self.repeat is None:
+            repeats = repeats[:1]
+        elif self.repeat is not ALL:
+            repeats = repeats[self.repeat:self.repeat + 1] or [None]
+        return [self._read_repeat(repeat, encoding, default) for repeat in repeats]
+
+    def _read_repeat(self, value, encoding, default):
+        """Select the component/subcomponent of one repetition"""
+        if value is None:
+            return default
+        if self.component is None:
+            return _leaf(value, encoding, encoding.component + encoding.subcomponent)
+        components = value.split(encoding.component)
+        if self.component >= len(components):
+            return default
+        value = components[self.component]
+        if self.subcomponent is None:
+            return _leaf(value, encoding, encoding.subcomponent)
+        subcomponents = value.split(encoding.subcomponent)
+        if self.subcomponent >= len(subcomponents):
+            return default
+        return encoding.unescape(subcomponents[self.subcomponent])
+
+    def __repr__(self):
+        return f"CompiledPath({self.path!r})"
+
+
+def _position(group, default):
+    """Convert a 1-based path position to 0-based, '*' to ALL"""
+    if group is None:
+        return default
+    if group == '*':
+        return ALL
+    return int(group) - 1
+
+
+def _leaf(value, encoding, delimiters):
+    """Decode a value unless it still holds lower-level delimiters"""
+    for delimiter in delimiters:
+        if delimiter in value:
+            return value
+    return encoding.unescape(value)
+
+
+@lru_cache(maxsize=1024)
+def compile_path(path):
+    """Return the shared CompiledPath for a path string"""
+    return CompiledPath(path)
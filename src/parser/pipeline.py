@@ -0,0 +1,274 @@
+"""Multi-stage streaming pipeline: read, parse, transform, write.
+
+A Pipeline connects four stages with bounded queues::
+
+    source     reads a file, a directory, stdin or a socket and frames
+               it into messages (the framing of reader.py)
+    parse      builds an HL7Message from each framed record
+    transform  applies the caller's functions and turns messages into rows
+    sink       writes the rows in group-committed batches (see sinks.py)
+
+Every stage runs in its own threads, so disk reads, parsing and output
+writes overlap; ``parse_workers`` and ``transform_workers`` set how many
+threads the middle stages get. Records travel in batches of
+``batch_size`` to keep queue overhead per message low, and each queue
+holds at most ``queue_size`` batches: a slow stage makes the stages in
+front of it wait instead of letting memory grow.
+
+With more than one parse or transform thread, messages can reach the
+sink out of order. Parsing is CPU-bound and the threads share one
+interpreter, so extra parse threads mainly help when a transform waits
+on I/O; to spread parsing over several cores use batch.py.
+"""
+import os
+import socket
+import sys
+import threading
+import queue
+from collections import namedtuple
+
+from .batch import find_files, DEFAULT_FIELDS
+from .message import HL7Message
+from .paths import compile_path
+from .reader import DEFAULT_CHUNK_SIZE, MESSAGE_HEADER, _records
+
+# Batches a queue between two stages holds before its producer waits
+DEFAULT_QUEUE_SIZE = 16
+
+# Records per batch passed between stages, and rows per sink write
+DEFAULT_BATCH_SIZE = 256
+
+# How often blocked threads check whether the pipeline was stopped
+_POLL_INTERVAL = 0.1
+
+# Marks the end of the input on a queue
+_DONE = object()
+
+PipelineStats = namedtuple('PipelineStats', 'records messages rows dropped')
+
+
+class _Stopped(Exception):
+    """Raised inside stage threads when the pipeline is shutting down"""
+
+
+class Pipeline:
+    """A source, parse, transform and sink stage connected by bounded queues.
+
+    ``source`` is a file or directory path (directories are read file by
+    file, matching ``pattern``), ``'-'`` for stdin, a connected socket or
+    a binary stream. ``transforms`` are called in order on each message;
+    a transform returns the value passed to the next one, or None to drop
+    the message. Values still HL7Messages after the last transform become
+    rows of the paths in ``fields``. Rows are dicts and go to ``sink``
+    (see sinks.py), which the caller closes.
+    """
+
+    def __init__(self, source, sink, transforms=(), fields=DEFAULT_FIELDS, projection=None,
+                 parse_workers=1, transform_workers=1, queue_size=DEFAULT_QUEUE_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE, pattern='*.hl7', chunk_size=DEFAULT_CHUNK_SIZE):
+        if parse_workers < 1 or transform_workers < 1:
+            raise ValueError("Each stage needs at least one worker")
+        if queue_size < 1 or batch_size < 1:
+            raise ValueError("queue_size and batch_size must be positive")
+        self.source = source
+        self.sink = sink
+        self.transforms = tuple(transforms)
+        self.fields = tuple(compile_path(path) for path in fields)
+        self.projection = projection
+        self.parse_workers = parse_workers
+        self.transform_workers = transform_workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.pattern = pattern
+        self.chunk_size = chunk_size
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._error = None
+        self._counts = dict.fromkeys(PipelineStats._fields, 0)
+
+    def run(self):
+        """Run the pipeline to the end of the input and return PipelineStats.
+
+        The first exception raised in any stage stops all of them and is
+        re-raised here.
+        """
+        records = queue.Queue(self.queue_size)
+        messages = queue.Queue(self.queue_size)
+        rows = queue.Queue(self.queue_size)
+        threads = [threading.Thread(target=self._guard, args=(self._read, records), name='hl7-source')]
+        threads += self._stage_threads('parse', self.parse_workers, records, messages, self._parse)
+        threads += self._stage_threads('transform', self.transform_workers, messages, rows, self._transform)
+        threads.append(threading.Thread(target=self._guard, args=(self._write, rows), name='hl7-sink'))
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(_POLL_INTERVAL)
+        except BaseException:
+            self.stop()
+            raise
+        if self._error is not None:
+            raise self._error
+        return self.stats
+
+    def stop(self):
+        """Ask every stage to finish as soon as possible"""
+        self._stop.set()
+
+    @property
+    def stats(self):
+        """Counts so far: records read, messages parsed, rows written and messages dropped"""
+        with self._lock:
+            return PipelineStats(**self._counts)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counts[name] += n
+
+    def _guard(self, function, *args):
+        """Run a stage function; the first failure stops the whole pipeline"""
+        try:
+            function(*args)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+            self.stop()
+
+    def _get(self, inbox):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                return inbox.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+
+    def _put(self, outbox, item):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                return outbox.put(item, timeout=_POLL_INTERVAL)
+            except queue.Full:
+                pass
+
+    # Stages
+
+    def _read(self, outbox):
+        """Source stage: frame the input into batches of message records"""
+        batch = []
+        for stream in self._streams():
+            for record in _records(stream, self.chunk_size):
+                name = record[:3]
+                if name != MESSAGE_HEADER and name != MESSAGE_HEADER.encode():
+                    # Batch envelope segments and stray text
+                    continue
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    self._count('records', len(batch))
+                    self._put(outbox, batch)
+                    batch = []
+                if self._stop.is_set():
+                    raise _Stopped()
+        if batch:
+            self._count('records', len(batch))
+            self._put(outbox, batch)
+        self._put(outbox, _DONE)
+
+    def _streams(self):
+        """Yield the binary streams of the source, opening and closing files"""
+        source = self.source
+        if source == '-':
+            yield sys.stdin.buffer
+        elif isinstance(source, socket.socket):
+            with source.makefile('rb') as stream:
+                yield stream
+        elif isinstance(source, (str, os.PathLike)):
+            paths = find_files(source, self.pattern) if os.path.isdir(source) else [source]
+            for path in paths:
+                with open(path, 'rb') as stream:
+                    yield stream
+        else:
+            yield source
+
+    def _stage_threads(self, name, workers, inbox, outbox, work):
+        """Create the threads of a middle stage, sharing one running count"""
+        state = {'running': workers, 'lock': threading.Lock()}
+        return [threading.Thread(target=self._guard, args=(self._relay, inbox, outbox, work, state),
+                                 name=f'hl7-{name}-{n}')
+                for n in range(workers)]
+
+    def _relay(self, inbox, outbox, work, state):
+        """Middle stage thread: apply work to each batch until the input ends"""
+        while True:
+            batch = self._get(inbox)
+            if batch is _DONE:
+                # Let the other threads of this stage see the end too
+                self._put(inbox, _DONE)
+                break
+            output = work(batch)
+            if output:
+                self._put(outbox, output)
+        with state['lock']:
+            state['running'] -= 1
+            last = not state['running']
+        if last:
+            self._put(outbox, _DONE)
+
+    def _parse(self, batch):
+        """Parse stage: records to HL7Messages.
+
+        The source only passes on records starting with MSH, and the
+        tokenizer accepts any of those, so parsing itself cannot fail.
+        """
+        projection = self.projection
+        messages = [HL7Message(record, projection) for record in batch]
+        self._count('messages', len(messages))
+        return messages
+
+    def _transform(self, batch):
+        """Transform stage: apply the transforms and turn messages into rows"""
+        rows = []
+        for value in batch:
+            for transform in self.transforms:
+                value = transform(value)
+                if value is None:
+                    break
+            if value is None:
+                self._count('dropped')
+                continue
+            if isinstance(value, HL7Message):
+                value = {path.path: path.get(value, '') for path in self.fields}
+            rows.append(value)
+        return rows
+
+    def _write(self, inbox):
+        """Sink stage: group rows into batches of batch_size and commit each at once.
+
+        A smaller batch is written whenever no more rows are waiting, so
+        output never lags behind a slow source.
+        """
+        pending = []
+        while True:
+            batch = self._get(inbox)
+            if batch is _DONE:
+                break
+            pending.extend(batch)
+            if len(pending) >= self.batch_size or inbox.empty():
+                self.sink.write_batch(pending)
+                self._count('rows', len(pending))
+                pending = []
+        if pending:
+            self.sink.write_batch(pending)
+            self._count('rows', len(pending))
+
+
+def run_pipeline(source, sink, transforms=(), **options):
+    """Build a Pipeline and run it; returns PipelineStats"""
+    return Pipeline(source, sink, transforms, **options).run()
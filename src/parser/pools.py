@@ -0,0 +1,29 @@
+"""Worker process pools of the long-running servers (serve, mllp-server).
+
+Ctrl-C in a terminal reaches the whole process group. The servers stop
+on the KeyboardInterrupt in the parent; the workers ignore SIGINT, so
+they neither print tracebacks of their own nor die while a request is
+being answered, and are shut down by the parent instead.
+"""
+import signal
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+
+def server_pool(workers, initializer=None, initargs=()):
+    """Return a ProcessPoolExecutor whose workers ignore SIGINT, then run ``initializer``"""
+    return ProcessPoolExecutor(workers, initializer=_init_server_worker, initargs=(initializer,) + tuple(initargs))
+
+
+def shutdown_pool(executor):
+    """Shut a pool down, dropping work that has not started (cancel_futures needs Python 3.9)"""
+    if sys.version_info >= (3, 9):
+        executor.shutdown(cancel_futures=True)
+    else:
+        executor.shutdown()
+
+
+def _init_server_worker(initializer, *args):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer is not None:
+        initializer(*args)
@@ -0,0 +1,59 @@
+"""Projections for selective parsing.
+
+A projection declares up front which segments and fields a consumer
+needs, e.g. ``{"MSH": [7, 9, 10], "PID": [3, 5], "OBX": [3, 5]}``. The
+tokenizer then skips every other segment while scanning and records
+only the requested fields; see tokenizer.tokenize().
+"""
+from .encoding import HEADER_SEGMENTS
+
+
+class Projection:
+    """The segments and field numbers to keep when tokenizing.
+
+    ``fields`` maps each segment name to a frozenset of field numbers, or
+    to None to keep every field of that segment. ``last_field`` holds the
+    highest requested field per segment, after which scanning of the
+    segment stops.
+    """
+
+    __slots__ = ('fields', 'last_field')
+
+    def __init__(self, spec):
+        self.fields = {}
+        self.last_field = {}
+        for name, numbers in spec.items():
+            if not isinstance(name, str) or len(name) != 3:
+                raise ValueError(f"Invalid segment name in projection: {name!r}")
+            if numbers is None:
+                self.fields[name] = None
+                continue
+            numbers = frozenset(int(number) for number in numbers)
+            if not numbers or min(numbers) < 1:
+                raise ValueError(f"Projection fields for {name} must be positive field numbers")
+            self.fields[name] = numbers
+            self.last_field[name] = max(numbers)
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    def keeps(self, name, number):
+        """Return True if field ``number`` of segment ``name`` is tokenized.
+
+        MSH-1 and MSH-2 (and their FHS/BHS equivalents) are always kept.
+        """
+        if name not in self.fields:
+            return False
+        numbers = self.fields[name]
+        return numbers is None or number in numbers or (number <= 2 and name in HEADER_SEGMENTS)
+
+    def __repr__(self):
+        spec = {name: None if numbers is None else sorted(numbers) for name, numbers in self.fields.items()}
+        return f"Projection({spec!r})"
+
+
+def as_projection(spec):
+    """Return spec as a Projection; None means no projection"""
+    if spec is None or isinstance(spec, Projection):
+        return spec
+    return Projection(spec)
@@ -0,0 +1,173 @@
+"""Streaming reader for files holding many HL7 messages.
+
+Batch files wrap any number of messages in an optional FHS/BHS ... BTS/FTS
+envelope. iter_messages() reads such a file in fixed-size chunks, finds
+message boundaries (a segment starting with MSH) across chunk edges, and
+yields one parsed HL7Message at a time, so memory use stays constant no
+matter how large the file is. Envelope segments are not yielded; they
+are kept as metadata on the reader.
+"""
+import os
+import re
+
+from .message import HL7Message
+
+# Bytes read from the source per chunk
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Segments that start a message or belong to the batch envelope
+MESSAGE_HEADER = 'MSH'
+ENVELOPE_SEGMENTS = ('FHS', 'BHS', 'BTS', 'FTS')
+
+# A record starts after a segment terminator (or MLLP start block) that is
+# followed by MSH or an envelope segment
+_BOUNDARY = re.compile(r'[\r\n\x0b](?=MSH|[FB]HS|[FB]TS)')
+_BOUNDARY_BYTES = re.compile(rb'[\r\n\x0b](?=MSH|[FB]HS|[FB]TS)')
+
+# Segment terminators, MLLP framing and blanks around a record
+_FRAMING = '\r\n\x0b\x1c \t'
+_FRAMING_BYTES = b'\r\n\x0b\x1c \t'
+
+
+class MessageReader:
+    """Iterable over the messages of an HL7 batch file or stream.
+
+    ``source`` is a path or an open file; binary streams give messages
+    decoded lazily with their MSH-18 charset, text streams give text
+    messages. Iterating yields HL7Message objects (parsed with
+    ``projection`` if given). While iterating, ``file_header`` and
+    ``batch_header`` hold the current FHS and BHS, and ``batch_trailer``
+    and ``file_trailer`` the last BTS and FTS, each as an HL7Message with
+    a single segment (e.g. ``reader.batch_header.get("BHS-11")``).
+    Text between records that is not a message or envelope segment is
+    skipped and counted in ``skipped``.
+    """
+
+    def __init__(self, source, chunk_size=DEFAULT_CHUNK_SIZE, projection=None):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive")
+        self.source = source
+        self.chunk_size = chunk_size
+        self.projection = projection
+        self.file_header = None
+        self.batch_header = None
+        self.batch_trailer = None
+        self.file_trailer = None
+        self.batch_count = 0
+        self.message_count = 0
+        self.skipped = 0
+
+    def __iter__(self):
+        if isinstance(self.source, (str, bytes, os.PathLike)):
+            with open(self.source, 'rb') as stream:
+                yield from self._read(stream)
+        else:
+            yield from self._read(self.source)
+
+    def _read(self, stream):
+        """Parse the records of a stream into messages and envelope metadata"""
+        for record in _records(stream, self.chunk_size):
+            name = record[:3]
+            if not isinstance(name, str):
+                name = name.decode('ascii', 'replace')
+            if name == MESSAGE_HEADER:
+                self.message_count += 1
+                yield HL7Message(record, self.projection)
+            elif name in ENVELOPE_SEGMENTS:
+                self._read_envelope(name, record)
+            else:
+                self.skipped += 1
+
+    def _read_envelope(self, name, record):
+        """Keep an envelope segment as metadata"""
+        segment = HL7Message(record)
+        if name == 'FHS':
+            self.file_header = segment
+        elif name == 'BHS':
+            self.batch_header = segment
+            self.batch_count += 1
+        elif name == 'BTS':
+            self.batch_trailer = segment
+        else:
+            self.file_trailer = segment
+
+    def __repr__(self):
+        return f"MessageReader({self.source!r})"
+
+
+def iter_messages(source, chunk_size=DEFAULT_CHUNK_SIZE, projection=None):
+    """Return a MessageReader over the messages in a file or stream.
+
+    Iterate over the result to get one HL7Message at a time; batch header
+    metadata is available on the reader while iterating.
+    """
+    return MessageReader(source, chunk_size, projection)
+
+
+def _records(stream, chunk_size):
+    """Yield each message or envelope segment of a stream, framing removed.
+
+    Only the unfinished record at the end of a chunk is carried over to
+    the next one, and only the newly read data is searched for
+    boundaries. The chunks of an unfinished record are kept in a list and
+    joined once, when its end is found, so a record spanning many chunks
+    is not copied again for each of them.
+    """
+    parts = None
+    # Length of the data in parts
+    scanned = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if parts is None:
+            if isinstance(chunk, str):
+                boundary, framing, empty = _BOUNDARY, _FRAMING, ''
+            else:
+                boundary, framing, empty = _BOUNDARY_BYTES, _FRAMING_BYTES, b''
+            parts = []
+        if not chunk:
+            break
+
+        # A boundary needs the three characters after its terminator, so
+        # the last few characters of the previous chunks are searched again
+        if boundary.search(_tail(parts, empty) + chunk) is None:
+            parts.append(chunk)
+            scanned += len(chunk)
+            continue
+        parts.append(chunk)
+        buffer = empty.join(parts)
+
+        start = 0
+        for match in boundary.finditer(buffer, max(scanned - 3, 0)):
+            end = match.start()
+            if end > start:
+                record = _strip(buffer, start, end, framing)
+                if record:
+                    yield record
+            start = end + 1
+        pending = buffer[start:]
+        parts = [pending] if pending else []
+        scanned = len(pending)
+
+    pending = empty.join(parts)
+    record = _strip(pending, 0, len(pending), framing)
+    if record:
+        yield record
+
+
+def _tail(parts, empty):
+    """Return the last three characters of the data in parts"""
+    tail = empty
+    for part in reversed(parts):
+        tail = part[-3:] + tail
+        if len(tail) >= 3:
+            break
+    return tail[-3:]
+
+
+def _strip(buffer, start, end, framing):
+    """Return buffer[start:end] without surrounding framing characters"""
+    while start < end and buffer[start:start + 1] in framing:
+        start += 1
+    while end > start and buffer[end - 1:end] in framing:
+        end -= 1
+    return buffer[start:end]
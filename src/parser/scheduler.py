@@ -0,0 +1,298 @@
+"""Priority scheduler for parse jobs shared by the GUI and background work.
+
+A Scheduler runs jobs on a few threads, taking them by priority class:
+INTERACTIVE jobs (a user waiting on a parse) always go before BATCH jobs
+(imports, exports, bulk parsing). One thread only takes interactive
+jobs, so they never wait for a batch job to free a worker.
+
+Threads cannot be preempted, and they share the interpreter, so
+long-running jobs yield cooperatively. They call checkpoint() between
+units of work, or iterate through yielding(). At a checkpoint a batch job
+pauses while interactive jobs are queued or running, and any job raises
+Cancelled if it or its token was cancelled. Outside a scheduler job,
+checkpoint() does nothing, so library code can call it unconditionally.
+
+Submitting a job with a ``key`` supersedes the unfinished job submitted
+earlier with the same key, e.g. the previous parse of the same document:
+that job is cancelled before it starts, or at its next checkpoint. Only
+that job stops; other jobs sharing its token keep running.
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+# Priority classes; lower values run first
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BATCH: 'batch'}
+
+# Per priority class: jobs waiting and running now; jobs finished,
+# cancelled and failed so far; time from submission to start
+PriorityStats = namedtuple('PriorityStats', 'queued running completed cancelled failed mean_wait_ms max_wait_ms')
+
+_current = threading.local()
+
+
+class Cancelled(Exception):
+    """Raised at a checkpoint of a job that, or whose token, was cancelled"""
+
+
+class CancellationToken:
+    """A flag a job checks at its checkpoints; one token may be shared by several jobs"""
+
+    __slots__ = ('_cancelled', '_schedulers')
+
+    def __init__(self):
+        self._cancelled = False
+        # Schedulers with jobs using this token, woken when it is cancelled
+        self._schedulers = []
+
+    def cancel(self):
+        self._cancelled = True
+        for scheduler in list(self._schedulers):
+            scheduler._wake()
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def check(self):
+        """Raise Cancelled if the token was cancelled"""
+        if self._cancelled:
+            raise Cancelled()
+
+
+class Job(Future):
+    """A scheduled call; a Future whose cancel() also stops it at its next checkpoint"""
+
+    def __init__(self, function, args, kwargs, priority, token, key, scheduler=None):
+        super().__init__()
+        self.scheduler = scheduler
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.token = token
+        self.key = key
+        self.submitted = time.perf_counter()
+        self.started = None
+        # Set by cancel(); unlike the token, never shared with other jobs
+        self._stop = False
+
+    def cancel(self):
+        """Cancel this job alone: it will not start, or it stops at its next checkpoint"""
+        self._stop = True
+        if self.scheduler is not None:
+            # A batch job paused at a checkpoint has to see it now
+            self.scheduler._wake()
+        return super().cancel()
+
+    @property
+    def stopping(self):
+        """True once the job or its token was cancelled"""
+        return self._stop or self.token.cancelled
+
+    def check(self):
+        """Raise Cancelled if the job or its token was cancelled"""
+        if self.stopping:
+            raise Cancelled()
+
+
+class Scheduler:
+    """Runs jobs on ``workers`` threads by priority class, plus one thread for interactive jobs only"""
+
+    def __init__(self, workers=1):
+        if workers < 1:
+            raise ValueError("workers must be positive")
+        self.workers = workers
+        self._queue = []
+        self._sequence = itertools.count()
+        # Reentrant: job callbacks take the lock, and cancelling runs them
+        self._condition = threading.Condition(threading.RLock())
+        self._keys = {}
+        self._running = set()
+        # Interactive jobs queued or running; batch jobs pause while nonzero
+        self._urgent = 0
+        self._closed = False
+        self._counts = {priority: dict.fromkeys(PriorityStats._fields[:5], 0) for priority in PRIORITY_NAMES}
+        # Per priority: jobs started, total and longest wait
+        self._waits = {priority: [0, 0.0, 0.0] for priority in PRIORITY_NAMES}
+        self._threads = [threading.Thread(target=self._work, args=(False,), name=f'hl7-scheduler-{n}', daemon=True)
+                         for n in range(workers)]
+        self._threads.append(threading.Thread(target=self._work, args=(True,), name='hl7-scheduler-interactive',
+                                              daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, function, *args, priority=BATCH, key=None, token=None, **kwargs):
+        """Schedule function(*args, **kwargs) and return its Job.
+
+        A job submitted with the ``key`` of an unfinished job cancels that
+        job. ``token`` lets the caller cancel several jobs at once.
+        """
+        if priority not in PRIORITY_NAMES:
+            raise ValueError(f"Unknown priority: {priority}")
+        token = token or CancellationToken()
+        job = Job(function, args, kwargs, priority, token, key, self)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Cannot schedule jobs after shutdown")
+            if self not in token._schedulers:
+                token._schedulers.append(self)
+            if key is not None:
+                previous = self._keys.get(key)
+                if previous is not None:
+                    previous.cancel()
+                self._keys[key] = job
+            if priority == INTERACTIVE:
+                self._urgent += 1
+            self._counts[priority]['queued'] += 1
+            heapq.heappush(self._queue, (priority, next(self._sequence), job))
+            job.add_done_callback(self._finished)
+            self._condition.notify_all()
+        return job
+
+    def run(self, function, *args, priority=INTERACTIVE, key=None, **kwargs):
+        """Run function as a job and wait for its result"""
+        return self.submit(function, *args, priority=priority, key=key, **kwargs).result()
+
+    @property
+    def stats(self):
+        """PriorityStats per priority class name"""
+        with self._condition:
+            stats = {}
+            for priority, name in PRIORITY_NAMES.items():
+                counts = self._counts[priority]
+                started, total, longest = self._waits[priority]
+                stats[name] = PriorityStats(mean_wait_ms=total / started * 1000 if started else 0.0,
+                                            max_wait_ms=longest * 1000, **counts)
+            return stats
+
+    def shutdown(self, wait=True, cancel=False):
+        """Stop taking jobs; with ``cancel``, cancel the queued and running ones"""
+        with self._condition:
+            self._closed = True
+            if cancel:
+                for job in [job for _, _, job in self._queue] + list(self._running):
+                    job.cancel()
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def _work(self, interactive_only):
+        """Worker thread: run jobs until shutdown and an empty queue"""
+        while True:
+            job = self._take(interactive_only)
+            if job is None:
+                return
+            _current.job, _current.scheduler = job, self
+            try:
+                job.check()
+                result = job.function(*job.args, **job.kwargs)
+            except BaseException as e:
+                if isinstance(e, Cancelled):
+                    # The Future is running, so it cannot be marked cancelled
+                    self._count(job.priority, 'cancelled')
+                else:
+                    self._count(job.priority, 'failed')
+                job.set_exception(e)
+            else:
+                self._count(job.priority, 'completed')
+                job.set_result(result)
+            finally:
+                _current.job = _current.scheduler = None
+
+    def _take(self, interactive_only):
+        """Wait for the next job this thread may run; None once shut down"""
+        with self._condition:
+            while True:
+                while self._queue and (not interactive_only or self._queue[0][0] == INTERACTIVE):
+                    priority, _, job = heapq.heappop(self._queue)
+                    self._counts[priority]['queued'] -= 1
+                    if not job.set_running_or_notify_cancel():
+                        self._counts[priority]['cancelled'] += 1
+                        continue
+                    job.started = time.perf_counter()
+                    wait = job.started - job.submitted
+                    waits = self._waits[priority]
+                    waits[0] += 1
+                    waits[1] += wait
+                    waits[2] = max(waits[2], wait)
+                    self._counts[priority]['running'] += 1
+                    self._running.add(job)
+                    return job
+                if self._closed and not self._queue:
+                    return None
+                self._condition.wait()
+
+    def _count(self, priority, name):
+        with self._condition:
+            self._counts[priority][name] += 1
+
+    def _finished(self, job):
+        """Done callback of every job, including jobs cancelled before they started"""
+        with self._condition:
+            if job.started is not None:
+                self._counts[job.priority]['running'] -= 1
+                self._running.discard(job)
+            if job.priority == INTERACTIVE:
+                self._urgent -= 1
+            if job.key is not None and self._keys.get(job.key) is job:
+                del self._keys[job.key]
+            self._condition.notify_all()
+
+    def _wake(self):
+        """Let paused jobs recheck whether they were cancelled"""
+        with self._condition:
+            self._condition.notify_all()
+
+    def _pause(self, job):
+        """Hold a batch job at its checkpoint while interactive jobs are queued or running"""
+        with self._condition:
+            while self._urgent and not job.stopping:
+                self._condition.wait()
+
+
+def checkpoint():
+    """Yield to interactive jobs and raise Cancelled if the running job was cancelled.
+
+    A no-op outside a scheduler job.
+    """
+    job = getattr(_current, 'job', None)
+    if job is None:
+        return
+    job.check()
+    scheduler = _current.scheduler
+    if job.priority != INTERACTIVE and scheduler._urgent:
+        scheduler._pause(job)
+        job.check()
+
+
+def yielding(iterable):
+    """Iterate, passing a checkpoint before each item"""
+    for item in iterable:
+        checkpoint()
+        yield item
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_scheduler():
+    """Return the process-wide Scheduler, creating it on first use"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Scheduler()
+        return _shared
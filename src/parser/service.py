@@ -0,0 +1,297 @@
+"""Local parse service: a warm parser behind HTTP/1.1.
+
+Every run of the command line parser starts an interpreter and imports
+the parser and its definitions before the first message is read.
+ParseService pays that once: it keeps a pool of worker processes with
+everything loaded and answers requests over HTTP/1.1 with keep-alive, on
+a TCP port or a Unix socket::
+
+    POST /parse    body: one raw HL7 message, in any supported charset
+                   200: the message structure as JSON (StructureNode.to_dict())
+                   400: {"error": ...} if the message cannot be parsed
+    GET /health    {"status": "ok", "workers": ..., "requests": ..., "errors": ...}
+
+The JSON is built in the worker, so only bytes cross the process
+boundary. The client side is src/utils/parse_client.py, which does not
+import the parser at all.
+"""
+import asyncio
+import json
+import os
+import socket
+import stat
+from http import HTTPStatus
+
+from .hl7_parser import parse
+from .pools import server_pool, shutdown_pool
+
+DEFAULT_MAX_BODY_SIZE = 16 * 1024 * 1024
+DEFAULT_MAX_CONNECTIONS = 100
+# Seconds an idle keep-alive connection is kept open
+DEFAULT_KEEP_ALIVE = 60.0
+
+# Request line and headers
+_MAX_HEADER_SIZE = 64 * 1024
+_HEADER_END = b'\r\n\r\n'
+
+# Parsed once by every worker as it starts, so the first request is not slower
+_WARM_UP = b"MSH|^~\\&|WARMUP||||20230101120000||ADT^A01|1|P|2.5\rPID|1||1^^^HOSP^MR||DOE^JOHN"
+
+
+def parse_structure(data):
+    """Parse one message and return (HTTP status, JSON body).
+
+    Module level, so it can run in a process pool.
+    """
+    try:
+        message = parse(data)
+    except ValueError as e:
+        return HTTPStatus.BAD_REQUEST, _json({'error': str(e)})
+    return HTTPStatus.OK, _json(message.get_structure().to_dict())
+
+
+def _json(value):
+    return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+
+def _init_worker():
+    """Set up a worker process: load the parser and its definitions"""
+    parse_structure(_WARM_UP)
+
+
+class ParseService:
+    """An HTTP/1.1 parse service on a TCP port or, given ``path``, a Unix socket.
+
+    With ``workers=0`` messages are parsed on the event loop thread;
+    otherwise in that many worker processes, started and warmed up by
+    start(). ``port=0`` binds a free port, see ``port``. Use
+    ``await service.start()`` then ``serve_forever()``, or
+    ``async with service:``.
+    """
+
+    def __init__(self, host='127.0.0.1', port=None, path=None, workers=0,
+                 max_body_size=DEFAULT_MAX_BODY_SIZE, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 keep_alive=DEFAULT_KEEP_ALIVE):
+        if (port is None) == (path is None):
+            raise ValueError("Give either a port or a Unix socket path")
+        if workers < 0 or max_connections < 1:
+            raise ValueError("workers must not be negative and max_connections must be positive")
+        self.host = host
+        self.port = port
+        self.path = path
+        self.workers = workers
+        self.max_body_size = max_body_size
+        self.max_connections = max_connections
+        self.keep_alive = keep_alive
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self.refused = 0
+        self._server = None
+        self._executor = None
+        # Connection handler tasks and their writers, closed by close()
+        self._tasks = {}
+
+    @property
+    def address(self):
+        """The address in the form parse_client accepts"""
+        return f'unix:{self.path}' if self.path is not None else f'{self.host}:{self.port}'
+
+    async def start(self):
+        """Start the workers and listen; the bound port is in ``port`` afterwards"""
+        if self.workers:
+            self._executor = server_pool(self.workers, _init_worker)
+            loop = asyncio.get_running_loop()
+            # One task per worker, so all of them are started before the first request
+            await asyncio.gather(*(loop.run_in_executor(self._executor, int) for _ in range(self.workers)))
+        else:
+            _init_worker()
+        if self.path is not None:
+            _remove_stale_socket(self.path)
+            self._server = await asyncio.start_unix_server(self._serve, self.path, limit=_MAX_HEADER_SIZE)
+        else:
+            self._server = await asyncio.start_server(self._serve, self.host, self.port, limit=_MAX_HEADER_SIZE)
+            self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()
+
+    def close(self):
+        """Stop listening and drop all connections"""
+        if self._server is not None:
+            self._server.close()
+        for writer in self._tasks.values():
+            writer.transport.abort()
+
+    async def wait_closed(self):
+        if self._server is not None:
+            await self._server.wait_closed()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.path is not None and self._server is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        if self._executor is not None:
+            shutdown_pool(self._executor)
+            self._executor = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+        await self.wait_closed()
+
+    async def _serve(self, reader, writer):
+        """Answer the requests of one connection, one at a time"""
+        if self.connections >= self.max_connections:
+            self.refused += 1
+            writer.close()
+            return
+        self.connections += 1
+        task = asyncio.current_task()
+        self._tasks[task] = writer
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(_HEADER_END), self.keep_alive)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
+                                        "Request header too large", False)
+                    break
+                keep_alive = await self._request(head, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # Gone in the middle of a request
+            pass
+        finally:
+            self.connections -= 1
+            self._tasks.pop(task, None)
+            writer.close()
+
+    async def _request(self, head, reader, writer):
+        """Read the body of one request and answer it; returns whether to keep the connection"""
+        try:
+            method, target, version, headers = _parse_head(head)
+        except ValueError as e:
+            await self._respond(writer, HTTPStatus.BAD_REQUEST, str(e), False)
+            return False
+        keep_alive = _keep_alive(version, headers)
+        if 'transfer-encoding' in headers:
+            await self._respond(writer, HTTPStatus.LENGTH_REQUIRED, "Send the message with a Content-Length", False)
+            return False
+        try:
+            length = int(headers.get('content-length', '0'))
+        except ValueError:
+            length = -1
+        if length < 0:
+            await self._respond(writer, HTTPStatus.BAD_REQUEST, "Invalid Content-Length", False)
+            return False
+        if length > self.max_body_size:
+            # The body is not read, so the connection cannot be reused
+            await self._respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                f"Messages are limited to {self.max_body_size} bytes", False)
+            return False
+        if length and headers.get('expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        body = await reader.readexactly(length) if length else b''
+
+        path = target.split('?', 1)[0]
+        if path == '/parse':
+            if method != 'POST':
+                return await self._respond(writer, HTTPStatus.METHOD_NOT_ALLOWED, "Use POST", keep_alive)
+            status, response = await self._parse(body)
+        elif path == '/health':
+            if method != 'GET':
+                return await self._respond(writer, HTTPStatus.METHOD_NOT_ALLOWED, "Use GET", keep_alive)
+            status, response = HTTPStatus.OK, _json({
+                'status': 'ok', 'workers': self.workers, 'connections': self.connections,
+                'requests': self.requests, 'errors': self.errors,
+            })
+        else:
+            return await self._respond(writer, HTTPStatus.NOT_FOUND, f"No such endpoint: {path}", keep_alive)
+        return await self._send(writer, status, response, keep_alive)
+
+    async def _parse(self, body):
+        if self._executor is None:
+            return parse_structure(body)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, parse_structure, body)
+        except Exception as e:
+            # A worker died or the pool is shutting down
+            return HTTPStatus.INTERNAL_SERVER_ERROR, _json({'error': str(e) or type(e).__name__})
+
+    async def _respond(self, writer, status, error, keep_alive):
+        return await self._send(writer, status, _json({'error': error}), keep_alive)
+
+    async def _send(self, writer, status, body, keep_alive):
+        self.requests += 1
+        if status >= 400:
+            self.errors += 1
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n")
+        if not keep_alive:
+            head += "Connection: close\r\n"
+        writer.write(head.encode('ascii') + b'\r\n' + body)
+        await writer.drain()
+        return keep_alive
+
+    def __repr__(self):
+        return f"ParseService({self.address!r})"
+
+
+def _parse_head(head):
+    """Return (method, target, version, headers) of a request head; header names are lowercase"""
+    lines = head[:-len(_HEADER_END)].decode('latin-1').split('\r\n')
+    parts = lines[0].split(' ')
+    if len(parts) != 3 or not parts[2].startswith('HTTP/1.'):
+        raise ValueError("Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        name, colon, value = line.partition(':')
+        if not colon:
+            raise ValueError("Malformed header line")
+        headers[name.strip().lower()] = value.strip()
+    return parts[0], parts[1], parts[2], headers
+
+
+def _keep_alive(version, headers):
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.0':
+        return connection == 'keep-alive'
+    return connection != 'close'
+
+
+def _remove_stale_socket(path):
+    """Remove a socket file left behind by a service that is gone"""
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            # Not ours; binding will fail with a clear error
+            return
+    except FileNotFoundError:
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(f"A parse service is already listening on {path}")
+
+
+def serve(host='127.0.0.1', port=None, path=None, workers=0, **options):
+    """Run a ParseService until interrupted"""
+    async def main():
+        async with ParseService(host, port, path, workers, **options) as service:
+            await service.serve_forever()
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+"""Output sinks for the pipeline (see pipeline.py).
+
+A sink receives rows, dicts mapping column names to values, in batches
+through write_batch(), and makes each batch durable in one go: one write
+and flush for JSONL and CSV, one executemany() and commit for SQLite. The
+pipeline groups rows into batches, so the per-row cost of a flush or a
+transaction is paid once per batch.
+"""
+import csv
+import json
+import sqlite3
+import sys
+from abc import ABC, abstractmethod
+
+
+class Sink(ABC):
+    """Base class; subclasses implement write_batch()"""
+
+    @abstractmethod
+    def write_batch(self, rows):
+        """Write a non-empty list of rows"""
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _TextSink(Sink):
+    """A sink writing to a path, '-' (stdout) or an open text stream"""
+
+    def __init__(self, target):
+        if target == '-':
+            self.stream, self._owned = sys.stdout, False
+        elif isinstance(target, str):
+            self.stream, self._owned = open(target, 'w', encoding='utf-8', newline=''), True
+        else:
+            self.stream, self._owned = target, False
+
+    def close(self):
+        if self._owned:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+
+class JsonlSink(_TextSink):
+    """Writes each row as one JSON line"""
+
+    def write_batch(self, rows):
+        self.stream.write(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows))
+        self.stream.flush()
+
+
+class CsvSink(_TextSink):
+    """Writes rows as CSV; the columns are fieldnames, or the first row's keys"""
+
+    def __init__(self, target, fieldnames=None):
+        super().__init__(target)
+        self.fieldnames = fieldnames
+        self._writer = None
+
+    def write_batch(self, rows):
+        if self._writer is None:
+            self._writer = csv.DictWriter(self.stream, self.fieldnames or list(rows[0]), extrasaction='ignore')
+            self._writer.writeheader()
+        self._writer.writerows({name: cell_value(value) for name, value in row.items()} for row in rows)
+        self.stream.flush()
+
+
+class SqliteSink(Sink):
+    """Inserts rows into a SQLite table, committing once per batch.
+
+    The table is created with the first row's keys as TEXT columns if it
+    does not exist yet.
+    """
+
+    def __init__(self, path, table='messages'):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.table = table
+        self._insert = None
+        self._columns = None
+
+    def write_batch(self, rows):
+        if self._insert is None:
+            self._prepare(list(rows[0]))
+        columns = self._columns
+        with self.connection:
+            self.connection.executemany(
+                self._insert, [tuple(cell_value(row.get(name)) for name in columns) for row in rows])
+
+    def _prepare(self, columns):
+        table = _quote(self.table)
+        names = ', '.join(_quote(name) for name in columns)
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({names})")
+        self._insert = f"INSERT INTO {table} ({names}) VALUES ({', '.join('?' * len(columns))})"
+        self._columns = columns
+
+    def close(self):
+        self.connection.close()
+
+
+def cell_value(value):
+    """Return a row value as a flat cell: lists (from [*] paths) are joined like repetitions"""
+    if isinstance(value, list):
+        return '~'.join('' if item is None else str(item) for item in value)
+    return value
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
@@ -0,0 +1,86 @@
+"""Lazy nodes for the hierarchical message structure.
+
+get_structure() used to build a complete tree of nested dicts before
+anything could be shown. StructureNode keeps the same dict-style access
+(``node['name']``, ``node['children']``, ``node.get('description')``),
+but a node only builds its children and looks up its description the
+first time they are read.
+"""
+from collections.abc import Mapping
+
+# Keys exposed through the dict-style interface, in display order
+NODE_KEYS = ('name', 'raw_name', 'description', 'value', 'children')
+
+
+class StructureNode(Mapping):
+    """A node of the message structure with lazily built children.
+
+    ``description`` and ``children`` may be given either as values or as
+    zero-argument callables. A callable is evaluated once, on first
+    access, and its result replaces it. ``has_children`` lets viewers
+    decide whether to show an expander without building the children.
+    """
+
+    __slots__ = ('name', 'raw_name', 'value', '_description', '_children', '_has_children')
+
+    def __init__(self, name, raw_name=None, description="", value=None, children=None, has_children=None):
+        self.name = name
+        self.raw_name = name if raw_name is None else raw_name
+        self.value = value
+        self._description = description
+        self._children = children
+        self._has_children = has_children
+
+    @property
+    def description(self):
+        description = self._description
+        if callable(description):
+            description = self._description = description()
+        return description
+
+    @property
+    def children(self):
+        children = self._children
+        if children is None:
+            children = self._children = []
+        elif callable(children):
+            children = self._children = children()
+        return children
+
+    @property
+    def has_children(self):
+        """True if the node has children, without building them if possible"""
+        if self._has_children is not None and callable(self._children):
+            return self._has_children
+        return bool(self.children)
+
+    def __getitem__(self, key):
+        if key in NODE_KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(NODE_KEYS)
+
+    def __len__(self):
+        return len(NODE_KEYS)
+
+    def __repr__(self):
+        return f"StructureNode({self.name!r}, value={self.value!r})"
+
+    def to_dict(self):
+        """Materialize this node and all descendants as plain nested dicts"""
+        return {
+            'name': self.name,
+            'raw_name': self.raw_name,
+            'description': self.description,
+            'value': self.value,
+            'children': [child.to_dict() for child in self.children]
+        }
+
+
+def has_children(node):
+    """Return True if a structure node (or legacy dict node) has children"""
+    if isinstance(node, StructureNode):
+        return node.has_children
+    return bool(node.get('children'))
@@ -0,0 +1,132 @@
+"""Structure templates: the names and descriptions of a message's structure.
+
+The nodes of get_structure() carry display names (``PID #2``, ``PID-3``,
+``PID-3.1``) and descriptions from the definitions of the message's HL7
+version, with MSH-9 enriched with the ADT event. None of that depends on
+the message's values, only on its shape: the HL7 version (MSH-12), the
+message type (MSH-9) and the sequence of segments. A StructureTemplate
+holds it for one such shape, so that building the structure of the next
+message with the same shape only attaches values.
+
+Templates are kept in an LRU cache of DEFAULT_TEMPLATE_CACHE_SIZE
+entries. Field and component names are added to a template as messages
+with more fields or components are expanded. Two threads extending the
+same template at once both build the same names, so no lock is needed.
+"""
+from functools import lru_cache
+
+from .definitions import definitions
+
+# Message shapes whose templates are kept
+DEFAULT_TEMPLATE_CACHE_SIZE = 256
+
+
+class SegmentTemplate:
+    """Display name and description of one segment, and the names of its fields"""
+
+    __slots__ = ('display_name', 'name', 'description', 'message_type', 'component', 'tables', '_fields')
+
+    def __init__(self, display_name, name, message_type, component, tables):
+        self.display_name = display_name
+        self.name = name
+        # The definitions of the message's version
+        self.tables = tables
+        self.description = tables.segments.get(name, "Unknown Segment")
+        # MSH-9 and the component delimiter, for the MSH-9 description
+        self.message_type = message_type
+        self.component = component
+        self._fields = []
+
+    def fields(self, count):
+        """Return (name, raw name, description, component descriptions) for fields 1 to at least count"""
+        fields = self._fields
+        if len(fields) < count:
+            fields = fields + [
+                (f"{self.name}-{field_num}", str(field_num),
+                 field_description(self.name, field_num, self.message_type, self.component, self.tables),
+                 self.tables.components(self.name, field_num))
+                for field_num in range(len(fields) + 1, count + 1)
+            ]
+            self._fields = fields
+        return fields
+
+
+class StructureTemplate:
+    """The segment templates of one message shape and the names of their components"""
+
+    __slots__ = ('segments', '_children')
+
+    def __init__(self, segments):
+        self.segments = segments
+        # Child names by parent node name: components of fields and
+        # repetitions, subcomponents of components
+        self._children = {}
+
+    def children(self, parent_name, count, label, descriptions=()):
+        """Return (name, raw name, description) for children 1 to at least count of a node.
+
+        Children without one of ``descriptions`` (those of the field's data
+        type) are described as ``<label> <n>``.
+        """
+        names = self._children.get(parent_name)
+        if names is None or len(names) < count:
+            names = names or []
+            names = names + [(f"{parent_name}.{n}", str(n),
+                              descriptions[n - 1] if n <= len(descriptions) else f"{label} {n}")
+                             for n in range(len(names) + 1, count + 1)]
+            self._children[parent_name] = names
+        return names
+
+
+def structure_template(message, names):
+    """Return the template for a message whose segment names are ``names``"""
+    msh = [seg_index for seg_index, name in enumerate(names) if name == 'MSH']
+    component = message.encoding.component
+    # MSH-12 may carry an internationalization code after the version ID
+    version = message.field_value(msh[0], 12).split(component)[0] if msh else ''
+    message_types = tuple(message.field_value(seg_index, 9) for seg_index in msh)
+    # Keyed by the tables rather than the version, so that swapping the
+    # overlay starts new templates
+    return _template(definitions(version), message_types, component, '\r'.join(names))
+
+
+@lru_cache(maxsize=DEFAULT_TEMPLATE_CACHE_SIZE)
+def _template(tables, message_types, component, signature):
+    """Build the template of a message shape; everything it needs is in the key"""
+    names = signature.split('\r')
+    totals = {}
+    for name in names:
+        totals[name] = totals.get(name, 0) + 1
+    counts = {}
+    message_types = iter(message_types)
+    segments = []
+    for name in names:
+        counts[name] = counts.get(name, 0) + 1
+        # Only add the segment number if there are several of its type
+        display_name = f"{name} #{counts[name]}" if totals[name] > 1 else name
+        message_type = next(message_types, '') if name == 'MSH' else ''
+        segments.append(SegmentTemplate(display_name, name, message_type, component, tables))
+    return StructureTemplate(segments)
+
+
+def template_cache_info():
+    """Return the hits, misses and size of the template cache"""
+    return _template.cache_info()
+
+
+def clear_template_cache():
+    _template.cache_clear()
+
+
+def field_description(segment_name, field_num, value, component, tables):
+    """Look up the description of a field in ``tables``, enriching MSH-9 with the event"""
+    description = tables.field(segment_name, field_num)
+
+    # Special handling for MSH-9 (Message Type) field
+    if segment_name == 'MSH' and field_num == 9 and value:
+        parts = value.split(component)
+        if len(parts) >= 2 and parts[0] == 'ADT':
+            event = tables.events.get(parts[1])
+            if event is not None:
+                description += f" - {event}"
+    return description
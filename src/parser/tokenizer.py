@@ -0,0 +1,385 @@
+"""Native single-pass HL7 tokenizer.
+
+The tokenizer records the boundaries of every segment and field as
+offsets into the original string; values are sliced out of the text only
+when they are read.
+
+The offsets of all field separators come from one split of the whole
+text, turned into positions by ``accumulate`` in C, and segments from
+``splitlines()``; ``\r``, ``\n`` and ``\r\n`` (also mixed) are accepted.
+The pieces are only measured, never kept. Python code then runs once per
+segment rather than once per field. Text holding other characters that
+``splitlines()`` breaks on is scanned segment by segment instead.
+Delimiters come from the message's own MSH-1/MSH-2 (see encoding.py), so
+feeds with nonstandard encoding characters tokenize correctly.
+
+Below the field level the work is deferred: a field is split into
+repetitions (``~``), and a repetition into components and
+subcomponents, only when a consumer asks for it (see
+``repetition_spans`` and ``tokenize_value``).
+
+With a Projection (see projection.py) only the listed segments are
+tokenized, and only up to their last requested field.
+
+All functions accept either ``str`` or ``bytes``. For bytes, pass the
+encoding's ``binary`` delimiters; offsets are then byte offsets. The
+lazy field-level functions also accept a ``memoryview``, which is how
+messages rebuilt over shared memory are read (see packed.py).
+"""
+import re
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import accumulate, repeat
+from operator import add
+
+from .encoding import read_encoding, HEADER_SEGMENTS
+
+# A segment is any run of characters up to \r, \n or \r\n
+_SEGMENT = re.compile(r'[^\r\n]+')
+_SEGMENT_BYTES = re.compile(rb'[^\r\n]+')
+
+# Characters str.splitlines() treats as line breaks besides \r and \n;
+# messages containing any of them are scanned with _SEGMENT instead
+_OTHER_LINE_BREAKS = '\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+
+# Stripped from the end of each line of a bytes message: the segment
+# terminators, plus the MLLP end block a frame read off the wire still
+# ends with (see mllp.py), so the frame needs no copy without it
+_BYTES_TERMINATORS = b'\r\n\x1c'
+
+
+# Unsigned 32-bit offsets; one message never approaches 4 GiB
+OFFSET_TYPECODE = 'I'
+
+
+class Tokens:
+    """Segment and field offset tables for one tokenized HL7 message.
+
+    Both levels are stored as parallel start/end ``array('I')`` tables.
+    ``segment_first`` holds, for every segment, the index of its first
+    field, so the fields of segment ``i`` are the range
+    ``segment_first[i]:segment_first[i + 1]``. Field 0 of every segment
+    is the segment name, which keeps field indexes equal to HL7 field
+    numbers (MSH-1 is the field separator itself and MSH-2 the encoding
+    characters). ``literal_fields`` lists the field indexes (MSH-1 and
+    MSH-2) whose values must never be split further.
+    """
+
+    __slots__ = (
+        'segment_start', 'segment_end', 'segment_first',
+        'field_start', 'field_end', 'literal_fields',
+    )
+
+    def __init__(self):
+        self.segment_start = array(OFFSET_TYPECODE)
+        self.segment_end = array(OFFSET_TYPECODE)
+        self.segment_first = array(OFFSET_TYPECODE)
+        self.field_start = array(OFFSET_TYPECODE)
+        self.field_end = array(OFFSET_TYPECODE)
+        self.literal_fields = set()
+
+    def nbytes(self):
+        """Return the number of bytes held by the offset tables"""
+        tables = (self.segment_start, self.segment_end, self.segment_first, self.field_start, self.field_end)
+        return sum(len(table) for table in tables) * array(OFFSET_TYPECODE).itemsize
+
+    def close(self):
+        """Append the sentinel field index used for range lookups"""
+        self.segment_first.append(len(self.field_start))
+        return self
+
+
+class ValueTokens:
+    """Component and subcomponent offsets of one field repetition.
+
+    ``component_first`` works like ``Tokens.segment_first``: the
+    subcomponents of component ``i`` are the range
+    ``component_first[i]:component_first[i + 1]``.
+    """
+
+    __slots__ = ('component_start', 'component_end', 'component_first', 'subcomponent_start', 'subcomponent_end')
+
+    def __init__(self):
+        self.component_start = array(OFFSET_TYPECODE)
+        self.component_end = array(OFFSET_TYPECODE)
+        self.component_first = array(OFFSET_TYPECODE)
+        self.subcomponent_start = array(OFFSET_TYPECODE)
+        self.subcomponent_end = array(OFFSET_TYPECODE)
+
+    def __len__(self):
+        return len(self.component_start)
+
+
+def segment_spans(text, pos=0, endpos=None):
+    """Yield (start, end) for each segment in one pass over the text.
+
+    ``\r``, ``\n`` and ``\r\n`` are all accepted as segment terminators,
+    also mixed within one buffer; blank lines are skipped.
+    """
+    if endpos is None:
+        endpos = len(text)
+    segment = _SEGMENT if isinstance(text, str) else _SEGMENT_BYTES
+    for match in segment.finditer(text, pos, endpos):
+        yield match.span()
+
+
+def tokenize(text, encoding=None, projection=None):
+    """Tokenize an HL7 message and return its Tokens offset tables.
+
+    ``encoding`` defaults to the encoding characters declared in the
+    message's MSH segment. With a ``projection`` only the segments and
+    fields it lists are tokenized.
+    """
+    if encoding is None:
+        encoding = read_encoding(text)
+    if projection is not None:
+        return _tokenize_projection(text, encoding, projection)
+    field_sep = encoding.field
+    if isinstance(text, str):
+        headers, terminators = tuple(name + field_sep for name in HEADER_SEGMENTS), '\r\n'
+        if any(char in text for char in _OTHER_LINE_BREAKS):
+            return _tokenize_scan(text, field_sep, _SEGMENT, headers)
+    else:
+        # bytes.splitlines() only breaks on \r, \n and \r\n
+        headers, terminators = tuple(name.encode('ascii') + field_sep for name in HEADER_SEGMENTS), _BYTES_TERMINATORS
+
+    tokens = Tokens()
+    seg_start, seg_end, seg_first = tokens.segment_start, tokens.segment_end, tokens.segment_first
+    field_start, field_end = tokens.field_start, tokens.field_end
+
+    # The offset of every field separator, from one split of the whole
+    # text in C: each piece ends just before a separator
+    seps = list(accumulate(map(add, map(len, text.split(field_sep)), repeat(1)), initial=-1))
+    del seps[0], seps[-1]
+    after = list(map(add, seps, repeat(1)))
+
+    first = pos = 0
+    for line in text.splitlines(True):
+        start = pos
+        pos += len(line)
+        end = start + len(line.rstrip(terminators))
+        if end == start:
+            continue
+        seg_start.append(start)
+        seg_end.append(end)
+        seg_first.append(len(field_start))
+
+        # The separators inside this segment
+        last = bisect_left(seps, end, first)
+        if text.startswith(headers, start):
+            fields_from = _msh_header(text, start, end, field_sep, tokens)
+            if fields_from > end:
+                first = last
+                continue
+            first = bisect_left(seps, fields_from, first, last)
+        else:
+            fields_from = start
+        field_start.append(fields_from)
+        field_start.extend(after[first:last])
+        field_end.extend(seps[first:last])
+        field_end.append(end)
+        first = last
+
+    return tokens.close()
+
+
+def _tokenize_scan(text, field_sep, segment, headers):
+    """Tokenize segment by segment with a regex scan and str.find().
+
+    Used for text containing line breaks other than \r and \n, which
+    splitlines() would split segments on.
+    """
+    tokens = Tokens()
+    seg_start, seg_end, seg_first = tokens.segment_start, tokens.segment_end, tokens.segment_first
+    field_start, field_end = tokens.field_start, tokens.field_end
+    find = text.find
+
+    for match in segment.finditer(text):
+        start, end = match.span()
+        seg_start.append(start)
+        seg_end.append(end)
+        seg_first.append(len(field_start))
+
+        pos = start
+        if text.startswith(headers, start):
+            pos = _msh_header(text, start, end, field_sep, tokens)
+            if pos > end:
+                continue
+
+        # Field boundaries: one C-level search per field separator
+        while True:
+            sep = find(field_sep, pos, end)
+            if sep < 0:
+                break
+            field_start.append(pos)
+            field_end.append(sep)
+            pos = sep + 1
+        field_start.append(pos)
+        field_end.append(end)
+
+    return tokens.close()
+
+
+def _msh_header(text, start, end, field_sep, tokens):
+    """Record the MSH name, MSH-1 and MSH-2; return where MSH-3 starts.
+
+    MSH-1 (the field separator) and MSH-2 (the encoding characters) are
+    literal values and must not be split. The returned position is past
+    ``end`` when the segment stops after MSH-2. FHS and BHS headers have
+    the same layout.
+    """
+    field_start, field_end = tokens.field_start, tokens.field_end
+    first = len(field_start)
+    tokens.literal_fields.update((first + 1, first + 2))
+    enc_start = start + 4
+    enc_end = text.find(field_sep, enc_start, end)
+    if enc_end < 0:
+        enc_end = end
+    field_start.extend((start, start + 3, enc_start))
+    field_end.extend((start + 3, start + 4, enc_end))
+    return enc_end + 1
+
+
+def _projected_spans(text, names, field_sep):
+    """Yield (start, end) of the segments whose name is in names.
+
+    Lines are cut by splitlines() in C and only the wanted ones are looked
+    at further; skipped segments cost one slice and a set lookup. ``names``
+    must be of the same type as text.
+    """
+    if isinstance(text, str):
+        terminators = '\r\n'
+        if any(char in text for char in _OTHER_LINE_BREAKS):
+            for start, end in segment_spans(text):
+                if text[start:start + 3] in names and text[start + 3:start + 4] in (field_sep, ''):
+                    yield start, end
+            return
+    else:
+        # bytes.splitlines() only breaks on \r, \n and \r\n
+        terminators = _BYTES_TERMINATORS
+
+    heads = {name + field_sep for name in names}
+    pos = 0
+    for line in text.splitlines(True):
+        if line[:4] in heads or (len(line) <= 5 and line.rstrip(terminators) in names):
+            yield pos, pos + len(line.rstrip(terminators))
+        pos += len(line)
+
+
+def _tokenize_projection(text, encoding, projection):
+    """Tokenize only the segments and fields listed in a projection.
+
+    Fields of a kept segment are recorded up to its last requested field
+    so field indexes still equal HL7 field numbers; fields in between
+    that were not requested are stored as empty spans, which path
+    queries read as their default (see Projection.keeps()).
+    """
+    field_sep = encoding.field
+    wanted_fields, last_fields = projection.fields, projection.last_field
+    # Segment names as they appear in text, mapped to the projection's keys
+    if isinstance(text, str):
+        names = {name: name for name in wanted_fields}
+    else:
+        names = {name.encode('ascii'): name for name in wanted_fields}
+
+    tokens = Tokens()
+    seg_start, seg_end, seg_first = tokens.segment_start, tokens.segment_end, tokens.segment_first
+    field_start, field_end = tokens.field_start, tokens.field_end
+    find = text.find
+
+    for start, end in _projected_spans(text, names, field_sep):
+        name = names[text[start:start + 3]]
+        seg_start.append(start)
+        seg_end.append(end)
+        seg_first.append(len(field_start))
+
+        if name in HEADER_SEGMENTS:
+            pos = _msh_header(text, start, end, field_sep, tokens)
+            number = 3
+        else:
+            field_start.append(start)
+            field_end.append(start + 3)
+            pos = start + 4
+            number = 1
+        if pos > end:
+            continue
+
+        wanted = wanted_fields[name]
+        last = last_fields.get(name)
+        while last is None or number <= last:
+            sep = find(field_sep, pos, end)
+            stop = end if sep < 0 else sep
+            field_start.append(pos)
+            field_end.append(stop if wanted is None or number in wanted else pos)
+            if sep < 0:
+                break
+            pos = sep + 1
+            number += 1
+
+    return tokens.close()
+
+
+def repetition_spans(text, start, end, repetition_sep):
+    """Return the (start, end) span of every repetition of a field value"""
+    spans = []
+    pos = start
+    for sep in _find_all(text, repetition_sep, start, end):
+        spans.append((pos, sep))
+        pos = sep + 1
+    spans.append((pos, end))
+    return spans
+
+
+def _find_all(text, sep, start, end):
+    """Yield the position of every occurrence of sep in text[start:end]"""
+    if isinstance(text, memoryview):
+        # memoryviews have no find(); a regex searches them in place
+        for match in _literal(sep).finditer(text, start, end):
+            yield match.start()
+        return
+    find = text.find
+    pos = find(sep, start, end)
+    while pos >= 0:
+        yield pos
+        pos = find(sep, pos + 1, end)
+
+
+@lru_cache(maxsize=64)
+def _literal(sep):
+    return re.compile(re.escape(sep))
+
+
+def tokenize_value(text, start, end, encoding=None):
+    """Split one field repetition into component and subcomponent offsets.
+
+    With ``encoding=None`` the value is kept whole as a single component,
+    which is how MSH-1 and MSH-2 are represented.
+    """
+    value = ValueTokens()
+    comp_start, comp_end, comp_first = value.component_start, value.component_end, value.component_first
+    sub_start, sub_end = value.subcomponent_start, value.subcomponent_end
+
+    comp_start.append(start)
+    comp_first.append(0)
+    sub_start.append(start)
+    if encoding is None:
+        delimiters = ()
+    else:
+        subcomponent_sep = encoding.subcomponent
+        delimiters = encoding.value_delimiters.finditer(text, start, end)
+    for delimiter in delimiters:
+        pos = delimiter.start()
+        sub_end.append(pos)
+        if text[pos:pos + 1] == subcomponent_sep:
+            sub_start.append(pos + 1)
+            continue
+        # Component separator
+        comp_end.append(pos)
+        comp_start.append(pos + 1)
+        comp_first.append(len(sub_start))
+        sub_start.append(pos + 1)
+    sub_end.append(end)
+    comp_end.append(end)
+    comp_first.append(len(sub_start))
+    return value
@@ -0,0 +1,138 @@
+"""Thin client for the local parse service (src/parser/service.py).
+
+Only the standard library is imported here, so a script talking to a
+running service starts in milliseconds instead of loading the parser.
+Addresses are ``unix:/path/to/socket`` or ``host:port`` (an ``http://``
+prefix is allowed). default_address() is where the service listens
+unless told otherwise; the HL7PARSER_SERVICE environment variable
+overrides it for both sides.
+"""
+import http.client
+import json
+import os
+import socket
+import tempfile
+
+ADDRESS_VARIABLE = 'HL7PARSER_SERVICE'
+# Used where Unix sockets are not available
+DEFAULT_PORT = 8765
+DEFAULT_TIMEOUT = 30.0
+
+# Errors meaning no service is listening at the address
+NOT_RUNNING = (ConnectionRefusedError, FileNotFoundError)
+
+
+def default_address():
+    """Return the service address from HL7PARSER_SERVICE, or the per-user default"""
+    address = os.environ.get(ADDRESS_VARIABLE)
+    if address:
+        return address
+    if hasattr(socket, 'AF_UNIX') and os.name != 'nt':
+        return 'unix:' + os.path.join(tempfile.gettempdir(), f'hl7parser-{os.getuid()}.sock')
+    return f'127.0.0.1:{DEFAULT_PORT}'
+
+
+def parse_address(address):
+    """Return ('unix', path) or ('tcp', (host, port)) for an address string"""
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):]
+    if address.startswith('http://'):
+        address = address[len('http://'):].rstrip('/')
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid service address {address!r}: use unix:PATH or HOST:PORT")
+    return 'tcp', (host.strip('[]'), int(port))
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    """HTTPConnection over a Unix socket"""
+
+    def __init__(self, socket_path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        try:
+            self.sock.connect(self.socket_path)
+        except OSError:
+            self.sock.close()
+            self.sock = None
+            raise
+
+
+class ParseClient:
+    """A keep-alive connection to a parse service.
+
+    parse() raises ValueError when the service cannot parse the message,
+    like HL7Parser does, and ConnectionRefusedError or FileNotFoundError
+    (see NOT_RUNNING) when no service is listening.
+    """
+
+    def __init__(self, address=None, timeout=DEFAULT_TIMEOUT):
+        self.address = address or default_address()
+        kind, target = parse_address(self.address)
+        if kind == 'unix':
+            self.connection = _UnixConnection(target, timeout)
+        else:
+            self.connection = http.client.HTTPConnection(*target, timeout=timeout)
+        self._used = False
+
+    def parse(self, data):
+        """Return the structure of one message as nested dicts"""
+        return json.loads(self.parse_json(data))
+
+    def parse_json(self, data):
+        """Return the structure of one message as the service's JSON bytes"""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return self._request('POST', '/parse', data)
+
+    def health(self):
+        return json.loads(self._request('GET', '/health'))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _request(self, method, url, body=None):
+        headers = {'Content-Type': 'application/hl7-v2'} if body is not None else {}
+        try:
+            response = self._exchange(method, url, body, headers)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            if not self._used:
+                raise
+            # The service closed the idle keep-alive connection; retry once
+            self.connection.close()
+            response = self._exchange(method, url, body, headers)
+        self._used = True
+        data = response.read()
+        if response.status == 200:
+            return data
+        try:
+            error = json.loads(data)['error']
+        except (ValueError, KeyError, TypeError):
+            error = data.decode('utf-8', 'replace')
+        if response.status < 500:
+            raise ValueError(error)
+        raise OSError(f"Parse service error {response.status}: {error}")
+
+    def _exchange(self, method, url, body, headers):
+        self.connection.request(method, url, body, headers)
+        return self.connection.getresponse()
+
+
+def is_running(address=None):
+    """Return True if a parse service answers at the address"""
+    try:
+        with ParseClient(address, timeout=1.0) as client:
+            client.health()
+        return True
+    except (OSError, http.client.HTTPException):
+        return False
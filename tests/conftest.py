@@ -0,0 +1,16 @@
+"""Messages shared by the tests; import the helpers with ``from conftest import ...``"""
+
+
+def build_message(n, message_type="ORU^R01"):
+    """Build a message with control ID MSGnnnn, a patient with two IDs and one result"""
+    return (f"MSH|^~\\&|LAB|HOSP|EHR|HOSP|20230101120000||{message_type}|MSG{n:04d}|P|2.5.1\r"
+            f"PID|1||{n}^^^HOSP^MR~X{n}^^^STATE^SS||DOE^JOHN\r"
+            f"OBX|1|NM|718-7^Hemoglobin^LN||13.{n % 10}|g/dL")
+
+
+def build_batch(count, message=build_message):
+    """Build a file of one batch with ``message(n)`` for n in range(count)"""
+    return ("FHS|^~\\&|LAB|HOSP|||20230101\r"
+            "BHS|^~\\&|LAB|HOSP|||20230101||||BATCH1\r"
+            + "\r".join(message(n) for n in range(count)) +
+            f"\rBTS|{count}\rFTS|1\r")
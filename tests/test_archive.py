@@ -0,0 +1,69 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.archive import HL7Archive
+from conftest import build_message
+
+@pytest.fixture
+def archive_path(tmp_path):
+    path = tmp_path / "archive.hl7"
+    body = ("FHS|^~\\&|LAB\rBHS|^~\\&|LAB\r"
+            + "\r".join(build_message(n) for n in range(10))
+            + "\rBTS|10\rBHS|^~\\&|LAB\r\n"
+            + "\r\n".join(build_message(n) for n in range(10, 20))
+            + "\r\nBTS|10\r\nFTS|2\r\n")
+    path.write_bytes(body.encode())
+    return path
+
+def test_archive_random_access(archive_path):
+    """Test indexing, negative indexes, slicing and len()"""
+    with HL7Archive(archive_path) as archive:
+        assert len(archive) == 20
+        assert archive[0].get("MSH-10") == "MSG0000"
+        assert archive[-1].get("MSH-10") == "MSG0019"
+        assert [message.get("PID-3.1") for message in archive[8:12]] == ["8", "9", "10", "11"]
+        # Trailing envelope segments are not part of a message
+        assert archive[9].segment_names() == ["MSH", "PID", "OBX"]
+        assert archive[19].segment_names() == ["MSH", "PID", "OBX"]
+        with pytest.raises(IndexError):
+            archive[20]
+
+def test_archive_reads_keep_no_state(archive_path):
+    """Test that reading messages leaves the archive's parser unchanged"""
+    with HL7Archive(archive_path) as archive:
+        with ThreadPoolExecutor(4) as executor:
+            control_ids = list(executor.map(lambda n: archive[n].get("MSH-10"), range(20)))
+        first = archive[0]
+        assert archive.parser.message is None and archive.parser.raw_message is None
+    assert control_ids == [f"MSG{n:04d}" for n in range(20)]
+    # Messages own their bytes and outlive the mapping
+    assert first.get("PID-3.1") == "0"
+
+def test_archive_index_and_raw_views(archive_path):
+    """Test the offset tables and zero-copy views"""
+    data = archive_path.read_bytes()
+    with HL7Archive(archive_path) as archive:
+        assert archive.starts.typecode == "Q"
+        start, end = archive.span(3)
+        assert data[start:end].decode() == build_message(3)
+        view = archive.raw(3)
+        assert bytes(view) == data[start:end]
+        view.release()
+
+def test_archive_empty_and_projection(tmp_path):
+    """Test an empty file and parsing with a projection"""
+    empty = tmp_path / "empty.hl7"
+    empty.write_bytes(b"")
+    with HL7Archive(empty) as archive:
+        assert len(archive) == 0
+
+    single = tmp_path / "single.hl7"
+    single.write_bytes(build_message(7).encode())
+    with HL7Archive(single, projection={"OBX": [5]}) as archive:
+        assert archive[0].segment_names() == ["OBX"]
+        assert archive[0].get("OBX-5") == "13.7"
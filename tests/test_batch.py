@@ -0,0 +1,85 @@
+import io
+import json
+import os
+import sys
+import pytest
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.batch import parse_files, parse_partitioned, partition_for, split_tasks, find_files, fields_projection
+from conftest import build_message
+
+@pytest.fixture
+def batch_dir(tmp_path):
+    (tmp_path / "a.hl7").write_bytes(("BHS|^~\\&|LAB\r" + "\r".join(build_message(n) for n in range(40))
+                                      + "\rBTS|40\r").encode())
+    (tmp_path / "b.hl7").write_bytes(build_message(40).encode())
+    (tmp_path / "notes.txt").write_text("not HL7")
+    return tmp_path
+
+def test_split_tasks_on_message_boundaries(batch_dir):
+    """Test that large files are cut between messages and small files grouped"""
+    paths = find_files(batch_dir)
+    assert [os.path.basename(path) for path in paths] == ["a.hl7", "b.hl7"]
+
+    tasks = list(split_tasks(paths, chunk_size=500))
+    data = (batch_dir / "a.hl7").read_bytes()
+    ranges = [item for task in tasks for item in task if item[0] == paths[0]]
+    assert len(ranges) > 1
+    assert ranges[0][1] == 0 and ranges[-1][2] == len(data)
+    for (_, _, end), (_, start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert data[start:start + 3] in (b"MSH", b"BTS")
+
+    assert list(split_tasks(paths, chunk_size=1 << 20)) == [[(path, 0, os.path.getsize(path)) for path in paths]]
+
+@pytest.mark.parametrize("workers,ordered", [(1, True), (2, True), (2, False)])
+def test_parse_files(batch_dir, workers, ordered):
+    """Test one JSON row per message, in input order unless unordered"""
+    output = io.StringIO()
+    summary = parse_files(find_files(batch_dir), output, ["MSH-10", "PID-3.1"], workers=workers,
+                          ordered=ordered, chunk_size=300)
+    rows = [json.loads(line) for line in output.getvalue().splitlines()]
+    control_ids = [row["MSH-10"] for row in rows]
+    expected = [f"MSG{n:04d}" for n in range(41)]
+    assert (control_ids if ordered else sorted(control_ids)) == expected
+    assert {"file": str(batch_dir / "a.hl7"), "MSH-10": "MSG0000", "PID-3.1": "0"} in rows
+    assert summary.messages == 41 and summary.errors == 0 and summary.files == 2
+
+def test_parse_files_csv_and_errors(batch_dir):
+    """Test CSV output, wildcard paths and unreadable files"""
+    output = io.StringIO()
+    missing = str(batch_dir / "missing.hl7")
+    summary = parse_files([str(batch_dir / "b.hl7"), missing], output, ["MSH-10", "OBX[*]-5"],
+                          workers=1, output_format="csv")
+    lines = output.getvalue().splitlines()
+    assert lines[0] == "file,MSH-10,OBX[*]-5"
+    assert lines[1].endswith(",MSG0040,13.0")
+    assert lines[2].startswith(missing + ",ERROR:")
+    assert summary.errors == 1
+    assert fields_projection(["MSH-10", "OBX[*]-5", "OBX-3.1"]) == {"MSH": {10}, "OBX": {3, 5}}
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_parse_partitioned_keeps_order_per_key(tmp_path, workers):
+    """Test that each patient's events keep their order and skew counters add up"""
+    events = [(n % 7, n) for n in range(90)] + [(None, 90)]
+    for part in range(2):
+        (tmp_path / f"{part}.hl7").write_bytes("\r".join(
+            f"MSH|^~\\&|ADT|HOSP|EHR|HOSP|20230101||ADT^A0{n % 3 + 1}|MSG{n:04d}|P|2.5.1\r"
+            + (f"PID|1||{patient}^^^HOSP^MR" if patient is not None else "PID|1")
+            for patient, n in events[part::2]).encode())
+    output = io.StringIO()
+    summary = parse_partitioned(find_files(tmp_path), output, "PID-3.1", ["MSH-10", "PID-3.1"],
+                                workers=workers, batch_size=4)
+    rows = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert len(rows) == summary.messages == 91
+    expected = [f"MSG{n:04d}" for n in range(0, 91, 2)] + [f"MSG{n:04d}" for n in range(1, 90, 2)]
+    for patient in ["0", "3", "6", ""]:
+        ids = [row["MSH-10"] for row in rows if row["PID-3.1"] == patient]
+        assert ids == [control_id for control_id in expected if control_id in ids]
+    assert sum(summary.partition_messages) == 91 and len(summary.partition_messages) == workers
+    assert sum(summary.partition_keys) == 8
+    assert summary.unkeyed == 1 and summary.max_key_messages == 13
+    assert summary.skew >= 1.0
+    assert partition_for("12345", 4) == partition_for("12345", 4) < 4
@@ -0,0 +1,60 @@
+import os
+import sys
+import pytest
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.hl7_parser import HL7Parser
+from src.parser.charsets import DecodedText, codec_for
+
+def build_message(charset):
+    return ("MSH|^~\\&|APP|FAC|||20230101120000||ADT^A01|MSG1|P|2.5.1||||||" + charset + "\r"
+            "PID|1||123^^^HOSP||MÜLLER^JOSÉ~GARÇON^ÉLODIE||19700101|F")
+
+def test_codec_for_msh_18():
+    """Test the mapping of MSH-18 values to codecs"""
+    assert codec_for("8859/1") == "latin-1"
+    assert codec_for("UNICODE UTF-8") == "utf-8"
+    assert codec_for("ASCII") == "ascii"
+    assert codec_for("") == "utf-8"
+    assert codec_for("NOT A CHARSET") == "utf-8"
+
+@pytest.mark.parametrize("charset, codec", [("8859/1", "latin-1"), ("UNICODE UTF-8", "utf-8")])
+def test_parse_bytes_decodes_lazily(charset, codec):
+    """Test that byte messages are tokenized undecoded and decoded per value"""
+    parser = HL7Parser()
+    parser.parse_bytes(build_message(charset).encode(codec) + b"\r\n")
+    message = parser.message
+
+    assert message.charset == codec
+    assert isinstance(message.raw_text, DecodedText)
+    assert isinstance(message.buffer, bytes)
+    assert message.get("PID-5.1") == "MÜLLER"
+    assert message.get("PID-5[2].2") == "ÉLODIE"
+    assert message[1][5].repetition(2)[1].value == "GARÇON"
+    assert str(message) == build_message(charset) + "\r\n"
+
+    structure = parser.get_structure()
+    assert structure["children"][1]["children"][4]["children"][0]["name"] == "PID-5[1]"
+
+def test_parse_bytes_wide_and_bom():
+    """Test UTF-16 messages and a UTF-8 byte order mark"""
+    text = build_message("UNICODE UTF-16")
+    parser = HL7Parser()
+    parser.parse_bytes(text.encode("utf-16"))
+    assert parser.message.get("PID-5.2") == "JOSÉ"
+
+    parser.parse_bytes(build_message("UNICODE UTF-8").encode("utf-8-sig"))
+    assert parser.message.get("MSH-3") == "APP"
+
+def test_parse_file_binary(tmp_path):
+    """Test parse_file(binary=True) on a Latin-1 feed"""
+    path = tmp_path / "latin1.hl7"
+    path.write_bytes(build_message("8859/1").encode("latin-1"))
+    parser = HL7Parser()
+    parser.parse_file(str(path), binary=True)
+    assert parser.message.get("PID-5.2") == "JOSÉ"
+
+    with pytest.raises(ValueError):
+        parser.parse_bytes(b"PID|1||123")
@@ -0,0 +1,139 @@
+import json
+import os
+import sys
+import tempfile
+import warnings
+
+import pytest
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.definitions import (CompiledDefinitions, compile_definitions, definitions, resolve_version,
+                                   field_description, event_description, set_overlay, current_overlay,
+                                   cache_path, DEFAULT_VERSION, SUPPORTED_VERSIONS)
+from src.parser.hl7_parser import parse
+from src.parser.hl7_definitions import HL7_SEGMENTS, HL7_FIELDS, ADT_CODES, VERSION_FIELD_COUNTS
+
+def test_compiled_tables_match_definitions():
+    """Test that the integer-indexed tables hold exactly the definition dicts"""
+    compiled = compile_definitions()
+    assert compiled.segments == HL7_SEGMENTS and compiled.events == ADT_CODES
+    for segment_name, fields in HL7_FIELDS.items():
+        table = compiled.fields(segment_name)
+        assert {str(n): d for n, d in enumerate(table) if d is not None} == fields
+    assert compiled.fields("ZZZ") == ()
+    assert field_description("PID", 5) == "Patient Name"
+    assert field_description("PID", 999) == field_description("ZZZ", 1) == "Unknown Field"
+    assert event_description("A01") == ADT_CODES["A01"] and event_description("Q99") is None
+
+def test_cache_round_trip_and_staleness():
+    """Test that cached tables load per segment and are rejected once the source changes"""
+    path = os.path.join(tempfile.mkdtemp(), "definitions.defs")
+    compile_definitions().save(path, 100, 200)
+    loaded = CompiledDefinitions.load(path, 100, 200)
+    assert loaded._fields == {}
+    assert loaded.fields("OBX")[5] == HL7_FIELDS["OBX"]["5"]
+    assert list(loaded._fields) == ["OBX"]
+    with pytest.raises(ValueError, match="Stale"):
+        CompiledDefinitions.load(path, 100, 201)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 1)
+    with pytest.raises(ValueError, match="Truncated"):
+        CompiledDefinitions.load(path, 100, 200)
+
+def test_version_registry():
+    """Test per-version tables, cached fallbacks and a mixed-version structure"""
+    assert resolve_version("2.5.1") == "2.5.1"
+    assert resolve_version("2.5.2") == "2.5"
+    assert resolve_version("2.9") == resolve_version("") == resolve_version("garbage") == DEFAULT_VERSION
+    assert definitions("2.5.2") is definitions("2.5")
+    assert definitions("2.3").field("PID", 31) == "Unknown Field"
+    assert definitions("2.4").field("PID", 31) == HL7_FIELDS["PID"]["31"]
+    assert definitions("2.4").field("MSH", 21) == "Conformance Statement ID"
+    assert definitions("2.3").field("OBX", 26) == "Unknown Field"
+    assert definitions("2.3").field("OBX", 17) == HL7_FIELDS["OBX"]["17"]
+    assert definitions("2.7").field("OBX", 26) == HL7_FIELDS["OBX"]["26"]
+    with pytest.raises(ValueError, match="Unsupported"):
+        compile_definitions("2.9")
+
+    header = "MSH|^~\\&|A|B|C|D|20230101||ADT^A01|%s|P|%s\rPID|1" + "|x" * 30
+    old, new = (parse(header % (n, version)).get_structure() for n, version in enumerate(("2.3^USA", "2.5.1")))
+    assert old.children[1].children[30].description == "Unknown Field"
+    assert new.children[1].children[30].description == HL7_FIELDS["PID"]["31"]
+
+def test_version_field_counts_are_complete():
+    """Test that every version limits every defined segment, and no version exceeds the union"""
+    for version in SUPPORTED_VERSIONS:
+        counts = VERSION_FIELD_COUNTS[version]
+        assert set(counts) == set(HL7_FIELDS)
+        assert all(count <= len(HL7_FIELDS[name]) for name, count in counts.items())
+
+    # OBX-26 is not described for a 2.3 message
+    text = "MSH|^~\\&|A|B|C|D|20230101||ORU^R01|1|P|2.3\rOBX|1" + "|x" * 25
+    obx = parse(text).get_structure().children[1]
+    assert obx.children[25].name == "OBX-26"
+    assert obx.children[25].description == "Unknown Field"
+    assert obx.children[16].description == HL7_FIELDS["OBX"]["17"]
+
+def test_overlay_hot_swap():
+    """Test Z-segments, data types and events from an overlay, swapped while running"""
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "site.json")
+    overlay = {
+        "segments": {"ZPD": "Patient Details"},
+        "fields": {"ZPD": {"1": "Set ID", "2": {"description": "Preferred Name", "type": "XPN"}},
+                   "PID": {"5": {"type": "XPN"}}},
+        "data_types": {"XPN": ["Family Name", "Given Name"]},
+        "events": {"Z01": "Site transfer"},
+    }
+    with open(path, "w") as f:
+        json.dump(overlay, f)
+    text = "MSH|^~\\&|A|B|C|D|20230101||ADT^Z01|1|P|2.5.1\rPID|1||42||DOE^JOHN\rZPD|1|JD^J"
+
+    try:
+        loaded = set_overlay(path)
+        root = parse(text).get_structure()
+        msh, pid, zpd = root.children
+        assert os.path.exists(cache_path("2.5.1", loaded))
+        assert msh.children[8].description == "Message Type - Site transfer"
+        assert zpd.description == "Patient Details"
+        assert [field.description for field in zpd.children] == ["Set ID", "Preferred Name"]
+        assert [c.description for c in zpd.children[1].children] == ["Family Name", "Given Name"]
+        assert pid.children[4].description == "Patient Name"
+        assert pid.children[4].children[1].description == "Given Name"
+
+        # The same overlay again keeps the loaded tables
+        tables = definitions("2.5.1")
+        assert set_overlay(path) == loaded and definitions("2.5.1") is tables
+
+        toml_path = os.path.join(directory, "site.toml")
+        with open(toml_path, "w") as f:
+            f.write('[segments]\nZPD = "Patient Details v2"\n')
+        set_overlay(toml_path)
+        assert parse(text).get_structure().children[2].description == "Patient Details v2"
+
+        with open(path, "w") as f:
+            json.dump({"fields": {"ZPD": {"x": "Bad"}}}, f)
+        with pytest.raises(ValueError, match="not a positive integer"):
+            set_overlay(path)
+        assert current_overlay().path == toml_path
+    finally:
+        set_overlay(None)
+    assert parse(text).get_structure().children[2].description == "Unknown Segment"
+
+def test_unreadable_environment_overlay(tmp_path, monkeypatch):
+    """Test that a missing HL7PARSER_OVERLAY file warns once and falls back to the built-in tables"""
+    import src.parser.definitions as module
+    monkeypatch.setattr(module, "_loaded", {})
+    monkeypatch.setattr(module, "_overlay", None)
+    monkeypatch.setattr(module, "_environment_read", False)
+    monkeypatch.setenv(module.OVERLAY_VARIABLE, str(tmp_path / "missing.json"))
+
+    with pytest.warns(RuntimeWarning, match="missing.json"):
+        assert field_description("PID", 5) == "Patient Name"
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert definitions("2.3").field("PID", 5) == "Patient Name"
+        assert current_overlay() is None
+
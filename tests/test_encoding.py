@@ -0,0 +1,59 @@
+import os
+import sys
+import pytest
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.encoding import DEFAULT_ENCODING, get_encoding, read_encoding
+from src.parser.hl7_parser import HL7Parser
+
+def test_read_encoding_from_msh():
+    """Test that delimiters are read from MSH-1 and MSH-2"""
+    encoding = read_encoding("MSH#$*/%#APP#FAC")
+    assert encoding.field == "#"
+    assert encoding.component == "$"
+    assert encoding.repetition == "*"
+    assert encoding.escape == "/"
+    assert encoding.subcomponent == "%"
+
+    assert read_encoding("MSH|^~\\&|APP") is DEFAULT_ENCODING
+    assert read_encoding("not a message") is DEFAULT_ENCODING
+
+def test_encoding_sets_are_shared():
+    """Test that each distinct encoding set is compiled once"""
+    assert read_encoding("MSH#$*/%#A") is read_encoding("MSH#$*/%#B")
+    assert get_encoding("#", "$*/%") is not DEFAULT_ENCODING
+
+def test_unescape_single_pass():
+    """Test decoding of the standard escape sequences"""
+    encoding = DEFAULT_ENCODING
+    assert encoding.unescape("plain value") == "plain value"
+    assert encoding.unescape("A\\F\\B\\S\\C\\T\\D\\R\\E\\E\\") == "A|B^C&D~E\\"
+    assert encoding.unescape("caf\\XE9\\") == "café"
+    # Decoded characters are never decoded a second time
+    assert encoding.unescape("\\E\\F\\E\\") == "\\F\\"
+
+def test_nonstandard_delimiters_parse():
+    """Test a feed that uses nonstandard encoding characters"""
+    parser = HL7Parser()
+    parser.parse_text("MSH#$*/%#APP#FAC###20230101##ADT$A01#MSG1#P#2.5.1\r"
+                      "PID#1##123$$$HOSP%1.2%ISO##DOE$JOHN/S/JR")
+    message = parser.message
+
+    assert message.field_value(0, 1) == "#"
+    assert message.field_value(0, 2) == "$*/%"
+    pid = message[1]
+    assert pid[3][4].subcomponents == ["HOSP", "1.2", "ISO"]
+    assert pid[5][2].value == "JOHN/S/JR"
+    assert pid[5][2].decoded == "JOHN$JR"
+
+    structure = parser.get_structure()
+    msh_9 = structure["children"][0]["children"][8]
+    assert msh_9["description"].endswith("Admit/visit notification")
+    assert structure["children"][1]["children"][4]["children"][1]["value"] == "JOHN$JR"
+
+def test_invalid_encoding_characters():
+    """Test that an unusable encoding set is rejected"""
+    with pytest.raises(ValueError):
+        get_encoding("||", "^~\\&")
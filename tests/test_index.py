@@ -0,0 +1,96 @@
+import os
+import sys
+from datetime import datetime
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.archive import HL7Archive
+from src.parser.index import ArchiveIndex, index_path, timestamp_key
+
+def build_message(n, timestamp):
+    return (f"MSH|^~\\&|LAB|HOSP|EHR|HOSP|{timestamp}||ADT^A0{n % 3 + 1}|CTRL{n % 4}|P|2.5.1\r"
+            f"PID|1||{n}^^^HOSP^MR||DOE^JOHN")
+
+# Deliberately out of time order
+TIMESTAMPS = ["20230103080000", "20230101120000", "202301021530", "20230101000000-0500", "20230104", "20230102"]
+
+def write_archive(path):
+    path.write_bytes("\r".join(build_message(n, ts) for n, ts in enumerate(TIMESTAMPS)).encode())
+
+def test_timestamp_key():
+    """Test normalization of HL7 timestamps"""
+    assert timestamp_key("20230102") == 20230102000000
+    assert timestamp_key("20230102153045.123+0100") == 20230102153045
+    assert timestamp_key(datetime(2023, 1, 2, 15, 30)) == 20230102153000
+    assert timestamp_key("") == 0
+
+def test_sidecar_index_lookups(tmp_path):
+    """Test building, saving and querying the sidecar index"""
+    path = tmp_path / "archive.hl7"
+    write_archive(path)
+    with HL7Archive(path) as archive:
+        index = archive.index
+        assert os.path.exists(index_path(path))
+        assert len(index) == 6
+
+        assert index.find("CTRL1") == [1, 5]
+        assert index.find("CTRL9") == []
+        assert [m.get("PID-3.1") for m in archive.find("CTRL0")] == ["0", "4"]
+
+        assert index.between("20230102", "20230103") == [5, 2]
+        assert index.between(datetime(2023, 1, 3)) == [0, 4]
+        assert [m.get("PID-3.1") for m in archive.between(end="20230101120000")] == ["3"]
+
+        entry = index.entry(2)
+        assert entry.control_id == "CTRL2"
+        assert entry.message_type == "ADT^A03"
+        assert entry.timestamp == 20230102153000
+        start, end = archive.span(2)
+        assert (entry.offset, entry.length) == (start, end - start)
+
+def test_sidecar_reuse_and_invalidation(tmp_path):
+    """Test that a saved index is reused and rebuilt when the archive changes"""
+    path = tmp_path / "archive.hl7"
+    write_archive(path)
+    with HL7Archive(path) as archive:
+        archive.index
+
+    loaded = ArchiveIndex.load(index_path(path))
+    assert loaded.find("CTRL3") == [3]
+    with HL7Archive(path) as archive:
+        # Offsets come from the sidecar instead of a scan
+        assert archive.starts is archive.index.offsets
+        assert archive[5].get("MSH-7") == "20230102"
+
+    with open(path, "ab") as f:
+        f.write(("\r" + build_message(6, "20230105")).encode())
+    with HL7Archive(path) as archive:
+        assert len(archive) == 7
+        assert archive.index.find("CTRL2") == [2, 6]
+    assert len(ArchiveIndex.load(index_path(path))) == 7
+
+def test_index_without_writable_sidecar(tmp_path, monkeypatch):
+    """Test that an index which cannot be saved is still used from memory"""
+    path = tmp_path / "archive.hl7"
+    write_archive(path)
+
+    def read_only(*args):
+        raise PermissionError("read-only directory")
+    monkeypatch.setattr(os, "replace", read_only)
+    with HL7Archive(path) as archive:
+        assert archive.index.find("CTRL1") == [1, 5]
+        assert len(archive) == 6
+    assert os.listdir(tmp_path) == ["archive.hl7"]
+
+def test_unreadable_sidecar_is_rebuilt_in_memory(tmp_path):
+    """Test that an archive opens and is indexed when its sidecar cannot be read"""
+    path = tmp_path / "archive.hl7"
+    write_archive(path)
+    os.mkdir(index_path(path))
+    with HL7Archive(path) as archive:
+        assert len(archive) == 6
+        assert archive.index.find("CTRL2") == [2]
+        assert archive[2].get("MSH-10") == "CTRL2"
+    assert os.path.isdir(index_path(path))
+
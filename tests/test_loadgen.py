@@ -0,0 +1,110 @@
+import asyncio
+import os
+import sys
+import pytest
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.hl7_parser import HL7Parser
+from src.parser.loadgen import LoadGenerator, generate_corpus, replay_file, percentile, timestamp_seconds
+from src.parser.mllp import MLLPServer, END_BLOCK, frame, process_message
+
+def send(messages, handler=None, **options):
+    async def main():
+        async with MLLPServer(handler, port=0) as server:
+            report = await LoadGenerator(port=server.port, **options).send(messages)
+            return server, report
+    return asyncio.run(main())
+
+def test_load_generator_counts_and_latency():
+    """Test pipelined sends over a connection pool and ACK error counting"""
+    def handler(message):
+        if message.get("MSH-9.2") == "A03":
+            raise ValueError("rejected")
+
+    server, report = send(generate_corpus(300), handler, connections=3, window=4)
+    assert report.sent == report.acked == server.messages == 300
+    assert report.errors == 100
+    assert 0 < report.latency_ms[50] <= report.latency_ms[99] <= report.max_latency_ms
+
+def test_paced_replay(tmp_path):
+    """Test streaming replay of a file with MSH-7 time compression and fixed rates"""
+    path = tmp_path / "archive.hl7"
+    path.write_bytes(b"\r".join(payload for payload, _ in generate_corpus(20, interval=60)))
+
+    parser = HL7Parser()
+    assert [message.get("MSH-10") for message in parser.iter_file(str(path), chunk_size=64)][-1] == "LG00000019"
+    assert parser.message.get("MSH-10") == "LG00000019"
+
+    # 19 minutes of MSH-7 time at 3,800x take 0.3 s
+    _, report = send(replay_file(str(path)), speed=3800)
+    assert report.acked == 20
+    assert 0.25 <= report.elapsed < 2
+
+    _, report = send(generate_corpus(10), rate=50)
+    assert 0.15 <= report.elapsed < 2
+
+def test_slow_connection_gets_fewer_messages():
+    """Test that messages go to the least loaded connection, not round-robin"""
+    counts = []
+
+    async def serve(reader, writer):
+        n = len(counts)
+        counts.append(0)
+        try:
+            while True:
+                data = await reader.readuntil(END_BLOCK)
+                counts[n] += 1
+                if n == 0:
+                    # The first connection acknowledges slowly
+                    await asyncio.sleep(0.5)
+                writer.write(frame(process_message(data[1:-len(END_BLOCK)])[1]))
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        async with server:
+            port = server.sockets[0].getsockname()[1]
+            return await LoadGenerator(port=port, connections=3, window=2).send(generate_corpus(60))
+
+    report = asyncio.run(main())
+    assert report.acked == 60 and sum(counts) == 60
+    # Round-robin would have queued 20 messages behind the slow ACKs
+    assert counts[0] <= 4
+
+def test_failed_open_closes_other_connections(monkeypatch):
+    """Test that connections already open are closed when another cannot be opened"""
+    open_connection = asyncio.open_connection
+    calls = []
+
+    async def second_fails(host, port):
+        calls.append(port)
+        if len(calls) == 2:
+            raise ConnectionRefusedError("refused")
+        return await open_connection(host, port)
+
+    async def main():
+        async with MLLPServer(port=0) as server:
+            monkeypatch.setattr(asyncio, "open_connection", second_fails)
+            with pytest.raises(ConnectionRefusedError):
+                await LoadGenerator(port=server.port, connections=3).send(generate_corpus(5))
+            for _ in range(100):
+                if not server.connections:
+                    break
+                await asyncio.sleep(0.01)
+            return server
+
+    server = asyncio.run(main())
+    assert len(calls) == 3 and server.connections == 0
+
+def test_percentiles_and_timestamps():
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile([1, 2, 3, 4], 99) == 4
+    assert percentile([], 50) == 0.0
+    assert timestamp_seconds("20230101000100") - timestamp_seconds("20230101") == 60
+    assert timestamp_seconds("") is None
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import sys
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.hl7_parser import parse
+from src.parser.mllp import MLLPServer, frame, END_BLOCK
+from src.parser.message import HL7Message
+
+def build_message(n, event="A01"):
+    return (f"MSH|^~\\&|ADT|HOSP|LAB|HOSP|20230101120000||ADT^{event}|MSG{n:04d}|P|2.5.1\r"
+            f"PID|1||{n}^^^HOSP^MR||DOE^JOHN").encode()
+
+async def exchange(server, payload, count):
+    """Send payload over a loopback connection and read count ACKs"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+    writer.write(payload)
+    await writer.drain()
+    acks = [HL7Message((await reader.readuntil(END_BLOCK))[1:-2]) for _ in range(count)]
+    writer.close()
+    return acks
+
+def run(handler=None, payload=b"", count=0, **options):
+    async def main():
+        async with MLLPServer(handler, port=0, **options) as server:
+            acks = await exchange(server, payload, count)
+            return server, acks
+    return asyncio.run(main())
+
+def test_pipelined_acks_in_order():
+    """Test that pipelined messages are acknowledged in order, with backpressure"""
+    payload = b"".join(frame(build_message(n)) for n in range(200))
+    server, acks = run(payload=payload, count=200, max_pending=2)
+    assert [ack.get("MSA-2") for ack in acks] == [f"MSG{n:04d}" for n in range(200)]
+    assert all(ack.get("MSA-1") == "AA" for ack in acks)
+    assert acks[0].get("MSH-3") == "LAB" and acks[0].get("MSH-5") == "ADT"
+    assert acks[0].get("MSH-9") == "ACK^A01^ACK"
+    assert server.messages == 200 and server.errors == 0
+
+def test_error_acks_and_executor():
+    """Test AE ACKs for handler failures and unparseable frames, in a thread pool"""
+    def handler(message):
+        if message.get("MSH-9.2") == "A03":
+            raise ValueError("discharges | not accepted")
+
+    payload = (frame(build_message(1)) + b"noise" + frame(build_message(2, "A03"))
+               + frame(b"PID|1||3") + frame(build_message(4)))
+    with ThreadPoolExecutor(2) as executor:
+        server, acks = run(handler, payload, 4, executor=executor)
+    assert [ack.get("MSA-1") for ack in acks] == ["AA", "AE", "AE", "AA"]
+    assert acks[1].get("MSA-2") == "MSG0002"
+    assert acks[1].get("MSA-3") == "discharges | not accepted"
+    assert server.errors == 2
+
+class BrokenExecutor(Executor):
+    """An executor whose every task fails, like a process pool that lost a worker"""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_exception(BrokenProcessPool("a worker process died"))
+        return future
+
+def test_executor_failures_send_error_acks():
+    """Test that a failing executor yields AE ACKs and keeps the connection open"""
+    payload = b"".join(frame(build_message(n)) for n in range(3))
+    server, acks = run(payload=payload, count=3, executor=BrokenExecutor())
+    assert [ack.get("MSA-1") for ack in acks] == ["AE", "AE", "AE"]
+    assert [ack.get("MSA-2") for ack in acks] == ["MSG0000", "MSG0001", "MSG0002"]
+    assert acks[0].get("MSA-3") == "BrokenProcessPool: a worker process died"
+    assert server.messages == 3 and server.errors == 3
+
+def test_frames_parsed_as_read():
+    """Test that a frame reaches the parser with its end block, which is skipped"""
+    received = []
+    payload = frame(build_message(1)) + b"\r\n" + frame(build_message(2) + b"\r")
+    server, acks = run(received.append, payload, 2)
+    assert [ack.get("MSA-1") for ack in acks] == ["AA", "AA"]
+    first, second = received
+    # The handler sees the bytes read off the stream, end block included
+    assert first.buffer.endswith(END_BLOCK)
+    assert str(first) == build_message(1).decode()
+    assert first.get("PID-5") == "DOE^JOHN" and second.get("PID-5.2") == "JOHN"
+    assert first.segments[-1].fields[-1].value == "DOE^JOHN"
+    assert parse(first.buffer, {"PID": [5]}).get("PID-5") == "DOE^JOHN"
+
+    # Charsets decoded up front stop before the end block as well
+    data = build_message(3).replace(b"|2.5.1\r", b"|2.5.1||||||ISO IR87\r") + END_BLOCK
+    message = parse(data)
+    assert message.charset == "iso2022_jp" and str(message).endswith("DOE^JOHN")
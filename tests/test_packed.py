@@ -0,0 +1,55 @@
+import os
+import sys
+import pytest
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.message import HL7Message
+from src.parser.packed import pack_messages, share_messages, PackedMessages, SharedMessages
+from src.parser.batch import parse_messages
+
+SAMPLE = ("MSH|^~\\&|LAB|HOSP|EHR|HOSP|20230101120000||ORU^R01|MSG0001|P|2.5.1||||||8859/1\r"
+          "PID|1||123^^^HOSP^MR~456^^^STATE^SS||DÖE^JÖHN\r"
+          "OBX|1|CE|718-7&LN^Hemoglobin||13.5|g/dL")
+
+def test_pack_round_trip():
+    """Test that text, bytes and projected messages read the same after packing"""
+    originals = [
+        HL7Message(SAMPLE),
+        HL7Message(SAMPLE.encode("latin-1")),
+        HL7Message(SAMPLE.encode("latin-1"), projection={"PID": [3]}),
+    ]
+    packed = PackedMessages(pack_messages(originals))
+    assert len(packed) == 3
+    for message, original in zip(packed, originals):
+        assert isinstance(message.tokens.field_start, memoryview)
+        assert message.segment_names() == original.segment_names()
+        for path in ("MSH-10", "PID-3[*].1", "PID-5.1", "OBX-3.1.2", "OBX-5"):
+            assert message.get(path) == original.get(path)
+        assert message.get_structure().to_dict() == original.get_structure().to_dict()
+    assert packed[1].charset == "latin-1"
+
+def test_shared_memory_handoff():
+    """Test reading messages from a shared memory segment and freeing it"""
+    name = share_messages([HL7Message(SAMPLE)] * 3)
+    with SharedMessages(name) as shared:
+        assert [message.get("PID-5.2") for message in shared] == ["JÖHN"] * 3
+    with pytest.raises(FileNotFoundError):
+        SharedMessages(name)
+    with pytest.raises(ValueError):
+        PackedMessages(b"not a packed block")
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_parse_messages(tmp_path, workers):
+    """Test handing messages back from worker processes through shared memory"""
+    for k in range(3):
+        (tmp_path / f"{k}.hl7").write_bytes("\r".join(
+            SAMPLE.replace("MSG0001", f"MSG{k}{n}") for n in range(5)).encode("latin-1"))
+    paths = sorted(str(path) for path in tmp_path.iterdir())
+
+    control_ids = []
+    for block in parse_messages(paths, workers=workers, projection={"MSH": [10]}, chunk_size=256):
+        with block:
+            control_ids.extend(message.get("MSH-10") for message in block)
+    assert control_ids == [f"MSG{k}{n}" for k in range(3) for n in range(5)]
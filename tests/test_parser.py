@@ -1,11 +1,13 @@
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pytest
 
 # Add the src directory to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from src.parser.hl7_parser import HL7Parser
+from src.parser.hl7_parser import HL7Parser, parse
 
 def test_parse_text():
     """Test parsing an HL7 message from text"""
@@ -15,12 +17,12 @@ def test_parse_text():
     result = parser.parse_text(sample_hl7)
     assert result is True
     assert parser.message is not None
-    assert parser.message.name == "MSH"
+    assert parser.message.segment_names() == ["MSH"]
     
     structure = parser.get_structure()
     assert structure is not None
-    assert structure["name"] == "MSH"
-    assert len(structure["children"]) > 0
+    assert structure["children"][0]["raw_name"] == "MSH"
+    assert len(structure["children"][0]["children"]) > 0
 
 def test_invalid_message():
     """Test parsing an invalid HL7 message"""
@@ -30,4 +32,197 @@ def test_invalid_message():
         parser.parse_text("This is not an HL7 message")
         
     # Message should be None after failed parse
-    assert parser.message is None
\ No newline at end of file
+    assert parser.message is None
+
+def test_native_tokenizer_boundaries():
+    """Test that the native engine records every level of the hierarchy"""
+    parser = HL7Parser()
+    sample_hl7 = ("MSH|^~\\&|APP|FAC|||20230101120000||ORU^R01|MSG00002|P|2.5.1\r"
+                  "PID|1||12345^^^HOSP&1.2.3&ISO||DOE^JOHN\r"
+                  "OBX|1|NM|GLU||5.4")
+    parser.parse_text(sample_hl7)
+
+    message = parser.message
+    assert message.segment_names() == ["MSH", "PID", "OBX"]
+    assert message.field_value(0, 1) == "|"
+    assert message.field_value(0, 2) == "^~\\&"
+    assert message.field_value(0, 9) == "ORU^R01"
+    assert message.field_value(1, 5) == "DOE^JOHN"
+    assert message.field_value(2, 5) == "5.4"
+    assert message.field_value(2, 6) == ""
+
+    pid = parser.get_structure()["children"][1]
+    pid_3 = pid["children"][2]
+    assert pid_3["name"] == "PID-3"
+    assert pid_3["children"][3]["value"] == "HOSP&1.2.3&ISO"
+    assert [sub["value"] for sub in pid_3["children"][3]["children"]] == ["HOSP", "1.2.3", "ISO"]
+
+def test_hl7apy_engine_is_opt_in():
+    """Test that hl7apy is only used when requested"""
+    assert HL7Parser().engine == "native"
+    assert HL7Parser(engine="hl7apy").engine == "hl7apy"
+
+    with pytest.raises(ValueError):
+        HL7Parser(engine="unknown")
+
+def test_structure_is_lazy():
+    """Test that structure nodes only build children when they are read"""
+    parser = HL7Parser()
+    parser.parse_text("MSH|^~\\&|APP|FAC|||20230101120000||ADT^A01|MSG00003|P|2.5.1\r"
+                      "PID|1||12345||DOE^JOHN")
+    structure = parser.get_structure()
+
+    pid = structure["children"][1]
+    assert callable(pid._children)
+    assert pid.has_children
+    assert callable(pid._children)
+
+    pid_5 = pid["children"][4]
+    assert pid_5["name"] == "PID-5"
+    assert pid_5.get("description") == "Patient Name"
+    assert [component["value"] for component in pid_5["children"]] == ["DOE", "JOHN"]
+
+    msh_9 = structure["children"][0]["children"][8]
+    assert msh_9["description"].endswith("Admit/visit notification")
+    assert structure.to_dict()["children"][1]["children"][4]["value"] == "DOE^JOHN"
+
+def test_compact_message_views():
+    """Test the slot-based segment, field and component views"""
+    parser = HL7Parser()
+    parser.parse_text("MSH|^~\\&|APP|FAC|||20230101120000||ORU^R01|MSG00004|P|2.5.1\r"
+                      "OBX|1|CE|GLU^Glucose^LN||5.4")
+    message = parser.message
+
+    obx = message[1]
+    assert obx.name == "OBX"
+    assert obx["name"] == "OBX"
+    assert len(obx) == 5
+    assert obx[3].value == "GLU^Glucose^LN"
+    assert obx[3][2].value == "Glucose"
+    assert [field["value"] for field in obx["fields"]] == ["1", "CE", "GLU^Glucose^LN", "", "5.4"]
+    assert obx.field(9) is None
+    assert message.tokens.field_start.typecode == "I"
+    assert not hasattr(obx, "__dict__")
+
+def test_segment_terminators():
+    """Test \r, \n and \r\n terminators, also mixed within one message"""
+    segments = ["MSH|^~\\&|APP|FAC|||20230101120000||ADT^A01|MSG00005|P|2.4",
+                "EVN|A01|20230101120000",
+                "PID|1||12345||DOE^JOHN",
+                "PV1|1|I"]
+    for terminator in ("\r", "\n", "\r\n"):
+        parser = HL7Parser()
+        parser.parse_text(terminator.join(segments))
+        assert parser.message.segment_names() == ["MSH", "EVN", "PID", "PV1"]
+        assert parser._extract_version(parser.raw_message) == "2.4"
+
+    parser = HL7Parser()
+    parser.parse_text(segments[0] + "\r\n" + segments[1] + "\r" + segments[2] + "\n\n" + segments[3] + "\r")
+    assert parser.message.segment_names() == ["MSH", "EVN", "PID", "PV1"]
+    assert parser.message[2][5].value == "DOE^JOHN"
+    assert parser.message[3].value == "PV1|1|I"
+
+def test_tokenizer_paths_agree():
+    """Test that text with other line breaks, tokenized by the scan, gets the same fields"""
+    text = ("MSH|^~\\&|APP|FAC|||20230101120000||ADT^A01|MSG00006|P|2.4\r\n\r\n"
+            "NTE|1||A\x1cB|\rFHS|^~\\&\nBHS|^~\\&|X\rPID")
+    plain = text.replace("\x1c", "-")
+    for message in (parse(text), parse(text.encode())):
+        assert message.segment_names() == ["MSH", "NTE", "FHS", "BHS", "PID"]
+        expected = parse(plain)
+        for seg_index in range(5):
+            count = message.field_count(seg_index)
+            assert count == expected.field_count(seg_index)
+            assert ([message.field_value(seg_index, n).replace("\x1c", "-") for n in range(1, count + 1)]
+                    == [expected.field_value(seg_index, n) for n in range(1, count + 1)])
+    assert parse(text).field_value(1, 3) == "A\x1cB"
+
+def test_parse_file_keeps_carriage_returns(tmp_path):
+    """Test that files using \r terminators are split into segments"""
+    path = tmp_path / "message.hl7"
+    path.write_bytes(b"MSH|^~\\&|APP|FAC|||20230101120000||ADT^A01|MSG00006|P|2.5.1\rPID|1||12345\r")
+
+    parser = HL7Parser()
+    parser.parse_file(str(path))
+    assert parser.message.segment_names() == ["MSH", "PID"]
+
+def test_field_repetitions():
+    """Test that ~ repetitions form their own level and are split lazily"""
+    parser = HL7Parser()
+    parser.parse_text("MSH|^~\\&|APP|FAC|||20230101120000||ADT^A01|MSG00007|P|2.5.1\r"
+                      "PID|1||111^^^HOSP^MR~222^^^STATE&2.16&ISO^SS~333||DOE^JOHN")
+    message = parser.message
+    pid_3 = message[1][3]
+
+    # Nothing below the field level is split until it is asked for
+    assert message._repetitions == {}
+    assert [repeat.value for repeat in pid_3.repetitions] == [
+        "111^^^HOSP^MR", "222^^^STATE&2.16&ISO^SS", "333"]
+    assert message._values == {}
+    assert pid_3.repetition(2)[4].subcomponents == ["STATE", "2.16", "ISO"]
+    assert list(message._values) == [(pid_3.index, 1)]
+    assert pid_3[1].value == "111"
+    assert pid_3.repetition(4) is None
+
+    # MSH-2 contains the repetition character but is never split
+    assert message[0][2].repetitions[0].value == "^~\\&"
+
+    node = parser.get_structure()["children"][1]["children"][2]
+    assert [child["name"] for child in node["children"]] == ["PID-3[1]", "PID-3[2]", "PID-3[3]"]
+    repeat_2 = node["children"][1]
+    assert repeat_2["children"][0]["name"] == "PID-3[2].1"
+    assert repeat_2["children"][3]["children"][2]["value"] == "ISO"
+    assert not node["children"][2].has_children
+
+def stress_message(n):
+    return (f"MSH|^~\\&|LAB|HOSP|EHR|HOSP|20230101120000||ORU^R01|MSG{n:05d}|P|2.5.1\r"
+            f"PID|1||{n}^^^HOSP^MR~X{n}^^^OTHER^PI||DOE^JOHN^{n}\r"
+            + "\r".join(f"OBX|{i}|NM|718-7^Hemoglobin^LN||{n}.{i}|g/dL" for i in range(1, 20)))
+
+def read_all(message):
+    return (message.get("MSH-10"), message.get("PID-3[*].1"), message.get("OBX[*]-5"),
+            message.get("PID-5.3"), message.get_structure().to_dict())
+
+def test_stateless_parse():
+    """Test that parse() returns immutable messages and leaves a parser unchanged"""
+    text = stress_message(1)
+    message = parse(text.encode())
+    assert message.get("PID-3[*].4") == ["HOSP", "OTHER"]
+    assert read_all(parse(text)) == read_all(message)
+    with pytest.raises(AttributeError):
+        message.raw_text = "MSH|^~\\&|"
+    with pytest.raises(AttributeError):
+        del message.tokens
+    parser = HL7Parser(projection={"MSH": [10]})
+    assert parser.parse(text).get("MSH-10") == "MSG00001"
+    assert parser.message is None and parser.raw_message is None
+    with pytest.raises(ValueError):
+        parse(b"  PID|1")
+    with pytest.raises(ValueError):
+        HL7Parser(engine="hl7apy").parse(text)
+
+def test_parse_thread_safety_stress():
+    """Test many threads parsing with one parser and reading shared messages at once"""
+    parser = HL7Parser()
+    texts = [stress_message(n) for n in range(16)]
+    expected = [read_all(parse(text)) for text in texts]
+    # Every thread reads the same messages while their lazy caches fill
+    shared = [parse(text.encode()) for text in texts]
+    barrier = threading.Barrier(4)
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-4)
+    try:
+        def work(worker):
+            barrier.wait()
+            results = []
+            for n in range(len(texts)):
+                n = (n + worker * 4) % len(texts)
+                results.append((n, read_all(parser.parse(texts[n])), read_all(shared[n])))
+            return results
+
+        with ThreadPoolExecutor(4) as executor:
+            for results in executor.map(work, range(4)):
+                for n, own, common in results:
+                    assert own == common == expected[n]
+    finally:
+        sys.setswitchinterval(interval)
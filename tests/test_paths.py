@@ -0,0 +1,62 @@
+import os
+import sys
+import pytest
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.hl7_parser import HL7Parser
+from src.parser.paths import compile_path
+
+SAMPLE = ("MSH|^~\\&|APP|FAC|||20230101120000||ADT^A01|MSG00001|P|2.5.1\r"
+          "PID|1||111^^^HOSP^MR~222^^^STATE&2.16&ISO^SS||DOE^JOHN\\T\\JR\r"
+          "OBX|1|NM|718-7^Hemoglobin^LN||13.5\r"
+          "OBX|2|NM|4544-3^Hematocrit^LN||41\r"
+          "OBX|3|ST|8867-4^Heart rate^LN")
+
+@pytest.fixture
+def message():
+    parser = HL7Parser()
+    parser.parse_text(SAMPLE)
+    return parser.message
+
+def test_get_paths(message):
+    """Test reading fields, components and subcomponents by path"""
+    assert message.get("MSH-9.2") == "A01"
+    assert message.get("MSH-12") == "2.5.1"
+    assert message.get("PID-5.1") == "DOE"
+    assert message.get("PID-5.2") == "JOHN&JR"
+    assert message.get("PID-5") == "DOE^JOHN\\T\\JR"
+    assert message.get("PID-3.1") == "111"
+    assert message.get("PID-3[2].4.3") == "ISO"
+    assert message.get("OBX[2]-3.2") == "Hematocrit"
+    # MSH-1 and MSH-2 are returned whole
+    assert message.get("MSH-1") == "|"
+    assert message.get("MSH-2") == "^~\\&"
+
+def test_get_wildcards(message):
+    """Test that [*] returns one entry per segment or repetition"""
+    assert message.get("PID-3[*].1") == ["111", "222"]
+    assert message.get("OBX[*]-5") == ["13.5", "41", None]
+    assert message.get("OBX[*]-3.1") == ["718-7", "4544-3", "8867-4"]
+    assert message.get("NTE[*]-3") == []
+
+def test_get_missing(message):
+    """Test that absent segments and positions read as the default"""
+    assert message.get("NTE-3") is None
+    assert message.get("OBX[4]-5") is None
+    assert message.get("PID-3[3].1") is None
+    assert message.get("PID-5.7", default="") == ""
+    assert message.get("PID-40") is None
+
+def test_compiled_paths_are_cached(message):
+    """Test that paths compile once and reject bad syntax"""
+    path = compile_path("OBX[2]-5")
+    assert compile_path("OBX[2]-5") is path
+    assert path(message) == "41"
+    # No structure tree or sub-field caches are needed
+    assert message._values == {} and message._repetitions == {}
+
+    for bad in ("PID", "PID-0", "PID.5", "OBX[0]-5", "pid-5"):
+        with pytest.raises(ValueError):
+            compile_path(bad)
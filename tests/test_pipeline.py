@@ -0,0 +1,77 @@
+import io
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import pytest
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.pipeline import Pipeline
+from src.parser.sinks import Sink, JsonlSink, CsvSink, SqliteSink
+from conftest import build_message, build_batch
+
+def build_admission(n):
+    return build_message(n, f"ADT^A0{n % 3 + 1}")
+
+@pytest.mark.parametrize("parse_workers", [1, 3])
+def test_pipeline_to_jsonl(parse_workers):
+    """Test the four stages end to end, with small batches and queues"""
+    output = io.StringIO()
+    source = io.BytesIO(build_batch(500, build_admission).encode())
+    pipeline = Pipeline(source, JsonlSink(output), fields=["MSH-10", "PID-3[*].1"],
+                        parse_workers=parse_workers, transform_workers=2, batch_size=7, queue_size=2)
+    stats = pipeline.run()
+    rows = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert sorted(row["MSH-10"] for row in rows) == [f"MSG{n:04d}" for n in range(500)]
+    assert {"MSH-10": "MSG0002", "PID-3[*].1": ["2", "X2"]} in rows
+    assert stats.records == stats.messages == stats.rows == 500
+
+def test_pipeline_transforms_and_sqlite(tmp_path):
+    """Test dropping and reshaping messages, directory sources and the SQLite sink"""
+    for k in range(2):
+        (tmp_path / f"{k}.hl7").write_bytes(build_batch(30, build_admission).encode())
+
+    def admissions_only(message):
+        return message if message.get("MSH-9.2") == "A01" else None
+
+    def to_row(message):
+        return {"control_id": message.get("MSH-10"), "ids": message.get("PID-3[*].1")}
+
+    database = str(tmp_path / "out.db")
+    with SqliteSink(database, table="admissions") as sink:
+        stats = Pipeline(str(tmp_path), sink, [admissions_only, to_row], batch_size=4).run()
+    assert stats.rows == 20 and stats.dropped == 40
+    with sqlite3.connect(database) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM admissions").fetchone() == (20,)
+        assert connection.execute("SELECT ids FROM admissions WHERE control_id = 'MSG0003' LIMIT 1").fetchone() == ("3~X3",)
+
+def test_pipeline_csv_from_socket_and_errors():
+    """Test a socket source, the CSV sink and failing transforms"""
+    left, right = socket.socketpair()
+    data = b"".join(b"\x0b" + build_message(n).encode() + b"\x1c\r" for n in range(5))
+    writer = threading.Thread(target=lambda: (right.sendall(data), right.close()))
+    writer.start()
+    output = io.StringIO()
+    Pipeline(left, CsvSink(output), fields=["MSH-10", "PID-5.2"]).run()
+    writer.join()
+    left.close()
+    assert output.getvalue().splitlines() == ["MSH-10,PID-5.2"] + [f"MSG{n:04d},JOHN" for n in range(5)]
+
+    def fail(message):
+        raise RuntimeError("transform failed")
+    with pytest.raises(RuntimeError):
+        Pipeline(io.BytesIO(build_batch(100, build_admission).encode()), JsonlSink(io.StringIO()), [fail],
+                 batch_size=1, queue_size=1).run()
+
+def test_sink_subclasses_must_write_batches():
+    """Test that Sink is abstract until write_batch() is implemented"""
+    class Incomplete(Sink):
+        pass
+    with pytest.raises(TypeError):
+        Incomplete()
+    with pytest.raises(TypeError):
+        Sink()
@@ -0,0 +1,68 @@
+import os
+import sys
+import pytest
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.hl7_parser import HL7Parser
+from src.parser.projection import Projection
+from src.parser.tokenizer import tokenize
+
+SAMPLE = ("MSH|^~\\&|LAB|HOSP|EHR|HOSP|20230101120000||ORU^R01|MSG00001|P|2.5.1\r"
+          "PID|1||12345^^^HOSP^MR||DOE^JOHN||19700101|M\r\n"
+          "OBR|1|ORD123|FIL456|CBC^Complete Blood Count^LN\n"
+          "OBX|1|NM|718-7^Hemoglobin^LN||13.5|g/dL\r"
+          "NTE|1||Comment\r"
+          "OBX|2|NM|4544-3^Hematocrit^LN||41|%")
+
+def test_projection_parses_requested_fields():
+    """Test that a projection keeps only the listed segments and fields"""
+    parser = HL7Parser(projection={"MSH": [7, 9, 10], "PID": [3, 5], "OBX": [3, 5]})
+    parser.parse_text(SAMPLE)
+    message = parser.message
+
+    assert message.segment_names() == ["MSH", "PID", "OBX", "OBX"]
+    assert message.get("MSH-9.2") == "R01"
+    assert message.get("MSH-10") == "MSG00001"
+    assert message.get("PID-3.1") == "12345"
+    assert message.get("PID-5.2") == "JOHN"
+    assert message.get("OBX[*]-5") == ["13.5", "41"]
+    # Fields left out of the projection read as the default, wherever they are
+    assert message.get("PID-4") is None
+    assert message.get("PID-4", "n/a") == "n/a"
+    assert message.get("PID-4.1", "n/a") == "n/a"
+    assert message.get("OBX[*]-4", "n/a") == ["n/a", "n/a"]
+    assert message.get("PID-7") is None
+    assert message.get("OBX-6") is None
+    assert message.get("OBR-4") is None
+    # MSH-1 and MSH-2 are always kept
+    assert message.get("MSH-2") == "^~\\&"
+    assert message.field_count(1) == 5
+
+def test_projection_all_fields():
+    """Test that None keeps every field of a segment"""
+    parser = HL7Parser(projection={"NTE": None})
+    parser.parse_text(SAMPLE)
+    assert parser.message.segment_names() == ["NTE"]
+    assert parser.message.get("NTE-3") == "Comment"
+    assert parser.message.get("NTE-2", "n/a") == ""
+
+def test_projection_other_line_breaks():
+    """Test segment skipping when the text holds other splitlines() breaks"""
+    text = SAMPLE.replace("Comment", "Com\x1cment")
+    projection = Projection({"NTE": [3], "OBX": [5]})
+    tokens = tokenize(text, projection=projection)
+    names = [text[tokens.field_start[f]:tokens.field_end[f]] for f in tokens.segment_first[:-1]]
+    assert names == ["OBX", "NTE", "OBX"]
+    nte_3 = tokens.segment_first[1] + 3
+    assert text[tokens.field_start[nte_3]:tokens.field_end[nte_3]] == "Com\x1cment"
+
+def test_invalid_projection():
+    """Test projection validation"""
+    with pytest.raises(ValueError):
+        HL7Parser(projection={"PID": [0]})
+    with pytest.raises(ValueError):
+        HL7Parser(projection={"PID1": [1]})
+    with pytest.raises(ValueError):
+        HL7Parser(engine="hl7apy", projection={"PID": [3]})
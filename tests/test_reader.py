@@ -0,0 +1,52 @@
+import io
+import os
+import sys
+import pytest
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.reader import iter_messages
+from conftest import build_batch
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 64, 1 << 20])
+def test_iter_messages_across_chunks(chunk_size):
+    """Test splitting a batch file on MSH boundaries at any chunk size"""
+    reader = iter_messages(io.BytesIO(build_batch(25).encode()), chunk_size=chunk_size)
+    messages = list(reader)
+
+    assert [message.get("MSH-10") for message in messages] == [f"MSG{n:04d}" for n in range(25)]
+    assert all(message.segment_names() == ["MSH", "PID", "OBX"] for message in messages)
+    assert reader.message_count == 25
+    assert reader.batch_count == 1
+    assert reader.file_header.get("FHS-3") == "LAB"
+    assert reader.batch_header.get("BHS-11") == "BATCH1"
+    assert reader.batch_trailer.get("BTS-1") == "25"
+    assert reader.file_trailer.get("FTS-1") == "1"
+
+def test_iter_messages_large_record_in_small_chunks():
+    """Test a message spanning thousands of chunks, followed by another one"""
+    obx = "".join(f"\rOBX|{n}|NM|718-7^Hemoglobin^LN||13.{n % 10}|g/dL" for n in range(5000))
+    batch = build_batch(3).replace("MSG0000|P|2.5.1", "MSG0000|P|2.5.1" + obx, 1)
+    messages = list(iter_messages(io.BytesIO(batch.encode()), chunk_size=64))
+    assert [len(message) for message in messages] == [5003, 3, 3]
+    assert messages[0].get("OBX[5000]-5") == "13.9"
+    assert messages[1].get("MSH-10") == "MSG0001"
+
+def test_iter_messages_from_path(tmp_path):
+    """Test reading a file path with \\n terminators and MLLP framing"""
+    text = build_batch(3).replace("\r", "\n")
+    path = tmp_path / "batch.hl7"
+    path.write_bytes(b"\x0b" + text.encode() + b"\x1c\r")
+
+    reader = iter_messages(str(path), chunk_size=16, projection={"PID": [3]})
+    assert [message.get("PID-3.1") for message in reader] == ["0", "1", "2"]
+    assert reader.file_trailer is not None
+
+def test_iter_messages_text_stream():
+    """Test that text streams yield text messages and junk is skipped"""
+    reader = iter_messages(io.StringIO("garbage line\n" + build_batch(2)), chunk_size=7)
+    messages = list(reader)
+    assert [message.get("MSH-10") for message in messages] == ["MSG0000", "MSG0001"]
+    assert isinstance(messages[0].raw_text, str)
+    assert reader.skipped == 1
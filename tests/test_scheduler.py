@@ -0,0 +1,162 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import CancelledError
+
+import pytest
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.scheduler import (Scheduler, Cancelled, CancellationToken, checkpoint, yielding,
+                                  INTERACTIVE, BATCH)
+
+def test_batch_jobs_yield_to_interactive_jobs():
+    """Test that a batch job pauses at checkpoints while an interactive job runs"""
+    progress = []
+    interactive_started = threading.Event()
+    release = threading.Event()
+
+    def bulk():
+        for n in yielding(range(10 ** 8)):
+            progress.append(n)
+            if n == 1000:
+                interactive = scheduler.submit(waiting, priority=INTERACTIVE)
+                assert interactive_started.wait(5)
+                paused_at = len(progress)
+                time.sleep(0.05)
+                release.set()
+                interactive.result()
+                return paused_at
+
+    def waiting():
+        interactive_started.set()
+        assert release.wait(5)
+        return "done"
+
+    with Scheduler(workers=1) as scheduler:
+        # The bulk job itself checks while running: it has no checkpoint
+        # between submitting and waiting, so it pauses at the next item
+        assert scheduler.submit(bulk).result() == 1001
+        stats = scheduler.stats
+    assert stats["interactive"].completed == 1 and stats["batch"].completed == 1
+    assert stats["interactive"].queued == stats["interactive"].running == 0
+
+def test_interactive_jobs_go_first():
+    """Test that queued interactive jobs run before queued batch jobs"""
+    order = []
+    started, gate = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        gate.wait(5)
+
+    with Scheduler(workers=1) as scheduler:
+        blocker = scheduler.submit(block)
+        assert started.wait(5)
+        batch = [scheduler.submit(order.append, f"batch{n}") for n in range(3)]
+        assert scheduler.stats["batch"].queued == 3
+        scheduler.run(order.append, "interactive")
+        gate.set()
+        for job in [blocker] + batch:
+            job.result()
+    assert order == ["interactive", "batch0", "batch1", "batch2"]
+    with pytest.raises(RuntimeError):
+        scheduler.submit(order.append, "late")
+
+def test_cancellation_and_supersede():
+    """Test that a key supersedes the earlier job and tokens stop running jobs"""
+    token = CancellationToken()
+    running = threading.Event()
+
+    def long_job():
+        running.set()
+        while True:
+            checkpoint()
+            time.sleep(0.001)
+
+    with Scheduler(workers=1) as scheduler:
+        first = scheduler.submit(long_job, token=token)
+        assert running.wait(5)
+        queued = scheduler.submit(str, "old", key="doc")
+        latest = scheduler.submit(str, "new", key="doc")
+        assert queued.cancelled()
+        token.cancel()
+        with pytest.raises(Cancelled):
+            first.result(5)
+        assert latest.result(5) == "new"
+        with pytest.raises(CancelledError):
+            queued.result()
+        stats = scheduler.stats["batch"]
+    assert stats.cancelled == 2 and stats.completed == 1
+    assert stats.max_wait_ms >= stats.mean_wait_ms > 0
+    # Outside a job a checkpoint does nothing
+    checkpoint()
+    assert BATCH > INTERACTIVE
+
+def test_supersede_leaves_shared_token_alone():
+    """Test that superseding a job does not cancel the token it shares with others"""
+    token = CancellationToken()
+    running = threading.Event()
+    release = threading.Event()
+
+    def wait_for_release():
+        running.set()
+        while not release.is_set():
+            checkpoint()
+            time.sleep(0.001)
+        return "done"
+
+    with Scheduler(workers=1) as scheduler:
+        sibling = scheduler.submit(wait_for_release, token=token)
+        assert running.wait(5)
+        old = scheduler.submit(str, "old", key="doc", token=token)
+        new = scheduler.submit(str, "new", key="doc", token=token)
+        assert old.cancelled() and not token.cancelled
+        release.set()
+        assert sibling.result(5) == "done"
+        assert new.result(5) == "new"
+
+        # A running job stops at its next checkpoint once superseded
+        running.clear()
+        release.clear()
+        looping = scheduler.submit(wait_for_release, key="loop", token=token)
+        assert running.wait(5)
+        replacement = scheduler.submit(str, "replacement", key="loop", token=token)
+        with pytest.raises(Cancelled):
+            looping.result(5)
+        assert replacement.result(5) == "replacement" and not token.cancelled
+
+@pytest.mark.parametrize("through_token", [False, True])
+def test_cancel_wakes_paused_batch_job(through_token):
+    """Test that a batch job paused for an interactive job stops as soon as it is cancelled"""
+    token = CancellationToken()
+    bulk_running, interactive_started, release = threading.Event(), threading.Event(), threading.Event()
+
+    def bulk():
+        bulk_running.set()
+        while True:
+            checkpoint()
+            time.sleep(0.001)
+
+    def waiting():
+        interactive_started.set()
+        release.wait(5)
+
+    with Scheduler(workers=1) as scheduler:
+        job = scheduler.submit(bulk, token=token)
+        assert bulk_running.wait(5)
+        interactive = scheduler.submit(waiting, priority=INTERACTIVE)
+        assert interactive_started.wait(5)
+        time.sleep(0.05)
+        if through_token:
+            token.cancel()
+        else:
+            job.cancel()
+        with pytest.raises(Cancelled):
+            job.result(2)
+        assert not interactive.done()
+        release.set()
+        interactive.result(5)
+
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import signal
+import socket
+import sys
+import tempfile
+
+import pytest
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.pools import server_pool, shutdown_pool
+from src.parser.service import ParseService
+from src.utils.parse_client import ParseClient, is_running, parse_address
+
+MESSAGE = b"MSH|^~\\&|ADT|HOSP|LAB|HOSP|20230101120000||ADT^A01|MSG1|P|2.5.1\rPID|1||42^^^HOSP^MR||DOE^JOHN"
+
+def with_service(client_calls, **options):
+    """Run a ParseService and call client_calls(address) from a thread"""
+    async def main():
+        async with ParseService(**options) as service:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(None, client_calls, service.address)
+            return service, result
+    return asyncio.run(main())
+
+def test_parse_over_keep_alive():
+    """Test parsing, errors and health over one keep-alive TCP connection"""
+    def calls(address):
+        with ParseClient(address) as client:
+            structures = [client.parse(MESSAGE), client.parse(MESSAGE.decode())]
+            with pytest.raises(ValueError, match="must start with an MSH segment"):
+                client.parse(b"PID|1||42")
+            with pytest.raises(ValueError, match="No such endpoint"):
+                client._request("GET", "/nothing")
+            sock = client.connection.sock
+            health = client.health()
+            # Still the same connection
+            assert client.connection.sock is sock
+        return structures, health
+
+    service, (structures, health) = with_service(calls, port=0)
+    assert structures[0] == structures[1]
+    root = structures[0]
+    assert root["name"] == "Message"
+    assert [segment["name"] for segment in root["children"]] == ["MSH", "PID"]
+    pid = root["children"][1]
+    assert pid["description"] == "Patient Identification"
+    assert pid["children"][2]["value"] == "42^^^HOSP^MR"
+    assert health["requests"] == 4 and health["errors"] == 2
+    assert service.requests == 5 and service.connections == 0
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs Unix sockets")
+def test_unix_socket_with_workers():
+    """Test a warm process pool behind a Unix socket, replacing a stale socket file"""
+    path = os.path.join(tempfile.mkdtemp(), "hl7parser.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    assert parse_address("unix:" + path) == ("unix", path)
+    assert not is_running("unix:" + path)
+
+    def calls(address):
+        with ParseClient(address) as client:
+            return [client.parse(MESSAGE)["children"][0]["name"] for _ in range(3)], is_running(address)
+
+    service, (names, running) = with_service(calls, path=path, workers=1)
+    assert names == ["MSH"] * 3 and running
+    assert not os.path.exists(path)
+
+def test_server_pool_workers_ignore_interrupts():
+    """Test that Ctrl-C is left to the parent, which shuts the pool down"""
+    executor = server_pool(1, int)
+    try:
+        assert executor.submit(signal.getsignal, signal.SIGINT).result(30) == signal.SIG_IGN
+    finally:
+        shutdown_pool(executor)
+    assert signal.getsignal(signal.SIGINT) is not signal.SIG_IGN
+
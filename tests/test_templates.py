@@ -0,0 +1,42 @@
+import os
+import sys
+
+# Add the src directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.parser.hl7_parser import parse
+from src.parser.templates import structure_template, template_cache_info, clear_template_cache
+
+MESSAGE = ("MSH|^~\\&|ADT|HOSP|LAB|HOSP|20230101120000||ADT^A01|MSG%d|P|2.5.1\r"
+           "PID|1||%d^^^HOSP^MR~X%d^^^O^PI||DOE^JOHN\rPID|2||7")
+
+def test_templates_are_shared_by_shape():
+    """Test that messages of the same shape share one template and get their own values"""
+    clear_template_cache()
+    messages = [parse(MESSAGE % (n, n, n)) for n in range(5)]
+    templates = {id(structure_template(m, m.segment_names())) for m in messages}
+    assert len(templates) == 1
+    info = template_cache_info()
+    assert (info.hits, info.misses) == (4, 1)
+
+    structures = [m.get_structure() for m in messages]
+    assert structures[3]["children"][1]["children"][2]["children"][0]["value"] == "3^^^HOSP^MR"
+    # Another message type is another shape
+    other = parse((MESSAGE % (9, 9, 9)).replace("ADT^A01", "ADT^A08"))
+    assert structure_template(other, other.segment_names()) is not structure_template(
+        messages[0], messages[0].segment_names())
+
+def test_template_names_and_descriptions():
+    """Test node names, descriptions and leaves built from a template"""
+    root = parse(MESSAGE % (1, 1, 1)).get_structure()
+    msh, pid, pid2 = root.children
+    assert [msh.name, pid.name, pid2.name] == ["MSH", "PID #1", "PID #2"]
+    assert pid.description == "Patient Identification"
+    assert msh.children[8].description == "Message Type - Admit/visit notification"
+    pid3 = pid.children[2]
+    assert [node.name for node in pid3.children] == ["PID-3[1]", "PID-3[2]"]
+    assert pid3.children[1].children[3].name == "PID-3[2].4"
+    assert pid3.children[1].children[3].description == "Component 4"
+    # A field without separators is a leaf
+    set_id = pid2.children[0]
+    assert set_id.value == "2" and not set_id.has_children and set_id.children == []